@@ -14,18 +14,35 @@ import pyudev
 import threading
 import time
 import os
-import shutil
 import datetime
-import filecmp
 import json
-from collections import defaultdict
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import make_server, WSGIServer, WSGIRequestHandler
+
+from fileindex import FileIndex, ScanCache
+from copyengine import CopyEngine, removeTempFiles
+from manifest import MANIFEST, ManifestWriter
+from usbmonitor import EventMonitorThread
+from store import ContentStore
+from journal import JOURNALDIR, BackupJournal
+from jobs import DiskLimits, JobManager
 
 import bottle
 from bottle import get,request,run, redirect, response, template
 
 BACKDIR=os.path.expanduser('~/backup') # parent directory for individual subdirectories
+COPYWORKERS=4 # number of threads copying files in parallel for each backup
+MAXJOBS=4 # number of devices backed up at once, more are queued
+DISKWORKERS=4 # number of files copied to a destination disk at once by all backups
+HASHCOPIES=True # hash files as they're copied, set to False to copy in the kernel and leave hashing to the index
+USESTORE=False # store file contents once in BACKDIR/.store with backup directories made of hardlinks to them
+EVENTINTERVAL=0.25 # minimum seconds between status events pushed to the browser
+USBEVENTS=True # detect USB devices from udev and mount table events, set to False to poll every second instead
 
 context = pyudev.Context()
+store=None # content store shared by all backups, created when first used if USESTORE is True
+storeLock=threading.Lock()
+diskLimits=DiskLimits(DISKWORKERS)
 
 def getSaveDir(root):
     '''Get a date-stamped save directory path rooted at `root'.'''
@@ -39,21 +56,98 @@ def enumAllFiles(rootdir):
             yield os.path.join(root,f)
             
 
-def getUnfoundFiles(src,dest):
-    '''Return files found in `src' not present in `dest'.'''
-    destfiles=defaultdict(list)
-    srcfiles=[]
-    
-    for destfile in enumAllFiles(dest):
-        base=os.path.basename(destfile)
-        destfiles[base].append(destfile)
+def getIndexFile(dest):
+    '''Get the path of the content index file for destination directory `dest', stored in BACKDIR/.index.'''
+    return os.path.join(BACKDIR,'.index',os.path.basename(dest)+'.sqlite')
+
+
+def openIndex(dest):
+    '''Open the content index for `dest', building it from the directory's contents if new.'''
+    index=FileIndex(getIndexFile(dest))
+    if len(index)==0:
+        print('Indexing',dest,'added %i, removed %i'%index.sync(dest,{MANIFEST}))
+
+    return index
+
+
+def getStore():
+    '''Get the content store in BACKDIR/.store if USESTORE is True, otherwise None.'''
+    global store
+    with storeLock:
+        if USESTORE and store is None:
+            store=ContentStore(os.path.join(BACKDIR,'.store'))
         
-    for srcfile in enumAllFiles(src):
-        base=os.path.basename(srcfile)
-        if base not in destfiles or not any(filecmp.cmp(srcfile,d) for d in destfiles[base]):
-            srcfiles.append(srcfile)
+    return store
+
+
+def getJournalFile(dest):
+    '''Get the path of the journal file of backup runs to destination directory `dest', stored in BACKDIR/.journal.'''
+    return os.path.join(BACKDIR,JOURNALDIR,os.path.basename(dest)+'.jsonl')
+
+
+def listInterruptedRuns():
+    '''Returns the journals of interrupted backup runs whose source directories are present, which can be resumed.'''
+    journaldir=os.path.join(BACKDIR,JOURNALDIR)
+    result=[]
+    
+    for f in sorted(os.listdir(journaldir)) if os.path.isdir(journaldir) else []:
+        journal=BackupJournal(os.path.join(journaldir,f))
+        if journal.isInterrupted() and os.path.isdir(journal.info['src']):
+            result.append(journal)
             
-    return srcfiles
+    return result
+
+
+def getDeviceID(mountpoint):
+    '''Get the filesystem UUID or label of the device mounted at `mountpoint', or its directory name if neither is known.'''
+    for p in psutil.disk_partitions():
+        if p.mountpoint==mountpoint:
+            try:
+                props=pyudev.Devices.from_device_file(context,p.device).properties
+                return props.get('ID_FS_UUID') or props.get('ID_FS_LABEL') or os.path.basename(mountpoint)
+            except Exception:
+                break
+            
+    return os.path.basename(mountpoint)
+
+
+def getScanCacheFile(deviceid):
+    '''Get the path of the scan cache file for the source device `deviceid', stored in BACKDIR/.scancache.'''
+    return os.path.join(BACKDIR,'.scancache',deviceid+'.sqlite')
+
+
+def iterUnfoundFiles(src,dest,index=None,cache=None,verify=False,skip=()):
+    '''
+    Yields each file found in `src' not present in `dest' with its size, looking up their contents in the index of 
+    `dest'. If the scan cache `cache' is given files recorded in it with unchanged size and mtime are skipped without 
+    being read unless `verify' is True, and files found in `dest' are recorded in it. Files in `skip' are skipped. An
+    index opened here because `index' is None is closed when done.
+    '''
+    opened=index is None
+    index=openIndex(dest) if opened else index
+    
+    try:
+        for srcfile in enumAllFiles(src):
+            if srcfile in skip:
+                continue
+                
+            st=os.stat(srcfile)
+            if cache is not None and not verify and cache.isUnchanged(srcfile,st):
+                continue
+                
+            found,_,full=index.match(srcfile,st.st_size)
+            if found is None:
+                yield srcfile,st.st_size
+            elif cache is not None:
+                cache.addFile(srcfile,full,st)
+    finally:
+        if opened:
+            index.close()
+            
+            
+def getUnfoundFiles(src,dest,index=None,cache=None,verify=False):
+    '''Return files found in `src' not present in `dest', see iterUnfoundFiles.'''
+    return [f for f,_ in iterUnfoundFiles(src,dest,index,cache,verify)]
                 
 
 def listUSBMountpoints():
@@ -78,68 +172,306 @@ class BackupThread(threading.Thread):
     Backup processing thread. This performs the steps of 1) searching the source device for files compared to the 
     destination, 2) listing the files found to copy, 3) copying the files and keeping track of progress, and reporting 
     any errors. Status is represented in the members which state where in the process the thread is and progress.
+    Files are counted as they are found, and if `confirm' is called before the search completes copying starts then with
+    files found later copied as they are found. Progress is recorded in a journal once copying starts, and passing the 
+    journal `journal' of an interrupted run resumes it, copying the remaining files to its save directory and only 
+    searching again for files not already in the journal if its search didn't finish.
     '''
     IDLE=0 # doing nothing
     SEARCH=1 # searching source device for files to backup
     DONESEARCH=2 # search done, waiting on waitEvent to trigger
-    BACKUP=3 # doing the backup now
+    BACKUP=3 # doing the backup now, the search may still be running if `searching' is True
     DONEBACKUP=4 # backup down
     ERROR=5 # error encountered, exc has exception
+    CANCELLED=6 # backup cancelled by `abort'
     
-    def __init__(self,src,dest):
+    def __init__(self,src,dest,deviceid=None,verify=False,journal=None):
         super(BackupThread,self).__init__()
         self.src=src # source directory
         self.dest=dest # destination root directory
+        self.deviceid=deviceid # source device ID naming its scan cache, no cache is used if None
+        self.verify=verify # if True files are read and compared even if the scan cache says they are backed up
+        self.engine=None # copy engine used once copying starts
         self.status=self.IDLE # current status
-        self.numFiles=0 # number of files to copy
+        self.searching=True # True until the search has finished
+        self.srcfiles=[] # files found to copy with their sizes
+        self.numFiles=0 # number of files to copy found so far
+        self.bytesFound=0 # total size of files to copy found so far
         self.currentFile=None # current file being copied
         self.numCopied=0 # number of files copied
+        self.bytesCopied=0 # total size of files copied
+        self.bytesResumed=0 # total size of files copied before this run was resumed
+        self.times={} # maps phase names to their start and end times, end is None while in progress
+        self.version=0 # incremented when progress changes
+        self.index=None # content index of the destination
+        self.cache=None # scan cache of the source device
+        self.destdir=None # save directory files are copied to
+        self.manifest=None # manifest of the files copied to destdir
+        self.journal=journal # journal of this run, given if resuming an interrupted run
+        self.resuming=journal is not None # True if resuming the run of `journal'
+        self.lock=threading.RLock()
+        self.changed=threading.Condition(self.lock) # notified when progress changes
         self.waitEvent=threading.Event() # once files are found the thread waits in this event before copying
         self.exc=None # raised exception
         self.doCopy=True # set this to False before setting the event to abort
+        self.confirmed=False # set by `confirm', if True before the search starts copying starts with it
+        self.onDone=None # called with this thread when it finishes
         self.daemon=True # make this a daemon thread
         
     def abort(self):
-        '''Abort the copy thread if the search has completed.'''
-        if self.status==self.DONESEARCH:
+        '''Abort the backup, stopping the search if it's running and files being copied mid-copy.'''
+        with self.lock:
             self.doCopy=False
-            self.waitEvent.set()
+            if self.status==self.IDLE:
+                self.status=self.CANCELLED
+            if self.engine is not None:
+                self.engine.abort()
+            self._notify()
+                
+        self.waitEvent.set()
+            
+    def _startPhase(self,name):
+        with self.lock:
+            self.times[name]=[time.monotonic(),None]
+            
+    def _endPhase(self,name):
+        with self.lock:
+            if name in self.times and self.times[name][1] is None:
+                self.times[name][1]=time.monotonic()
+                
+    def _notify(self):
+        '''Notify waiting threads of changed progress, must be called with the lock held.'''
+        self.version+=1
+        self.changed.notify_all()
+        
+    def waitChanged(self,version,timeout=None):
+        '''Wait until progress changes from snapshot version `version' or `timeout' seconds pass.'''
+        with self.changed:
+            self.changed.wait_for(lambda:self.version!=version,timeout)
+            
+    def getStatusName(self):
+        if self.status==self.IDLE:
+            return 'Queued'
+        elif self.status==self.DONEBACKUP:
+            return 'Done'
+        elif self.status==self.CANCELLED:
+            return 'Cancelled'
+        elif self.status==self.SEARCH:
+            return 'Searching'
+        elif self.status==self.DONESEARCH:
+            return 'Searched Files'
+        elif self.status==self.ERROR:
+            return 'Error: %s'%self.exc
+        else:
+            return 'Backing up'
+            
+    def snapshot(self):
+        '''
+        Returns a consistent snapshot of the status and progress as a dictionary, including throughput in bytes per 
+        second, the estimated seconds until the files found so far are copied (None if not known), and the durations of
+        the search, wait, and copy phases so far.
+        '''
+        with self.lock:
+            now=time.monotonic()
+            timings={name:(end or now)-start for name,(start,end) in self.times.items()}
+            copyTime=timings.get('copy',0)
+            throughput=(self.bytesCopied-self.bytesResumed)/copyTime if copyTime>0 else 0.0
+            
+            return {
+                'status':self.getStatusName(),
+                'done':self.status in (self.DONEBACKUP,self.ERROR,self.CANCELLED),
+                'source':self.src,
+                'numcopied':self.numCopied,
+                'numfiles':self.numFiles,
+                'bytesfound':self.bytesFound,
+                'bytescopied':self.bytesCopied,
+                'searching':self.searching,
+                'currentfile':os.path.basename(self.currentFile or ''),
+                'throughput':throughput,
+                'eta':(self.bytesFound-self.bytesCopied)/throughput if throughput>0 else None,
+                'timings':timings,
+                'version':self.version,
+            }
+            
+    def confirm(self):
+        '''
+        Confirm the files found are to be copied, copying starts immediately if the search is still running or when it
+        starts if the thread is still queued.
+        '''
+        with self.lock:
+            self.confirmed=True
+            if self.status==self.SEARCH and self.index is not None and self.engine is None and self.doCopy:
+                self._startCopy()
+                
+        self.waitEvent.set()
+            
+    def _startCopy(self):
+        '''Start the copy engine copying to a new save directory or the resumed run's, queueing the files found so far.'''
+        if not self.resuming:
+            self.destdir=getSaveDir(self.dest)
+            self.journal=BackupJournal(getJournalFile(self.dest))
+            self.journal.start(self.src,self.dest,self.destdir,self.deviceid)
+        else:
+            self.destdir=self.journal.info['destdir']
+            print('Removed %i partial files'%removeTempFiles(self.destdir))
+            
+        print('Backing up to',self.destdir)
+        self._endPhase('wait')
+        self._startPhase('copy')
+        
+        def onCopied(src,dest,size,hashes):
+            partial,full=hashes or (None,None) # without hashing the index hashes files when it needs to compare them
+            st=os.stat(dest)
+            self.index.addFile(dest,partial,full)
+            self.manifest.add(dest,full,st)
+            if self.cache is not None:
+                self.cache.addFile(src,full)
+                
+            self.journal.fileCopied(src)
+                
+            with self.lock:
+                self.currentFile=src
+                self.numCopied+=1
+                self.bytesCopied+=size
+                self._notify()
+                print('Copied',src,'to',dest,self.numCopied,'/',self.numFiles)
+                
+        with self.lock:
+            self.manifest=ManifestWriter(self.destdir)
+            limiter=diskLimits.get(self.destdir)
+            self.engine=CopyEngine(COPYWORKERS,onCopied=onCopied,hashing=HASHCOPIES,store=getStore(),limiter=limiter)
+            self.engine.start()
+            self.status=self.BACKUP
+            if not self.doCopy: # aborted before the engine was created
+                self.engine.abort()
+            
+            for src,size in self.srcfiles:
+                self._queueCopy(src,size)
+                
+            if not self.searching:
+                self.journal.searchDone()
+            
+    def _queueCopy(self,src,size):
+        self.journal.addFile(src,size)
+        self.engine.add(src,os.path.join(self.destdir,os.path.relpath(src,self.src)),size)
         
     def run(self):
         try:
             print('Starting backup thread from',self.src,'to',self.dest)
             
-            self.status=self.SEARCH
-            srcfiles=getUnfoundFiles(self.src,self.dest)
-            self.numFiles=len(srcfiles)
+            with self.lock:
+                if self.status==self.IDLE: # may have been cancelled before starting
+                    self.status=self.SEARCH
+                    
+            self.index=openIndex(self.dest)
+            self.cache=ScanCache(getScanCacheFile(self.deviceid),self.src) if self.deviceid else None
+            
+            if self.resuming:
+                self._resume()
+            else:
+                with self.lock:
+                    if self.confirmed and self.engine is None and self.doCopy: # confirmed while queued
+                        self._startCopy()
+                
+            if self.searching:
+                self._startPhase('search')
+                
+            skip=self.journal.found if self.resuming else ()
+            files=iterUnfoundFiles(self.src,self.dest,self.index,self.cache,self.verify,skip) if self.searching else []
             
+            for src,size in files:
+                if not self.doCopy:
+                    break
+                    
+                with self.lock:
+                    self.srcfiles.append((src,size))
+                    self.numFiles+=1
+                    self.bytesFound+=size
+                    self._notify()
+                    
+                    if self.engine is not None: # copying started before the search finished
+                        self._queueCopy(src,size)
+                
+            self._endPhase('search')
+            with self.lock:
+                self.searching=False
+                self._notify()
+                if self.engine is None:
+                    self.status=self.DONESEARCH
+                    self._startPhase('wait')
+                elif self.doCopy:
+                    self.journal.searchDone()
+                    
             print('Num files to backup:',self.numFiles)
-            self.status=self.DONESEARCH
             
-            if self.numFiles>0:
+            if self.engine is None and self.numFiles>0:
                 self.waitEvent.wait()
                 
-                if not self.doCopy:
-                    self.status=self.DONEBACKUP
-                else:
-                    self.status=self.BACKUP
-                    destdir=getSaveDir(self.dest)
-                    print('Backing up to',destdir)
+                if self.doCopy:
+                    self._startCopy()
+                    
+            if self.engine is not None:
+                self.engine.finish()
+                try:
+                    self.engine.wait()
+                finally:
+                    self.manifest.close()
                     
-                    for i,src in enumerate(srcfiles):
-                        self.currentFile=src
-                        dest=os.path.join(destdir,os.path.relpath(src,self.src))
-                        
-                        print('Copying',src,'to',dest,i+1,'/',self.numFiles)
-                        os.makedirs(os.path.dirname(dest),exist_ok=True)
-                        shutil.copy2(src,dest)
-                        self.numCopied=i+1
+                self.journal.finish() # a cancelled run isn't resumed, files not copied are found again by the next run
                 
-            self.status=self.DONEBACKUP
-            print('Done')
+            self.status=self.DONEBACKUP if self.doCopy else self.CANCELLED
+            print('Done' if self.doCopy else 'Cancelled')
         except Exception as e:
-            self.exc=e
-            self.status=self.ERROR
+            with self.lock: # the engine can't be started by confirm once the status is an error
+                self.exc=e
+                self.status=self.ERROR
+                
+            if self.engine is not None:
+                self._stopEngine()
+        finally:
+            with self.lock:
+                self.searching=False
+                for name in list(self.times):
+                    self._endPhase(name)
+                self._notify()
+                
+            if self.journal is not None:
+                self.journal.close()
+                
+            # close the database connections, copying has stopped so nothing else uses them
+            if self.index is not None:
+                self.index.close()
+            if self.cache is not None:
+                self.cache.close()
+                
+            if self.onDone is not None:
+                self.onDone(self)
+            
+    def _stopEngine(self):
+        '''Stop the copy engine after an error, aborting copies in progress and waiting for its workers to exit.'''
+        self.engine.abort()
+        self.engine.finish()
+        try:
+            self.engine.wait()
+        except Exception:
+            pass # the error which stopped the run is reported instead
+        finally:
+            self.manifest.close()
+            
+    def _resume(self):
+        '''Resume the interrupted run recorded in the journal, copying its remaining files immediately.'''
+        with self.lock:
+            remaining=self.journal.remaining()
+            print('Resuming backup, %i files of %i remaining'%(len(remaining),len(self.journal.files)))
+            
+            self.searching=not self.journal.searched
+            self.srcfiles=remaining
+            self.numFiles=len(self.journal.files)
+            self.numCopied=self.numFiles-len(remaining)
+            self.bytesFound=sum(size for _,size in self.journal.files)
+            self.bytesCopied=self.bytesFound-sum(size for _,size in remaining)
+            self.bytesResumed=self.bytesCopied
+            self._startCopy()
         
 
 class USBMonitor(object):
@@ -180,10 +512,14 @@ class MonitorThread(threading.Thread,USBMonitor):
         USBMonitor.run(self)
         
         
-mon=MonitorThread()
+if USBEVENTS:
+    mon=EventMonitorThread(context)
+else:
+    mon=MonitorThread()
+    
 mon.start()
 
-backupThread=None
+jobs=JobManager(MAXJOBS)
 
 # save the template to file every time the script is run, the reloader will notice when changes are made to it this way
 with open('base.tpl','w') as o:
@@ -225,11 +561,21 @@ body{
 
 rootTemplate='''
 % rebase('base.tpl')
+% if snapshots:
+<h1>Backups:</h1>
+% for snap in snapshots:
+    <a href="/job/{{snap['id']}}">{{snap['source']}}: {{snap['status']}}</a><br/>
+% end
+% end
 <h1>Choose Backup Source:</h1>
 <form action="/choose" method="GET">
+% for journal in interrupted:
+    <a href="/resume?journal={{journal.filename}}">Resume backup from {{journal.info['src']}}</a><br/>
+% end
 % for i,m in enumerate(mounts):
     <input type="radio" name="mount" value="{{m}}" {{'checked="checked' if i==0 else ''}}>{{m}}<br/>
 % end
+<input type="checkbox" name="verify" value="1">Verify all files<br/>
 <input value="Choose Source" type="submit" />
 <br/>
 <br/>
@@ -243,110 +589,166 @@ progressTemplate='''
 <script>
 window.onload = function() {
   var elem = document.getElementById("progress");   
-  var id = setInterval(frame, 1000);
+  var source = new EventSource("/job/{{jobid}}/events");
   
-  function frame() {
-    var xmlhttp = new XMLHttpRequest();
-    xmlhttp.onreadystatechange = function() {
-        if (this.readyState == 4 && this.status == 200) {
-            var res = JSON.parse(this.responseText);
-            var numcopied=res.numcopied;
-            var numfiles=res.numfiles;
-            
-            if(numcopied==numfiles){
-                clearInterval(id);
-            }
-            
-            elem.innerHTML="<h1>Status: "+res.status+"</h1>";
-            elem.innerHTML+="<h2>Current File: "+res.currentfile+"</h2>";
-            elem.innerHTML+="<h2>Copied: "+String(numcopied)+" / "+String(numfiles)+"</h2>";
-            elem.innerHTML+="<h2><a href='/'>Home</a></h2>";
-        }
-    };
-    xmlhttp.open("GET", "/status", true);
-    xmlhttp.send();
-  }
+  source.onmessage = function(event) {
+    var res = JSON.parse(event.data);
+    var mb=(res.bytescopied/1e6).toFixed(1);
+    var rate=(res.throughput/1e6).toFixed(1);
+    var eta=res.eta===null ? "?" : String(Math.round(res.eta))+"s";
+    
+    if(res.done){
+        source.close();
+    }
+    
+    elem.innerHTML="<h1>Status: "+res.status+"</h1>";
+    elem.innerHTML+="<h2>Current File: "+res.currentfile+"</h2>";
+    elem.innerHTML+="<h2>Copied: "+String(res.numcopied)+" / "+String(res.numfiles)+(res.searching ? "+" : "")+"</h2>";
+    elem.innerHTML+="<h2>"+mb+" MB at "+rate+" MB/s, ETA "+eta+"</h2>";
+    elem.innerHTML+=res.done ? "" : "<h2><a href='/job/{{jobid}}/cancel'>Cancel</a></h2>";
+    elem.innerHTML+="<h2><a href='/'>Home</a></h2>";
+  };
 }
 </script>
 
 <div id='progress'>...</div>
 '''
 
-okCancelTemplate='''
+searchTemplate='''
 % rebase('base.tpl')
-<h1>Num files: {{numFiles}}</h1>
-% if numFiles > 0:
-    <form action="/start" method="GET">
-    <input value="OK" type="submit" />
-    </form>
-    <a href="/cancel">Cancel</a>
-% else:
-    <a href="/">Home</a>
-% end
+
+<script>
+window.onload = function() {
+  var elem = document.getElementById("found");
+  var buttons = document.getElementById("buttons");
+  var source = new EventSource("/job/{{jobid}}/events");
+  
+  source.onmessage = function(event) {
+    var res = JSON.parse(event.data);
+    var mb=(res.bytesfound/1e6).toFixed(1);
+    
+    if(res.status=="Queued"){
+        elem.innerHTML="<h1>Queued</h1>";
+        return;
+    }
+
+    elem.innerHTML="<h1>"+(res.searching ? "Searching..." : "Search Done")+"</h1>";
+    elem.innerHTML+="<h2>Files found: "+String(res.numfiles)+" ("+mb+" MB)</h2>";
+    
+    if(!res.searching){
+        source.close();
+        
+        if(res.numfiles==0){
+            buttons.innerHTML="<a href='/'>Home</a>";
+        }
+    }
+  };
+}
+</script>
+
+<div id='found'>...</div>
+<div id='buttons'>
+<form action="/job/{{jobid}}/start" method="GET">
+<input value="OK" type="submit" />
+</form>
+<a href="/job/{{jobid}}/cancel">Cancel</a>
+</div>
 '''
 
 
+def getJob(jobid):
+    '''Get the job `jobid', aborting the request with a 404 error if there isn't one.'''
+    job=jobs.get(jobid)
+    if job is None:
+        bottle.abort(404,'No backup job %i'%jobid)
+
+    return job
+
+
 @get('/')
 def root():
-    if backupThread is not None and backupThread.isAlive() and backupThread.status>=BackupThread.BACKUP:
-        return template(progressTemplate,numCopied=backupThread.numCopied,numFiles=backupThread.numFiles)
-    else:
-        return template(rootTemplate,mounts=mon.mounts)
+    interrupted=[j for j in listInterruptedRuns() if jobs.findActive(dest=j.info['dest']) is None]
+    return template(rootTemplate,mounts=mon.mounts,interrupted=interrupted,snapshots=jobs.snapshots())
 
 
 @get('/choose')
 def choose():
-    global backupThread
-    
     mount=request.params.get('mount')
-    
+
     if not mount:
         redirect('/')
     else:
         base=os.path.basename(mount)
-        backupThread=BackupThread(mount,os.path.join(BACKDIR,base))
-        backupThread.start()
-        
-        while backupThread.status<=BackupThread.SEARCH: # wait for the search, too slow?
-            time.sleep(0.1)
-        
-        print('Files to backup:',backupThread.numFiles)
-        return template(okCancelTemplate,numFiles=backupThread.numFiles)
-    
-       
+        verify=bool(request.params.get('verify'))
+        jobid=jobs.add(BackupThread(mount,os.path.join(BACKDIR,base),getDeviceID(mount),verify))
+        redirect('/job/%i'%jobid)
+
+
+@get('/resume')
+def resume():
+    filename=request.params.get('journal')
+    journals=[j for j in listInterruptedRuns() if j.filename==filename]
+
+    if not journals:
+        redirect('/')
+    else:
+        info=journals[0].info
+        jobid=jobs.add(BackupThread(info['src'],info['dest'],info['deviceid'],journal=journals[0]))
+        redirect('/job/%i'%jobid)
+
+
+@get('/job/<jobid:int>')
+def job(jobid):
+    job=getJob(jobid)
+    if job.status in (BackupThread.IDLE,BackupThread.SEARCH,BackupThread.DONESEARCH):
+        return template(searchTemplate,jobid=jobid)
+    else:
+        return template(progressTemplate,jobid=jobid)
+
+
 @get('/status')
 def status():
-    if backupThread is None or backupThread.status==BackupThread.DONEBACKUP:
-        stat='Ready'
-    elif backupThread.status==BackupThread.DONESEARCH:
-        stat='Searched Files'
-    elif backupThread.status==BackupThread.ERROR:
-        stat='Error: %s'%backupThread.exc
-    else:
-        stat='Backing up'
-        
-    res={
-        'status':stat,
-        'numcopied':backupThread.numCopied if backupThread else 0,
-        'numfiles':backupThread.numFiles if backupThread else 0,
-        'currentfile':os.path.basename(backupThread.currentFile) if backupThread else ''
-    }
-    
+    '''Returns the status snapshots of all jobs.'''
     response.content_type = 'application/json'
-    return json.dumps(res)
-    
-    
-@get('/start')
-def start():
-    backupThread.waitEvent.set()    
-    redirect('/')
-    
+    return json.dumps(jobs.snapshots())
+
+
+@get('/job/<jobid:int>/status')
+def jobStatus(jobid):
+    response.content_type = 'application/json'
+    return json.dumps(dict(getJob(jobid).snapshot(),id=jobid))
+
+
+@get('/job/<jobid:int>/events')
+def jobEvents(jobid):
+    '''Push status snapshots as Server-Sent Events when progress changes, at least every second, until the job ends.'''
+    job=getJob(jobid)
+    response.content_type='text/event-stream'
+    response.set_header('Cache-Control','no-cache')
+
+    def stream():
+        while True:
+            snapshot=dict(job.snapshot(),id=jobid)
+            yield 'data: %s\n\n'%json.dumps(snapshot)
+
+            if snapshot['done']:
+                break
+
+            time.sleep(EVENTINTERVAL)
+            job.waitChanged(snapshot['version'],1)
 
-@get('/cancel')
-def cancel():
-    global backupThread
-    backupThread.abort()
-    backupThread=None
+    return stream()
+
+
+@get('/job/<jobid:int>/start')
+def jobStart(jobid):
+    getJob(jobid).confirm()
+    redirect('/job/%i'%jobid)
+
+
+@get('/job/<jobid:int>/cancel')
+def jobCancel(jobid):
+    jobs.cancel(jobid)
     redirect('/')
 
 
@@ -355,5 +757,20 @@ def shutdown():
     os.system('sudo shutdown now')
     redirect('/')
     
+class ThreadingServer(bottle.ServerAdapter):
+    '''Server handling each request in its own thread, so event streams and slow clients don't stall other requests.'''
+    def run(self,handler):
+        class Server(ThreadingMixIn,WSGIServer):
+            daemon_threads=True
+            
+        class Handler(WSGIRequestHandler):
+            def log_request(self,*args,**kwargs):
+                if not quiet:
+                    WSGIRequestHandler.log_request(self,*args,**kwargs)
+                    
+        quiet=self.quiet
+        make_server(self.host,int(self.port),handler,Server,Handler).serve_forever()
+        
+    
 if __name__=='__main__':
-    run(host='0.0.0.0',port='8080',reloader=True)
+    run(host='0.0.0.0',port='8080',reloader=True,server=ThreadingServer)
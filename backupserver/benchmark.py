@@ -0,0 +1,251 @@
+'''
+Benchmarks for the backup components which run without USB devices, preferably on tmpfs or a loopback filesystem so
+results measure the copying code rather than the disks, eg.:
+
+    python3 benchmark.py copy --path /dev/shm --num_small 2000 --num_large 20
+    python3 benchmark.py store --path /dev/shm --overlap 0.5
+    python3 benchmark.py usbreplay
+'''
+
+from __future__ import print_function
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from types import SimpleNamespace
+
+from copyengine import CopyEngine
+from manifest import ManifestWriter, verifyBackup
+from store import ContentStore
+from usbmonitor import EventUSBMonitor
+
+
+def makeSourceTree(root,numSmall,smallSize,numLarge,largeSize,numDirs=10):
+    '''Create a tree of random files in `root' like a camera card, returning the list of files and total bytes.'''
+    files=[]
+    for i in range(numSmall+numLarge):
+        size=smallSize if i<numSmall else largeSize
+        path=os.path.join(root,'DCIM','%03iCANON'%(i%numDirs),'IMG_%04i.CR2'%i)
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        with open(path,'wb') as o:
+            o.write(os.urandom(size))
+        files.append(path)
+
+    return files,numSmall*smallSize+numLarge*largeSize
+
+
+def serialCopy(pairs):
+    '''The original backup loop copying one file at a time.'''
+    for src,dest in pairs:
+        os.makedirs(os.path.dirname(dest),exist_ok=True)
+        shutil.copy2(src,dest)
+
+
+def benchCopy(args):
+    '''Compare the serial copy loop against the copy engine with different numbers of workers, with and without hashing.'''
+    root=tempfile.mkdtemp(dir=args.path)
+    try:
+        src=os.path.join(root,'src')
+        files,total=makeSourceTree(src,args.num_small,args.small_size,args.num_large,args.large_size)
+        print('%i files, %.1fMB'%(len(files),total/1e6))
+
+        runs=[('serial copy2',None,False)]+[('engine, %i workers'%w,w,False) for w in args.workers]
+        runs+=[('hashing, %i workers'%w,w,True) for w in args.workers]
+        base=None
+        for name,workers,hashing in runs:
+            dest=os.path.join(root,'dest')
+            pairs=[(f,os.path.join(dest,os.path.relpath(f,src))) for f in files]
+
+            start=time.perf_counter()
+            if workers is None:
+                serialCopy(pairs)
+            else:
+                CopyEngine(workers,hashing=hashing).copyFiles(pairs)
+            secs=time.perf_counter()-start
+
+            base=base or secs
+            assert all(os.path.getsize(s)==os.path.getsize(d) for s,d in pairs)
+            print('%-22s %.3fs, %.1fMB/s, speedup %.2fx'%(name+':',secs,total/secs/1e6,base/secs))
+            shutil.rmtree(dest)
+    finally:
+        shutil.rmtree(root)
+
+
+def benchStore(args):
+    '''
+    Back up two overlapping cards with and without the content store, checking the second backup's files are linked to
+    the first's where they overlap and comparing copy times and the space used.
+    '''
+    root=tempfile.mkdtemp(dir=args.path)
+    try:
+        card1,card2=os.path.join(root,'card1'),os.path.join(root,'card2')
+        files1,total=makeSourceTree(card1,0,0,args.num_files,args.size)
+        numShared=int(args.num_files*args.overlap)
+
+        # the second card shares the first `numShared' files with the first card, the rest are new
+        files2,_=makeSourceTree(card2,0,0,args.num_files-numShared,args.size)
+        for f in files1[:numShared]:
+            dest=os.path.join(card2,'DCIM','SHARED',os.path.basename(f))
+            os.makedirs(os.path.dirname(dest),exist_ok=True)
+            shutil.copy2(f,dest)
+            files2.append(dest)
+
+        print('2 cards of %i files, %.1fMB each, %i%% overlap'%(args.num_files,total/1e6,args.overlap*100))
+
+        for name,useStore in (('full copies',False),('content store',True)):
+            backdir=os.path.join(root,'backup')
+            store=ContentStore(os.path.join(backdir,'.store')) if useStore else None
+            times=[]
+
+            for card,files in ((card1,files1),(card2,files2)):
+                destdir=os.path.join(backdir,os.path.basename(card))
+                manifest=ManifestWriter(destdir)
+                onCopied=lambda src,dest,size,hashes:manifest.add(dest,hashes[1])
+                pairs=[(f,os.path.join(destdir,os.path.relpath(f,card))) for f in files]
+
+                start=time.perf_counter()
+                CopyEngine(args.workers,onCopied=onCopied,hashing=True,store=store).copyFiles(pairs)
+                times.append(time.perf_counter()-start)
+                manifest.close()
+
+                num,problems=verifyBackup(destdir)
+                assert num==len(files) and not problems,problems
+
+            used=sum(st.st_size for st in {(s.st_dev,s.st_ino):s for s in map(os.stat,enumFiles(backdir))}.values())
+            if useStore:
+                assert store.numLinked==numShared,(store.numLinked,numShared)
+                for f in files1[:numShared]: # shared files in both backups are the same stored file
+                    name1=os.path.join(backdir,'card1',os.path.relpath(f,card1))
+                    name2=os.path.join(backdir,'card2','DCIM','SHARED',os.path.basename(f))
+                    assert os.path.samefile(name1,name2)
+
+            print('%-14s first %.3fs, second %.3fs, %.1fMB used'%(name+':',times[0],times[1],used/1e6))
+            shutil.rmtree(backdir)
+    finally:
+        shutil.rmtree(root)
+
+
+def enumFiles(root):
+    '''Yields every file in `root' and its subdirectories.'''
+    for dirpath,dirs,files in os.walk(root):
+        for f in files:
+            yield os.path.join(dirpath,f)
+
+
+def fakeDevice(action,devnode,removable=True):
+    '''Create a stand-in for a pyudev partition device with the attributes EventUSBMonitor uses.'''
+    disk=SimpleNamespace(attributes=SimpleNamespace(asstring=lambda name:'1' if removable else '0'))
+    return SimpleNamespace(action=action,device_type='partition',device_node=devnode,
+                           find_parent=lambda subsystem,devtype:disk)
+
+
+def mountInfoLine(i,source,mountpoint):
+    '''Returns a mountinfo line mounting `source' at `mountpoint', escaping spaces as the kernel does.'''
+    return '%i 1 8:%i / %s rw,relatime shared:%i - vfat %s rw\n'%(i+20,i,mountpoint.replace(' ','\\040'),i,source)
+
+
+class RecordingMonitor(EventUSBMonitor):
+    '''Event monitor recording added and removed mountpoints rather than printing them.'''
+    def __init__(self,mountinfo):
+        EventUSBMonitor.__init__(self,None,mountinfo)
+        self.log=[]
+
+    def addMount(self,m):
+        self.log.append(('add',m))
+
+    def removeMount(self,m):
+        self.log.append(('remove',m))
+
+
+def benchUSBReplay(args):
+    '''Replay synthetic udev and mount table events through the event driven USB monitor and check the results.'''
+    root=tempfile.mkdtemp()
+    mountinfo=os.path.join(root,'mountinfo')
+    mounted={'/dev/root':'/'} # current mount table, source device to mountpoint
+
+    def setMounts():
+        with open(mountinfo,'w') as o:
+            for i,(source,mountpoint) in enumerate(sorted(mounted.items())):
+                o.write(mountInfoLine(i,source,mountpoint))
+
+    # each step is an event and the expected mountpoints after it
+    steps=[
+        (('udev','add','/dev/sda1',True),[]),
+        (('mount','/dev/sda1','/media/pi/CARD'),['/media/pi/CARD']),
+        (('udev','add','/dev/sdb1',False),['/media/pi/CARD']),
+        (('mount','/dev/sdb1','/media/pi/DISK'),['/media/pi/CARD']),
+        (('udev','add','/dev/sdc1',True),['/media/pi/CARD']),
+        (('mount','/dev/sdc1','/media/pi/MY CARD'),['/media/pi/CARD','/media/pi/MY CARD']),
+        (('udev','remove','/dev/sda1',True),['/media/pi/MY CARD']),
+        (('unmount','/dev/sda1'),['/media/pi/MY CARD']),
+        (('unmount','/dev/sdc1'),[]),
+        (('udev','remove','/dev/sdc1',True),[]),
+    ]
+
+    try:
+        setMounts()
+        mon=RecordingMonitor(mountinfo)
+        mon.mountTableChanged()
+
+        for event,expected in steps:
+            if event[0]=='udev':
+                mon.handleDevice(fakeDevice(*event[1:]))
+            else:
+                if event[0]=='mount':
+                    mounted[event[1]]=event[2]
+                else:
+                    del mounted[event[1]]
+
+                setMounts()
+                mon.mountTableChanged() # called when poll signals a change on a real mount table
+
+            assert mon.mounts==expected,'After %r expected %r, got %r'%(event,expected,mon.mounts)
+
+        assert mon.log==[('add','/media/pi/CARD'),('add','/media/pi/MY CARD'),('remove','/media/pi/CARD'),
+                         ('remove','/media/pi/MY CARD')],mon.log
+        print('%i events replayed, %i mount table reads, mounts reported: %r'%(len(steps),mon.numTableReads,mon.log))
+
+        # time handling a plug and unplug cycle, the cost paid per event rather than every second when polling
+        start=time.perf_counter()
+        for i in range(args.num_events):
+            mon.handleDevice(fakeDevice('add','/dev/sdz1'))
+            mon.mountTableChanged()
+            mon.handleDevice(fakeDevice('remove','/dev/sdz1'))
+        secs=time.perf_counter()-start
+        print('%.3fms per add, mount table change, and remove'%(secs*1000/args.num_events))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub=parser.add_subparsers(dest='command')
+    sub.required=True
+
+    p=sub.add_parser('copy',help=benchCopy.__doc__)
+    p.add_argument('--path',default='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                   help='Directory to create benchmark files in')
+    p.add_argument('--num_small',type=int,default=2000,help='Number of small files')
+    p.add_argument('--small_size',type=int,default=32*1024,help='Size of small files in bytes')
+    p.add_argument('--num_large',type=int,default=20,help='Number of large files')
+    p.add_argument('--large_size',type=int,default=25*1024*1024,help='Size of large files in bytes')
+    p.add_argument('--workers',type=int,nargs='+',default=[1,2,4],help='Numbers of copy workers to test')
+    p.set_defaults(func=benchCopy)
+
+    p=sub.add_parser('store',help=benchStore.__doc__)
+    p.add_argument('--path',default='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                   help='Directory to create benchmark files in')
+    p.add_argument('--num_files',type=int,default=50,help='Number of files on each card')
+    p.add_argument('--size',type=int,default=4*1024*1024,help='Size of each file in bytes')
+    p.add_argument('--overlap',type=float,default=0.5,help='Fraction of the second card\'s files also on the first')
+    p.add_argument('--workers',type=int,default=4,help='Number of copy workers')
+    p.set_defaults(func=benchStore)
+
+    p=sub.add_parser('usbreplay',help=benchUSBReplay.__doc__)
+    p.add_argument('--num_events',type=int,default=1000,help='Number of event cycles to time')
+    p.set_defaults(func=benchUSBReplay)
+
+    args=parser.parse_args()
+    args.func(args)
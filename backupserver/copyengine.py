@@ -0,0 +1,285 @@
+'''
+Parallel file copying for backups. Destination directories are created before copying starts, file data is copied in
+the kernel with copy_file_range or sendfile where available, and small and large files are copied by separate workers
+so reading many small files from the source overlaps with long sequential writes of large ones. If hashing is enabled
+data is instead copied through a buffer and hashed as it is read, so files are never read twice to compute hashes.
+Files are written to temporary names and renamed once complete and synced, so a file is either fully copied or absent.
+'''
+
+from __future__ import print_function
+import os
+import errno
+import shutil
+import threading
+from collections import deque
+from contextlib import nullcontext
+
+from fileindex import StreamHasher
+
+BUFSIZE=8*1024*1024 # bytes copied per system call
+SMALLSIZE=1024*1024 # files smaller than this are small files
+TEMPSUFFIX='.part' # suffix of the hidden temporary names files are copied to
+
+
+class CopyAborted(Exception):
+    '''Raised when copying a file is stopped before it completes.'''
+
+
+def _checkStop(stop):
+    if stop is not None and stop.is_set():
+        raise CopyAborted()
+
+
+def getTempName(dest):
+    '''Get the temporary name `dest' is copied to before being renamed.'''
+    dirname,basename=os.path.split(dest)
+    return os.path.join(dirname,'.'+basename+TEMPSUFFIX)
+
+
+def removeTempFiles(root):
+    '''Remove temporary files in `root' left by copies which were interrupted, returning the number removed.'''
+    removed=0
+    for dirpath,dirs,files in os.walk(root):
+        for f in files:
+            if f.startswith('.') and f.endswith(TEMPSUFFIX):
+                os.remove(os.path.join(dirpath,f))
+                removed+=1
+
+    return removed
+
+
+def _copyRange(fsrc,fdst,size,bufsize,stop=None):
+    '''Copy `size' bytes between file descriptors with copy_file_range, raises OSError if it isn't supported.'''
+    copied=0
+    while copied<size:
+        _checkStop(stop)
+        n=os.copy_file_range(fsrc,fdst,min(bufsize,size-copied))
+        if n==0:
+            break
+        copied+=n
+
+    return copied
+
+
+def _sendFile(fsrc,fdst,size,bufsize,stop=None):
+    '''Copy `size' bytes between file descriptors with sendfile, raises OSError if it isn't supported.'''
+    copied=0
+    while copied<size:
+        _checkStop(stop)
+        n=os.sendfile(fdst,fsrc,copied,min(bufsize,size-copied))
+        if n==0:
+            break
+        copied+=n
+
+    return copied
+
+
+def _readWrite(fsrc,fdst,size,bufsize,hasher=None,stop=None):
+    '''Copy between file descriptors by reading and writing through a buffer, passing data to `hasher' if given.'''
+    copied=0
+    buf=bytearray(max(1,min(bufsize,size)))
+    view=memoryview(buf)
+    with open(fsrc,'rb',buffering=0,closefd=False) as f:
+        while True:
+            _checkStop(stop)
+            n=f.readinto(buf)
+            if not n:
+                break
+
+            if hasher is not None:
+                hasher.update(view[:n])
+
+            pos=0
+            while pos<n:
+                pos+=os.write(fdst,view[pos:n])
+            copied+=n
+
+    return copied
+
+
+# kernel copy methods tried in order, dropped from the list when found not to be supported between the filesystems used
+_copyMethods=[m for m,name in ((_copyRange,'copy_file_range'),(_sendFile,'sendfile')) if hasattr(os,name)]
+_unsupported={errno.ENOSYS,errno.EXDEV,errno.EINVAL,errno.EOPNOTSUPP,errno.ENOTSUP,errno.EBADF}
+
+
+def copyFile(src,dest,bufsize=BUFSIZE,hashing=False,stop=None):
+    '''
+    Copy the contents and metadata of `src' to `dest' as shutil.copy2 does, returning the number of bytes copied and,
+    if `hashing' is True, the partial and full hashes of the data copied as fileindex computes them, otherwise None.
+    The data is copied to a temporary name, synced to disk, then renamed to `dest'. If the event `stop' is set while
+    copying CopyAborted is raised after the current chunk and the temporary file is removed.
+    '''
+    size=os.stat(src).st_size
+    hasher=StreamHasher(size) if hashing else None
+    tmp=getTempName(dest)
+
+    fsrc=os.open(src,os.O_RDONLY)
+    try:
+        fdst=os.open(tmp,os.O_WRONLY|os.O_CREAT|os.O_TRUNC,0o666)
+        try:
+            copied=None
+            for method in ([] if hashing else list(_copyMethods)):
+                try:
+                    copied=method(fsrc,fdst,size,bufsize,stop)
+                    break
+                except OSError as e:
+                    # only fall back if nothing was written, otherwise this is a real error
+                    if e.errno not in _unsupported or os.lseek(fdst,0,os.SEEK_CUR)!=0:
+                        raise
+
+                    if method in _copyMethods:
+                        _copyMethods.remove(method)
+
+            if copied is None:
+                copied=_readWrite(fsrc,fdst,size,bufsize,hasher,stop)
+
+            os.fsync(fdst)
+        finally:
+            os.close(fdst)
+
+        shutil.copystat(src,tmp)
+        os.rename(tmp,dest)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        os.close(fsrc)
+
+    return copied,hasher.hashes() if hashing else None
+
+
+class CopyEngine(object):
+    '''
+    Copies files with a pool of `numWorkers' threads. Files of at least `smallSize' bytes are copied by `largeWorkers'
+    of the threads while the rest copy small files, each taking files from the other queue once theirs is empty. Files
+    are either given all at once to `copyFiles', or streamed by calling `start', then `add' for each file as it's found,
+    then `finish' and `wait'. Progress is kept in `numCopied' and `bytesCopied', and `onCopied' is called from the
+    worker threads with the source, destination, size, and hashes (None if `hashing' is False) of each file copied. If
+    the content store `store' is given files are stored in it and linked to their destinations instead of copied. If
+    `limiter' is given each file is copied while holding it, for example a semaphore limiting how many files are copied
+    to a disk at once by all the engines copying to it.
+    '''
+    def __init__(self,numWorkers=4,largeWorkers=1,smallSize=SMALLSIZE,bufsize=BUFSIZE,onCopied=None,hashing=False,
+                 store=None,limiter=None):
+        self.numWorkers=max(1,numWorkers)
+        self.largeWorkers=min(largeWorkers,self.numWorkers)
+        self.smallSize=smallSize
+        self.bufsize=bufsize
+        self.onCopied=onCopied
+        self.hashing=hashing
+        self.store=store
+        self.limiter=limiter
+        self.lock=threading.Lock()
+        self.cond=threading.Condition(self.lock)
+        self.small=deque() # queued small files
+        self.large=deque() # queued large files
+        self.dirs=set() # destination directories created so far
+        self.finished=False # set when no more files will be added
+        self.threads=[]
+        self.numCopied=0
+        self.bytesCopied=0
+        self.currentFiles=set() # source files being copied now
+        self.exc=None # first exception raised by a worker
+        self.stopEvent=threading.Event()
+
+    def abort(self):
+        '''Stop copying, files being copied are stopped after their current chunk and their partial copies removed.'''
+        with self.cond:
+            self.stopEvent.set()
+            self.cond.notify_all()
+
+    def start(self):
+        '''Start the worker threads, which wait for files to be added.'''
+        for i in range(self.numWorkers):
+            queues=(self.large,self.small) if i<self.largeWorkers else (self.small,self.large)
+            self.threads.append(threading.Thread(target=self._work,args=queues,name='Copy%i'%i,daemon=True))
+            self.threads[-1].start()
+
+    def add(self,src,dest,size=None):
+        '''Queue `src' to be copied to `dest', creating its directory now so workers never wait on it.'''
+        size=os.path.getsize(src) if size is None else size
+        dirname=os.path.dirname(dest)
+        if dirname not in self.dirs:
+            os.makedirs(dirname,exist_ok=True)
+            self.dirs.add(dirname)
+
+        with self.cond:
+            (self.small if size<self.smallSize else self.large).append((src,dest,size))
+            self.cond.notify()
+
+    def finish(self):
+        '''State no more files will be added, workers exit once the queues are empty.'''
+        with self.cond:
+            self.finished=True
+            self.cond.notify_all()
+
+    def wait(self):
+        '''Wait for the workers to exit, raising the first exception raised copying a file if any.'''
+        for t in self.threads:
+            t.join()
+
+        if self.exc is not None:
+            raise self.exc
+
+    def _next(self,first,second):
+        with self.cond:
+            while not self.stopEvent.is_set():
+                queue=first if first else second
+                if queue:
+                    return queue.popleft()
+                elif self.finished:
+                    break
+
+                self.cond.wait()
+
+            return None
+
+    def _work(self,first,second):
+        while True:
+            item=self._next(first,second)
+            if item is None:
+                return
+
+            src,dest,size=item
+            with self.lock:
+                self.currentFiles.add(src)
+
+            try:
+                copy=copyFile if self.store is None else self.store.copyFile
+                with self.limiter if self.limiter is not None else nullcontext():
+                    _,hashes=copy(src,dest,self.bufsize,self.hashing,self.stopEvent)
+
+                if self.onCopied is not None:
+                    self.onCopied(src,dest,size,hashes)
+            except CopyAborted:
+                return
+            except Exception as e:
+                with self.lock:
+                    self.exc=self.exc or e
+                self.abort()
+                return
+            finally:
+                with self.lock:
+                    self.currentFiles.discard(src)
+
+            with self.lock:
+                self.numCopied+=1
+                self.bytesCopied+=size
+
+    def copyFiles(self,pairs):
+        '''
+        Copy each (source, destination) file in `pairs' and wait until done. Small files are copied in path order and
+        large files in order of decreasing size. The first exception raised copying a file stops all workers and is
+        raised here.
+        '''
+        pairs=[(src,dest,os.path.getsize(src)) for src,dest in pairs]
+        small=sorted(p for p in pairs if p[2]<self.smallSize)
+        large=sorted((p for p in pairs if p[2]>=self.smallSize),key=lambda p:-p[2])
+
+        for src,dest,size in small+large:
+            self.add(src,dest,size)
+
+        self.start()
+        self.finish()
+        self.wait()
@@ -0,0 +1,269 @@
+'''
+Persistent content index of a backup destination directory stored in a Sqlite file. Files are matched by size first,
+then by a partial hash of their first and last blocks, then by a full content hash. Hashes of indexed files are only
+computed when another file of the same size is looked up and are then stored, so most lookups read nothing from the
+destination and never more than once per file.
+
+The scan cache of a source device records the files already backed up from it so unchanged files can be skipped by
+their metadata without being read.
+'''
+
+from __future__ import print_function
+import os
+import sys
+import sqlite3
+import hashlib
+import threading
+
+HASHNAME='sha1' # hash algorithm used for partial and full hashes
+PARTIALSIZE=64*1024 # bytes read from the start and end of a file for its partial hash
+BLOCKSIZE=1024*1024 # read size when hashing whole files
+
+
+def partialHash(path,size=None):
+    '''Returns the hash of the size and first and last PARTIALSIZE bytes of `path', which covers all of small files.'''
+    size=os.path.getsize(path) if size is None else size
+    h=hashlib.new(HASHNAME)
+    h.update(str(size).encode())
+
+    with open(path,'rb') as f:
+        h.update(f.read(PARTIALSIZE))
+        if size>PARTIALSIZE:
+            f.seek(max(PARTIALSIZE,size-PARTIALSIZE))
+            h.update(f.read(PARTIALSIZE))
+
+    return h.hexdigest()
+
+
+def fullHash(path):
+    '''Returns the hash of the whole contents of `path'.'''
+    h=hashlib.new(HASHNAME)
+
+    with open(path,'rb') as f:
+        for block in iter(lambda:f.read(BLOCKSIZE),b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+class StreamHasher(object):
+    '''
+    Computes the partial and full hashes of a file of `size' bytes from its data passed to `update' in order, giving
+    the same results as partialHash and fullHash so files can be hashed while they're copied without reading them again.
+    '''
+    def __init__(self,size):
+        self.size=size
+        self.full=hashlib.new(HASHNAME)
+        self.head=bytearray() # first PARTIALSIZE bytes
+        self.tail=bytearray() # last bytes read, up to PARTIALSIZE of them
+        self.tailStart=max(PARTIALSIZE,size-PARTIALSIZE) # offset of the tail read by partialHash
+
+    def update(self,data):
+        self.full.update(data)
+
+        if len(self.head)<PARTIALSIZE:
+            self.head+=data[:PARTIALSIZE-len(self.head)]
+
+        self.tail+=data[-PARTIALSIZE:]
+        del self.tail[:-PARTIALSIZE]
+
+    def hashes(self):
+        '''Returns the partial and full hashes of the data given so far.'''
+        partial=hashlib.new(HASHNAME)
+        partial.update(str(self.size).encode())
+        partial.update(self.head)
+
+        if self.size>PARTIALSIZE:
+            partial.update(self.tail[len(self.tail)-(self.size-self.tailStart):])
+
+        return partial.hexdigest(),self.full.hexdigest()
+
+
+class FileIndex(object):
+    '''
+    Index of files stored in the Sqlite file `dbfile', mapping each path to its size, mtime, and hashes once known.
+    Entries are validated against the file's current size and mtime when used so stale entries are dropped. The index
+    can be shared between threads.
+    '''
+    def __init__(self,dbfile):
+        dirname=os.path.dirname(dbfile)
+        if dirname:
+            os.makedirs(dirname,exist_ok=True)
+
+        self.dbfile=dbfile
+        self.lock=threading.RLock()
+        self.conn=sqlite3.connect(dbfile,check_same_thread=False)
+
+        with self.lock,self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS files(
+                path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, partial TEXT, full TEXT)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS files_size ON files(size,partial)')
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def addFile(self,path,partial=None,full=None):
+        '''Add or replace the entry for `path' with its current size and mtime and the given hashes if known.'''
+        st=os.stat(path)
+        with self.lock,self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?)',
+                              (os.path.abspath(path),st.st_size,st.st_mtime,partial,full))
+
+    def removeFile(self,path):
+        with self.lock,self.conn:
+            self.conn.execute('DELETE FROM files WHERE path=?',(os.path.abspath(path),))
+
+    def sync(self,root,ignore=()):
+        '''
+        Bring the entries for files in `root' up to date by stat'ing every file, without reading any. New and changed
+        files are added without hashes and entries for missing files are removed, files with names in `ignore' are not
+        indexed. Returns the numbers added and removed.
+        '''
+        root=os.path.abspath(root)
+        prefix=os.path.join(root,'')
+
+        with self.lock:
+            rows=self.conn.execute('SELECT path,size,mtime FROM files WHERE substr(path,1,?)=?',(len(prefix),prefix))
+            known={path:(size,mtime) for path,size,mtime in rows}
+
+        added=[]
+        for dirpath,dirs,files in os.walk(root):
+            for f in files:
+                if f in ignore:
+                    continue
+
+                path=os.path.join(dirpath,f)
+                try:
+                    st=os.stat(path)
+                except OSError:
+                    continue
+
+                if known.pop(path,None)!=(st.st_size,st.st_mtime):
+                    added.append((path,st.st_size,st.st_mtime,None,None))
+
+        with self.lock,self.conn:
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?)',added)
+            self.conn.executemany('DELETE FROM files WHERE path=?',[(p,) for p in known])
+
+        return len(added),len(known)
+
+    def _candidates(self,size):
+        '''Returns valid entries of files of `size' bytes as lists, removing entries of missing or changed files.'''
+        with self.lock:
+            rows=self.conn.execute('SELECT path,mtime,partial,full FROM files WHERE size=?',(size,)).fetchall()
+
+        result=[]
+        for path,mtime,partial,full in rows:
+            try:
+                st=os.stat(path)
+            except OSError:
+                st=None
+
+            if st is None or st.st_size!=size or st.st_mtime!=mtime:
+                self.removeFile(path)
+            else:
+                result.append([path,partial,full])
+
+        return result
+
+    def _setHash(self,path,column,value):
+        with self.lock,self.conn:
+            self.conn.execute('UPDATE files SET %s=? WHERE path=?'%column,(value,path))
+
+    def match(self,srcfile,size=None):
+        '''
+        Returns the path of an indexed file with the same contents as `srcfile', or None if there isn't one, with the
+        partial and full hashes of `srcfile' if they were computed. Sizes are compared first, then partial hashes, then
+        full hashes, and hashes of indexed files are stored as computed.
+        '''
+        size=os.path.getsize(srcfile) if size is None else size
+        candidates=self._candidates(size)
+        if not candidates:
+            return None,None,None
+
+        srcpartial=partialHash(srcfile,size)
+        matches=[]
+        for c in candidates:
+            if c[1] is None:
+                c[1]=partialHash(c[0],size)
+                self._setHash(c[0],'partial',c[1])
+
+            if c[1]==srcpartial:
+                matches.append(c)
+
+        if not matches:
+            return None,srcpartial,None
+        elif size<=2*PARTIALSIZE: # the partial hash covers the whole file
+            return matches[0][0],srcpartial,None
+
+        srcfull=fullHash(srcfile)
+        for c in matches:
+            if c[2] is None:
+                c[2]=fullHash(c[0])
+                self._setHash(c[0],'full',c[2])
+
+            if c[2]==srcfull:
+                return c[0],srcpartial,srcfull
+
+        return None,srcpartial,srcfull
+
+    def findDuplicate(self,srcfile,size=None):
+        '''Returns the path of an indexed file with the same contents as `srcfile', or None if there isn't one.'''
+        return self.match(srcfile,size)[0]
+
+
+class ScanCache(object):
+    '''
+    Cache of files backed up from a source device mounted at `root', stored in the Sqlite file `dbfile'. Each file's
+    path relative to `root' is mapped to its size, mtime, and content hash if known, so that a file whose size and mtime
+    are unchanged when the device is next inserted is known to be backed up without reading it.
+    '''
+    def __init__(self,dbfile,root):
+        dirname=os.path.dirname(dbfile)
+        if dirname:
+            os.makedirs(dirname,exist_ok=True)
+
+        self.dbfile=dbfile
+        self.root=root
+        self.lock=threading.RLock()
+        self.conn=sqlite3.connect(dbfile,check_same_thread=False)
+
+        with self.lock,self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('''CREATE TABLE IF NOT EXISTS files(
+                path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, hash TEXT)''')
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def isUnchanged(self,path,st=None):
+        '''Returns True if `path' was backed up and its size and mtime, taken from `st' if given, have not changed.'''
+        st=st or os.stat(path)
+        with self.lock:
+            row=self.conn.execute('SELECT size,mtime FROM files WHERE path=?',(os.path.relpath(path,self.root),))
+            return row.fetchone()==(st.st_size,st.st_mtime)
+
+    def addFile(self,path,hash=None,st=None):
+        '''Record `path' as backed up with its current size and mtime, taken from `st' if given, and `hash' if known.'''
+        st=st or os.stat(path)
+        with self.lock,self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?)',
+                              (os.path.relpath(path,self.root),st.st_size,st.st_mtime,hash))
+
+
+if __name__=='__main__':
+    # rebuild the index of a destination directory: fileindex.py INDEXFILE DESTDIR
+    index=FileIndex(sys.argv[1])
+    print('Added %i, removed %i'%index.sync(sys.argv[2]))
+    index.close()
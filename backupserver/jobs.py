@@ -0,0 +1,142 @@
+'''
+Management of concurrent backup jobs. Each job is a thread backing up one source device, jobs are queued and run at
+most a given number at a time, and jobs copying to the same disk share a limit on how many files are copied to it at
+once so devices backed up together share the disk's bandwidth rather than competing for it with too many writers.
+'''
+
+from __future__ import print_function
+import os
+import threading
+from collections import OrderedDict, deque
+
+
+class DiskLimits(object):
+    '''Provides a semaphore per disk allowing `workersPerDisk' files to be copied to that disk at once.'''
+    def __init__(self,workersPerDisk=4):
+        self.workersPerDisk=workersPerDisk
+        self.limiters={} # device ID to semaphore
+        self.lock=threading.Lock()
+
+    def get(self,path):
+        '''Get the semaphore for the disk `path' is on, or would be on if it doesn't exist yet.'''
+        while not os.path.exists(path):
+            path=os.path.dirname(path)
+
+        dev=os.stat(path).st_dev
+        with self.lock:
+            if dev not in self.limiters:
+                self.limiters[dev]=threading.BoundedSemaphore(self.workersPerDisk)
+
+            return self.limiters[dev]
+
+
+class JobManager(object):
+    '''
+    Runs backup jobs, threads with `src' and `dest' members, `abort' and `snapshot' methods, and an `onDone' callback
+    member called with the job when it finishes, as BackupThread provides. At most `maxJobs' run at once with the rest
+    queued in the order added, and only one job at a time backs up a given source or to a given destination, so a job
+    for a different device with the same destination, such as another card with the same label, waits in the queue
+    until the destination is free. Up to `keepDone' finished jobs are kept so their status can still be viewed.
+    '''
+    def __init__(self,maxJobs=4,keepDone=10):
+        self.maxJobs=maxJobs
+        self.keepDone=keepDone
+        self.jobs=OrderedDict() # job IDs to jobs in the order added
+        self.queue=deque() # jobs waiting to start
+        self.running=set() # jobs started and not yet finished
+        self.nextID=1
+        self.lock=threading.RLock()
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.jobs.items()))
+
+    def get(self,jobid):
+        '''Get the job with ID `jobid', or None if there isn't one.'''
+        with self.lock:
+            return self.jobs.get(jobid)
+
+    def isActive(self,job):
+        '''Returns True if `job' is queued or running.'''
+        with self.lock:
+            return job in self.running or job in self.queue
+
+    def findActive(self,src=None,dest=None):
+        '''Returns the ID of the queued or running job backing up `src' or to `dest', or None if there isn't one.'''
+        with self.lock:
+            for jobid,job in self.jobs.items():
+                if self.isActive(job) and (job.src==src or job.dest==dest):
+                    return jobid
+
+            return None
+
+    def findDuplicate(self,job):
+        '''Returns the ID of the queued or running job backing up the same source and device as `job', or None.'''
+        with self.lock:
+            for jobid,active in self.jobs.items():
+                if self.isActive(active) and active.src==job.src and active.deviceid==job.deviceid:
+                    return jobid
+
+            return None
+
+    def add(self,job):
+        '''
+        Queue `job' and start it if there's room, returning its ID or the ID of the active job backing up the same
+        source and device, which requests to back up a device again while its job is active are directed to.
+        '''
+        with self.lock:
+            jobid=self.findDuplicate(job)
+            if jobid is not None:
+                return jobid
+
+            jobid=self.nextID
+            self.nextID+=1
+            self.jobs[jobid]=job
+            self.queue.append(job)
+            job.onDone=self._jobDone
+            self._startJobs()
+            return jobid
+
+    def cancel(self,jobid):
+        '''Cancel the job `jobid', stopping it mid-copy if running or removing it from the queue if not started.'''
+        with self.lock:
+            job=self.jobs.get(jobid)
+            if job is None:
+                return
+
+            job.abort()
+            if job in self.queue:
+                self.queue.remove(job)
+                self._prune()
+
+    def snapshots(self):
+        '''Returns the status snapshots of all jobs, each with its ID as `id'.'''
+        return [dict(job.snapshot(),id=jobid) for jobid,job in self]
+
+    def _canStart(self,job):
+        '''Returns True if no running job backs up the source of `job' or to its destination.'''
+        return not any(r.src==job.src or r.dest==job.dest for r in self.running)
+
+    def _startJobs(self):
+        '''Start queued jobs in order while there's room, skipping those whose source or destination is in use.'''
+        with self.lock:
+            for job in list(self.queue):
+                if len(self.running)>=self.maxJobs:
+                    break
+
+                if self._canStart(job):
+                    self.queue.remove(job)
+                    self.running.add(job)
+                    job.start()
+
+    def _jobDone(self,job):
+        with self.lock:
+            self.running.discard(job)
+            self._prune()
+            self._startJobs()
+
+    def _prune(self):
+        '''Remove the oldest finished jobs beyond `keepDone'.'''
+        done=[jobid for jobid,job in self.jobs.items() if not self.isActive(job)]
+        for jobid in done[:max(0,len(done)-self.keepDone)]:
+            del self.jobs[jobid]
@@ -0,0 +1,118 @@
+'''
+Journals recording the progress of backup runs so interrupted runs can be resumed. A journal is a file of JSON lines,
+one record per event, written as the run proceeds: the run's source and save directory when copying starts, each file
+found to copy, the end of the search, and each file once it has been copied and renamed into place. The journal is
+removed when the run completes, so one left behind is a run which was interrupted by losing power, the device being
+removed, or an error, and reading it gives the files still to copy without searching the source again.
+'''
+
+from __future__ import print_function
+import os
+import json
+import threading
+
+JOURNALDIR='.journal' # directory in the backup directory journals are stored in
+
+
+class BackupJournal(object):
+    '''
+    Journal of a backup run stored in `filename', read if the file exists. Records are flushed as they're written and
+    the file synced at the start and end of the search, lost records of copied files only cause them to be copied again.
+    Thread-safe.
+    '''
+    def __init__(self,filename):
+        self.filename=filename
+        self.lock=threading.Lock()
+        self.out=None
+        self.info=None # start record with the run's src, dest, destdir, and deviceid values
+        self.files=[] # (source file, size) pairs found to copy
+        self.found=set() # source files found to copy
+        self.copied=set() # source files copied
+        self.searched=False # True if the search finished
+
+        if os.path.exists(filename):
+            self._read()
+
+    def _read(self):
+        with open(self.filename) as f:
+            for line in f:
+                try:
+                    record=json.loads(line)
+                except ValueError: # last line written when power was lost
+                    break
+
+                op=record['op']
+                if op=='start':
+                    self.info=record
+                elif op=='file':
+                    self.found.add(record['src'])
+                    self.files.append((record['src'],record['size']))
+                elif op=='copied':
+                    self.copied.add(record['src'])
+                elif op=='searched':
+                    self.searched=True
+
+    def _write(self,record,sync=False):
+        with self.lock:
+            if self.out is None:
+                self.out=open(self.filename,'a')
+
+            self.out.write(json.dumps(record)+'\n')
+            self.out.flush()
+            if sync:
+                os.fsync(self.out.fileno())
+
+    def isInterrupted(self):
+        '''Returns True if the journal is of a run which was started but not completed.'''
+        return self.info is not None
+
+    def remaining(self):
+        '''Returns the (source file, size) pairs found but not yet copied.'''
+        return [(src,size) for src,size in self.files if src not in self.copied]
+
+    def start(self,src,dest,destdir,deviceid=None):
+        '''Start a new journal for a run from `src' to `destdir' in `dest', replacing any existing one.'''
+        os.makedirs(os.path.dirname(self.filename),exist_ok=True)
+        self.close()
+        with self.lock:
+            self.out=open(self.filename,'w')
+            self.files=[]
+            self.found=set()
+            self.copied=set()
+            self.searched=False
+
+        self.info=dict(op='start',src=src,dest=dest,destdir=destdir,deviceid=deviceid)
+        self._write(self.info,True)
+
+    def addFile(self,src,size):
+        '''Record the file `src' was found to copy, if not already recorded.'''
+        if src not in self.found:
+            self.found.add(src)
+            self.files.append((src,size))
+            self._write(dict(op='file',src=src,size=size))
+
+    def searchDone(self):
+        '''Record the search finished, so all files to copy are in the journal.'''
+        if not self.searched:
+            self.searched=True
+            self._write(dict(op='searched'),True)
+
+    def fileCopied(self,src):
+        '''Record the file `src' was copied.'''
+        with self.lock:
+            self.copied.add(src)
+
+        self._write(dict(op='copied',src=src))
+
+    def close(self):
+        with self.lock:
+            if self.out is not None:
+                self.out.close()
+                self.out=None
+
+    def finish(self):
+        '''Record the run completed by removing the journal.'''
+        self.close()
+        self.info=None
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
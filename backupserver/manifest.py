@@ -0,0 +1,116 @@
+'''
+Backup manifests recording the path, size, mtime, and content hash of every file copied in a backup run. The manifest
+is a CSV file stored in the backup's directory which is appended to as files are copied, and can be used to verify
+the backup's files later. Files copied without hashing have an empty hash and only their sizes are verified:
+
+    python3 manifest.py ~/backup/DEVICE/20180101120000 [--workers 4]
+'''
+
+from __future__ import print_function
+import os
+import sys
+import csv
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from fileindex import fullHash
+
+MANIFEST='.manifest.csv' # name of the manifest file in each backup directory
+FIELDS=('path','size','mtime','hash')
+
+
+class ManifestWriter(object):
+    '''
+    Writes the manifest for the backup directory `backupdir', created when the first file is added. Each row is flushed
+    as it's written so the manifest is complete up to the last file copied if the run is interrupted. Thread-safe.
+    '''
+    def __init__(self,backupdir):
+        self.backupdir=backupdir
+        self.lock=threading.Lock()
+        self.out=None
+        self.writer=None
+
+    def add(self,path,hash,st=None):
+        '''
+        Add the file `path' in the backup directory with its hash `hash', which is None if not known, and size and mtime
+        from `st' if given.
+        '''
+        st=st or os.stat(path)
+        row=(os.path.relpath(path,self.backupdir),st.st_size,repr(st.st_mtime),hash or '')
+
+        with self.lock:
+            if self.out is None:
+                filename=os.path.join(self.backupdir,MANIFEST)
+                isNew=not os.path.exists(filename)
+                self.out=open(filename,'a',newline='')
+                self.writer=csv.writer(self.out)
+                if isNew:
+                    self.writer.writerow(FIELDS)
+
+            self.writer.writerow(row)
+            self.out.flush()
+
+    def close(self):
+        with self.lock:
+            if self.out is not None:
+                self.out.close()
+                self.out=None
+
+
+def readManifest(backupdir):
+    '''Returns the rows of the manifest of `backupdir' as dictionaries with absolute paths and typed values.'''
+    with open(os.path.join(backupdir,MANIFEST),newline='') as f:
+        rows=list(csv.DictReader(f))
+
+    for row in rows:
+        row['path']=os.path.join(backupdir,row['path'])
+        row['size']=int(row['size'])
+        row['mtime']=float(row['mtime'])
+
+    return rows
+
+
+def checkFile(row):
+    '''Check the file of the manifest row `row' against its recorded size and hash, returning a problem or None.'''
+    path=row['path']
+    if not os.path.isfile(path):
+        return 'missing'
+    elif os.path.getsize(path)!=row['size']:
+        return 'size %i, expected %i'%(os.path.getsize(path),row['size'])
+    elif row['hash'] and fullHash(path)!=row['hash']:
+        return 'hash mismatch'
+
+    return None
+
+
+def verifyBackup(backupdir,numWorkers=4):
+    '''
+    Verify the files of `backupdir' against its manifest with `numWorkers' threads hashing files in parallel. Returns
+    the number of files checked and a list of (path, problem) pairs for files which failed.
+    '''
+    rows=readManifest(backupdir)
+
+    with ThreadPoolExecutor(max(1,numWorkers)) as pool:
+        results=pool.map(checkFile,rows)
+        problems=[(row['path'],p) for row,p in zip(rows,results) if p is not None]
+
+    return len(rows),problems
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('backupdirs',nargs='+',help='Backup directories to verify')
+    parser.add_argument('--workers',type=int,default=4,help='Number of files to verify in parallel')
+    args=parser.parse_args()
+
+    failed=False
+    for backupdir in args.backupdirs:
+        num,problems=verifyBackup(backupdir,args.workers)
+        failed=failed or bool(problems)
+        print('%s: %i files, %i problems'%(backupdir,num,len(problems)))
+
+        for path,problem in problems:
+            print('  %s: %s'%(path,problem))
+
+    sys.exit(1 if failed else 0)
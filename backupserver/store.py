@@ -0,0 +1,136 @@
+'''
+Content addressed store for deduplicating backups. Each distinct file content is stored once under its full hash and
+files in backup directories are hardlinks to the stored copies, so directories can be browsed as normal while files
+backed up more than once, such as the same photos imported from different card readers, take space and write time
+once. Stored files share their metadata with every link to them so shouldn't be modified in place. Existing backup
+directories can be added to the store, replacing their files with links to already stored copies:
+
+    python3 store.py ~/backup/.store ~/backup/DEVICE/*
+'''
+
+from __future__ import print_function
+import os
+import uuid
+import errno
+import argparse
+import threading
+
+from fileindex import FileIndex, fullHash, partialHash
+from copyengine import copyFile, getTempName, BUFSIZE
+from manifest import MANIFEST
+
+INDEXNAME='.index.sqlite' # content index of the store in its root directory
+TMPDIR='.tmp' # directory in the store root files are copied to before being moved to their hash path
+
+
+class ContentStore(object):
+    '''
+    Store of file contents in `root', each at a path named by its full hash. Files are looked up in the store's content
+    index before copying and linked to the existing copy if found, otherwise copied in and hashed in the same pass.
+    '''
+    def __init__(self,root):
+        self.root=root
+        self.tmpdir=os.path.join(root,TMPDIR)
+        os.makedirs(self.tmpdir,exist_ok=True)
+        self.index=FileIndex(os.path.join(root,INDEXNAME))
+        self.lock=threading.Lock()
+        self.numLinked=0 # number of files linked to existing stored copies
+        self.bytesLinked=0 # bytes not copied because their content was already stored
+
+    def getPath(self,hash):
+        '''Get the path of the stored file with full hash `hash'.'''
+        return os.path.join(self.root,hash[:2],hash)
+
+    def _link(self,stored,dest):
+        '''
+        Hardlink `dest' to `stored', copying instead if the filesystem doesn't support links. The link is made at the
+        temporary name copies use then renamed over `dest', so an existing `dest' is replaced as copying would.
+        '''
+        tmp=getTempName(dest)
+        try:
+            if os.path.lexists(tmp): # left by an interrupted link
+                os.remove(tmp)
+
+            os.link(stored,tmp)
+            os.rename(tmp,dest)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV,errno.EPERM,errno.EMLINK,errno.EOPNOTSUPP):
+                raise
+
+            copyFile(stored,dest)
+        finally:
+            if os.path.lexists(tmp): # rename does nothing if dest is already a link to stored
+                os.remove(tmp)
+
+    def copyFile(self,src,dest,bufsize=BUFSIZE,hashing=True,stop=None):
+        '''
+        Store the contents of `src' if not already stored and link `dest' to them, with the same arguments and return
+        value as copyengine.copyFile but with the returned number of bytes copied being 0 if the contents were stored
+        already. Hashes are always returned since files are stored by hash.
+        '''
+        size=os.path.getsize(src)
+        stored,partial,_=self.index.match(src,size)
+
+        if stored is not None:
+            self._link(stored,dest)
+            with self.lock:
+                self.numLinked+=1
+                self.bytesLinked+=size
+            return 0,(partial,os.path.basename(stored))
+
+        tmp=os.path.join(self.tmpdir,uuid.uuid4().hex)
+        try:
+            copied,(partial,full)=copyFile(src,tmp,bufsize,True,stop)
+            stored=self.getPath(full)
+            os.makedirs(os.path.dirname(stored),exist_ok=True)
+            os.rename(tmp,stored) # if another thread stored the same contents first this replaces it with a copy
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        self.index.addFile(stored,partial,full)
+        self._link(stored,dest)
+        return copied,(partial,full)
+
+    def addExisting(self,path):
+        '''
+        Add the existing file `path' to the store, replacing it with a link to the stored copy if its contents are already
+        stored or otherwise linking it into the store without copying. Returns True if `path' was replaced.
+        '''
+        size=os.path.getsize(path)
+        stored,partial,full=self.index.match(path,size)
+
+        if stored is not None:
+            if os.path.samefile(stored,path):
+                return False
+
+            tmp=os.path.join(self.tmpdir,uuid.uuid4().hex)
+            os.link(stored,tmp)
+            os.rename(tmp,path) # atomically replace so `path' is never missing
+            with self.lock:
+                self.numLinked+=1
+                self.bytesLinked+=size
+            return True
+
+        full=full or fullHash(path)
+        stored=self.getPath(full)
+        os.makedirs(os.path.dirname(stored),exist_ok=True)
+        os.link(path,stored)
+        self.index.addFile(stored,partial or partialHash(path,size),full)
+        return False
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('store',help='Store directory')
+    parser.add_argument('backupdirs',nargs='+',help='Backup directories to add to the store')
+    args=parser.parse_args()
+
+    store=ContentStore(args.store)
+    for backupdir in args.backupdirs:
+        for root,dirs,files in os.walk(backupdir):
+            for f in sorted(files):
+                if f!=MANIFEST:
+                    store.addExisting(os.path.join(root,f))
+
+    print('Replaced %i files with links, %.1fMB freed'%(store.numLinked,store.bytesLinked/1e6))
@@ -0,0 +1,148 @@
+'''
+Event driven detection of directories mounted from USB devices. Partitions of removable disks are tracked from udev add
+and remove events, and mountpoints from the mount table which is only read again when the kernel signals it changed
+by polling /proc/self/mountinfo, so nothing is done while devices aren't being plugged in, removed, or mounted.
+'''
+
+from __future__ import print_function
+import os
+import re
+import select
+import threading
+from collections import defaultdict
+
+MOUNTINFO='/proc/self/mountinfo'
+
+
+def unescapeMountField(field):
+    '''Replace the octal escapes used for spaces and other characters in mount table fields.'''
+    return re.sub(r'\\([0-7]{3})',lambda m:chr(int(m.group(1),8)),field)
+
+
+def readMountTable(filename=MOUNTINFO):
+    '''Returns a dictionary mapping mounted devices to lists of their mountpoints, read from the mountinfo `filename'.'''
+    table=defaultdict(list)
+
+    with open(filename) as f:
+        for line in f:
+            fields=line.split()
+            sep=fields.index('-') # optional fields end with a lone '-' followed by type, source, and options
+            source=unescapeMountField(fields[sep+2])
+            if source.startswith('/dev/'): # resolve links like /dev/disk/by-uuid/... to device nodes
+                source=os.path.realpath(source)
+
+            table[source].append(unescapeMountField(fields[4]))
+
+    return table
+
+
+def isRemovablePartition(device):
+    '''Returns True if the pyudev device `device' is a partition of a removable disk.'''
+    if device.device_type!='partition':
+        return False
+
+    parent=device.find_parent('block','disk')
+    return parent is not None and parent.attributes.asstring('removable')=='1'
+
+
+class EventUSBMonitor(object):
+    '''
+    Monitors for USB devices and fills the member `mounts' with directories mounted from them, as USBMonitor does but
+    driven by events. `handleDevice' is called with udev block device events and `mountTableChanged' when the mount
+    table at `mountinfo' changes, both of which can be called directly to replay events without hardware.
+    '''
+    def __init__(self,context=None,mountinfo=MOUNTINFO):
+        self.context=context
+        self.mountinfo=mountinfo
+        self.partitions=set() # device nodes of partitions of removable disks
+        self.table={} # cached mount table
+        self.mounts=[]
+        self.numTableReads=0 # number of times the mount table has been read
+        self.lock=threading.RLock()
+        self.doRun=True
+        self.timeout=60 # seconds between checks of doRun while waiting for mount table changes
+
+    def addMount(self,m):
+        print('Added',m)
+
+    def removeMount(self,m):
+        print('Removed',m)
+
+    def _update(self):
+        '''Recompute the mountpoints from the known partitions and cached mount table, reporting changes.'''
+        with self.lock:
+            oldmounts=self.mounts
+            self.mounts=sorted(set(m for p in self.partitions for m in self.table.get(p,[])))
+
+            for m in sorted(set(self.mounts).union(oldmounts)):
+                if m not in oldmounts:
+                    self.addMount(m)
+                elif m not in self.mounts:
+                    self.removeMount(m)
+
+    def deviceEvent(self,action,devnode,removable):
+        '''Handle the udev `action' for the partition `devnode' which is a partition of a removable disk if `removable'.'''
+        with self.lock:
+            if action=='add' and removable:
+                self.partitions.add(devnode)
+            elif action=='remove':
+                self.partitions.discard(devnode)
+            else:
+                return
+
+            self._update()
+
+    def handleDevice(self,device):
+        '''Handle an event for the pyudev block device `device'.'''
+        if device.device_type=='partition' and device.device_node:
+            # a removed device's parent may already be gone so removal doesn't depend on it being found removable
+            removable=device.action!='remove' and isRemovablePartition(device)
+            self.deviceEvent(device.action,device.device_node,removable)
+
+    def mountTableChanged(self):
+        '''Read the mount table again and report changed mountpoints.'''
+        with self.lock:
+            self.table=readMountTable(self.mountinfo)
+            self.numTableReads+=1
+            self._update()
+
+    def listPartitions(self):
+        '''Find the partitions of removable disks already present, only needed once at startup.'''
+        with self.lock:
+            for device in self.context.list_devices(subsystem='block',DEVTYPE='partition'):
+                if device.device_node and isRemovablePartition(device):
+                    self.partitions.add(device.device_node)
+
+    def run(self):
+        import pyudev
+
+        monitor=pyudev.Monitor.from_netlink(self.context)
+        monitor.filter_by('block')
+        observer=pyudev.MonitorObserver(monitor,callback=self.handleDevice,name='USBEvents')
+        observer.daemon=True
+        observer.start()
+
+        self.listPartitions()
+        self.mountTableChanged()
+
+        # the kernel signals changes to the mount table with POLLPRI and POLLERR on open mountinfo files
+        with open(self.mountinfo) as f:
+            poller=select.poll()
+            poller.register(f,select.POLLPRI|select.POLLERR)
+
+            while self.doRun:
+                if poller.poll(self.timeout*1000):
+                    self.mountTableChanged()
+
+        observer.stop()
+
+
+class EventMonitorThread(threading.Thread,EventUSBMonitor):
+    '''Create a threaded version of the event monitor.'''
+    def __init__(self,context=None,mountinfo=MOUNTINFO):
+        threading.Thread.__init__(self)
+        EventUSBMonitor.__init__(self,context,mountinfo)
+        self.daemon=True
+
+    def run(self):
+        EventUSBMonitor.run(self)
@@ -0,0 +1,298 @@
+"""
+Sensor and display backends. The hardware backend sets up the Pimoroni breakout sensors and ST7789 display, the simulated
+backend provides deterministic stand-ins with the same interfaces so the logger can be run and profiled off the Pi.
+"""
+
+import math
+import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from display import merge_boxes
+
+
+class HardwareBackend:
+    """The BME688, MICS6814, and BH1745 sensors configured as used by the logger, modules are imported when created."""
+
+    def __init__(self):
+        import bme680
+        import mics6814
+        import bh1745
+
+        try:
+            self.env_sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
+        except (RuntimeError, IOError):
+            self.env_sensor = bme680.BME680(bme680.I2C_ADDR_SECONDARY)
+
+        self.env_sensor.set_humidity_oversample(bme680.OS_2X)
+        self.env_sensor.set_pressure_oversample(bme680.OS_4X)
+        self.env_sensor.set_temperature_oversample(bme680.OS_8X)
+        self.env_sensor.set_filter(bme680.FILTER_SIZE_3)
+        self.env_sensor.set_gas_status(bme680.ENABLE_GAS_MEAS)
+        self.env_sensor.set_gas_heater_temperature(320)
+        self.env_sensor.set_gas_heater_duration(150)
+        self.env_sensor.select_gas_heater_profile(0)
+
+        self.gas_sensor = mics6814.MICS6814()
+
+        self.light_sensor = bh1745.BH1745()
+        self.light_sensor.setup()
+        self.light_sensor.set_leds(0)
+        self.light_sensor._enable_channel_compensation = False
+        # might be sensible values instead of disabling compensation:
+        # self.light_sensor._channel_compensation = (0.9, 0.5, 0.95, 10.0)
+
+
+class SyntheticSignals:
+    """
+    Deterministic synthetic sensor signals, a daily cycle plus seeded noise for each value. Time advances by `period`
+    seconds with each call to `step` so the signals do not depend on how fast they are sampled.
+    """
+
+    def __init__(self, seed=0, period=1.0):
+        self.rng = np.random.default_rng(seed)
+        self.period = period
+        self.t = 0.0
+        self.values = {}
+        self.step()
+
+    def step(self):
+        """Advance to the next sample time and compute new values."""
+        self.t += self.period
+        day = math.sin(2 * math.pi * self.t / 86400)
+        noise = self.rng.normal(0, 1, 10)
+
+        self.values = dict(
+            temperature=21.0 + 3.0 * day + 0.05 * noise[0],
+            pressure=1013.0 + 5.0 * math.sin(2 * math.pi * self.t / 604800) + 0.02 * noise[1],
+            humidity=45.0 - 8.0 * day + 0.1 * noise[2],
+            gas_resistance=250000.0 + 50000.0 * day + 2000.0 * noise[3],
+            oxidising=20000.0 + 3000.0 * day + 200.0 * noise[4],
+            reducing=400000.0 - 40000.0 * day + 2000.0 * noise[5],
+            nh3=100000.0 + 10000.0 * day + 500.0 * noise[6],
+            light=max(0.0, 500.0 * day + 20.0 * noise[7]),
+        )
+
+
+class SimulatedSensor:
+    """Base for simulated sensors, each read waits `latency` seconds and fails with probability `fault_rate`."""
+
+    def __init__(self, signals, latency=0.0, fault_rate=0.0, seed=0):
+        self.signals = signals
+        self.latency = latency
+        self.fault_rate = fault_rate
+        self.fault_rng = np.random.default_rng(seed)
+
+    def _read(self):
+        """Wait for the read latency and return True if this read should fail."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        return self.fault_rate > 0 and self.fault_rng.random() < self.fault_rate
+
+
+class SimulatedBME680(SimulatedSensor):
+    """Simulated BME680/BME688, each successful `get_sensor_data` call advances the signals to the next sample."""
+
+    def __init__(self, signals, latency=0.0, fault_rate=0.0, seed=0):
+        super().__init__(signals, latency, fault_rate, seed)
+        self.data = SimpleNamespace(heat_stable=False)
+
+    def get_sensor_data(self):
+        if self._read():
+            return False
+
+        self.signals.step()
+        vals = self.signals.values
+        self.data = SimpleNamespace(
+            temperature=vals["temperature"],
+            pressure=vals["pressure"],
+            humidity=vals["humidity"],
+            gas_resistance=vals["gas_resistance"],
+            heat_stable=True,
+        )
+
+        return True
+
+
+class SimulatedMICS6814(SimulatedSensor):
+    """Simulated MICS6814 gas sensor, reads raise IOError on faults."""
+
+    def _value(self, name):
+        if self._read():
+            raise IOError(f"Simulated MICS6814 fault reading {name}")
+
+        return self.signals.values[name]
+
+    def read_oxidising(self):
+        return self._value("oxidising")
+
+    def read_reducing(self):
+        return self._value("reducing")
+
+    def read_nh3(self):
+        return self._value("nh3")
+
+    def set_led(self, r, g, b):
+        pass
+
+
+class SimulatedBH1745(SimulatedSensor):
+    """Simulated BH1745 light sensor returning a slightly warm white light, reads raise IOError on faults."""
+
+    def setup(self):
+        pass
+
+    def set_leds(self, state):
+        pass
+
+    def get_rgbc_raw(self):
+        if self._read():
+            raise IOError("Simulated BH1745 fault")
+
+        c = self.signals.values["light"]
+        return int(c * 0.4), int(c * 0.35), int(c * 0.25), int(c)
+
+
+class SimulatedBackend:
+    """
+    Simulated sensors sharing one set of synthetic signals seeded by `seed`. Every read takes `latency` seconds and
+    fails with probability `fault_rate`, and signals advance by `period` seconds per environment sensor reading.
+    """
+
+    def __init__(self, seed=0, latency=0.0, fault_rate=0.0, period=1.0):
+        self.signals = SyntheticSignals(seed, period)
+        self.env_sensor = SimulatedBME680(self.signals, latency, fault_rate, seed + 1)
+        self.gas_sensor = SimulatedMICS6814(self.signals, latency, fault_rate, seed + 2)
+        self.light_sensor = SimulatedBH1745(self.signals, latency, fault_rate, seed + 3)
+
+
+class NullDisplay:
+    """Display sink which discards images."""
+
+    def begin(self):
+        pass
+
+    def display(self, image):
+        pass
+
+    def update(self, array, dirty):
+        pass
+
+
+class FileDisplay:
+    """Display sink which saves each image to `filename`, overwriting the previous image."""
+
+    def __init__(self, filename):
+        self.filename = filename
+
+    def begin(self):
+        pass
+
+    def display(self, image):
+        image.save(self.filename)
+
+    def update(self, array, dirty):
+        """Save the (height, width, 3) image `array` if any of the boxes in `dirty` changed."""
+        if dirty:
+            self.display(Image.fromarray(array))
+
+
+def rgb565(array):
+    """Convert the (height, width, 3) uint8 RGB `array` to the big-endian RGB565 bytes the ST7789 expects."""
+    r, g, b = (array[..., i].astype(np.uint16) for i in range(3))
+    return (((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)).astype(">u2").tobytes()
+
+
+def rotate_box(box, width, height, rotation):
+    """
+    Returns the box (x0, y0, x1, y1) in an image of size `width` by `height` moved to where it is in the image rotated
+    by `rotation` degrees counterclockwise as np.rot90 does, a multiple of 90.
+    """
+    x0, y0, x1, y1 = box
+    for _ in range((rotation // 90) % 4):
+        x0, y0, x1, y1 = y0, width - x1, y1, width - x0
+        width, height = height, width
+
+    return x0, y0, x1, y1
+
+
+class ST7789Display:
+    """
+    Pushes images to the ST7789 `disp`, created with rotation `rotation`, sending only changed regions when updated. The
+    panel keeps its contents so each dirty box, merged with others if this wastes fewer than `merge_slack` pixels, is
+    sent in its own window, and nothing is sent when no box is dirty. Bytes and windows sent are counted in `sent` and
+    `windows` for profiling.
+    """
+
+    def __init__(self, disp, rotation=90, merge_slack=256, chunk_size=4096):
+        self.disp = disp
+        self.rotation = rotation
+        self.merge_slack = merge_slack
+        self.chunk_size = chunk_size
+        self.sent = 0
+        self.windows = 0
+
+    def begin(self):
+        self.disp.begin()
+
+    def display(self, image):
+        """Push the whole of the PIL `image`."""
+        self.update(np.asarray(image.convert("RGB")), [(0, 0) + image.size])
+
+    def update(self, array, dirty):
+        """Push the boxes (x0, y0, x1, y1) in `dirty` of the (height, width, 3) image `array` to the display."""
+        height, width = array.shape[:2]
+        rotated = np.rot90(array, self.rotation // 90)
+
+        for box in merge_boxes(dirty, self.merge_slack):
+            x0, y0, x1, y1 = rotate_box(box, width, height, self.rotation)
+            data = rgb565(rotated[y0:y1, x0:x1])
+
+            self.disp.set_window(x0, y0, x1 - 1, y1 - 1)
+            for i in range(0, len(data), self.chunk_size):
+                self.disp.data(list(data[i : i + self.chunk_size]))
+
+            self.sent += len(data)
+            self.windows += 1
+
+
+def create_backend(name, **kwargs):
+    """Create the sensor backend named "hardware" or "simulated", `kwargs` are passed to the simulated backend."""
+    if name == "hardware":
+        return HardwareBackend()
+    elif name == "simulated":
+        return SimulatedBackend(**kwargs)
+    else:
+        raise ValueError(f"Unknown backend {name}")
+
+
+def create_display(name, filename=None):
+    """Create the display named "st7789", "file" which saves to `filename`, or "null"."""
+    if name == "st7789":
+        import st7789
+
+        rotation = 90
+        disp = ST7789Display(
+            st7789.ST7789(
+                port=0,
+                cs=st7789.BG_SPI_CS_FRONT,  # BG_SPI_CS_BACK or BG_SPI_CS_FRONT
+                dc=9,
+                backlight=19,  # 18 for back BG slot, 19 for front BG slot.
+                spi_speed_hz=80 * 1000 * 1000,
+                offset_left=0,
+                rotation=rotation,
+            ),
+            rotation,
+        )
+    elif name == "file":
+        disp = FileDisplay(filename)
+    elif name == "null":
+        disp = NullDisplay()
+    else:
+        raise ValueError(f"Unknown display {name}")
+
+    disp.begin()
+    return disp
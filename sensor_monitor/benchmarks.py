@@ -0,0 +1,391 @@
+"""Benchmarks for the sensor logger components, these run without any sensor hardware."""
+
+import csv
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import click
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backends import SimulatedBackend, NullDisplay, ST7789Display, rgb565
+from database import Reading, BatchWriter, create_log_engine
+from display import FONT_FILE, GraphRenderer, draw_sensors
+from ringbuffer import SensorRingBuffer
+from reader import read_log, export_log
+from sensor_logger import GRAPH_FIELDS, collect_data
+from pipeline import SensorPipeline
+from iaq import AdaptiveBaseline, StreamingIAQ, compute_iaq, iaq_scalar
+
+
+def synthetic_rows(num_rows, seed=0):
+    """Generate `num_rows` reading dictionaries with random values at 1 second intervals."""
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1)
+    vals = rng.uniform(0, 1000, (num_rows, 8))
+    rgbc = rng.integers(0, 1000, (num_rows, 4))
+
+    for i in range(num_rows):
+        v = vals[i].tolist()
+        r, g, b, c = rgbc[i].tolist()
+        yield dict(
+            date=start + timedelta(seconds=i),
+            temperature=v[0],
+            pressure=v[1],
+            humidity=v[2],
+            gas_resistance=v[3],
+            iaq=v[4],
+            oxidising=v[5],
+            reducing=v[6],
+            nh3=v[7],
+            r=r,
+            g=g,
+            b=b,
+            c=c,
+        )
+
+
+def _remove_db(filename):
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(filename + suffix):
+            os.remove(filename + suffix)
+
+
+def _db_path(path, name):
+    if path == ":memory:":
+        return path
+
+    filename = os.path.join(path, name)
+    _remove_db(filename)
+
+    return filename
+
+
+@click.group()
+def cli():
+    """Benchmarks for sensor_logger, results are printed to the console."""
+
+
+@cli.command()
+@click.option("-n", "--num_rows", type=int, default=5000, show_default=True, help="Number of readings to write")
+@click.option("-f", "--flush_size", type=int, default=100, show_default=True, help="Batch writer flush size")
+@click.option(
+    "-p",
+    "--path",
+    default="/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(),
+    show_default=True,
+    help="Directory for the benchmark databases, or :memory: for in-memory databases",
+)
+def writer(num_rows, flush_size, path):
+    """Compare the per-row commit path against the batched write-behind writer."""
+    rows = list(synthetic_rows(num_rows))
+
+    per_row_db = _db_path(path, "bench_per_row.sqlite")
+    batched_db = _db_path(path, "bench_batched.sqlite")
+
+    engine = create_log_engine(per_row_db, wal=False)
+    start = time.perf_counter()
+    for row in rows:
+        with Session(engine) as session:
+            session.add(Reading(**row))
+            session.commit()
+    per_row = time.perf_counter() - start
+
+    engine = create_log_engine(batched_db)
+    start = time.perf_counter()
+    with BatchWriter(engine, flush_size, flush_interval=60.0) as bw:
+        for row in rows:
+            bw.write(row)
+    batched = time.perf_counter() - start
+
+    with Session(engine) as session:
+        assert session.query(Reading).count() == num_rows
+
+    engine.dispose()
+    if path != ":memory:":
+        _remove_db(per_row_db)
+        _remove_db(batched_db)
+
+    print(f"per-row commit: {per_row:.3f}s, {num_rows / per_row:.1f} rows/s")
+    print(f"batched writer: {batched:.3f}s, {num_rows / batched:.1f} rows/s, speedup {per_row / batched:.1f}x")
+
+
+@cli.command()
+@click.option("-n", "--num_frames", type=int, default=200, show_default=True, help="Number of frames to render")
+@click.option("-m", "--max_data_len", type=int, default=60 * 12, show_default=True, help="Ring buffer size")
+@click.option("--font_file", default=FONT_FILE, show_default=True, help="TrueType font to render labels with")
+def render(num_frames, max_data_len, font_file):
+    """Compare frames per second of draw_sensors against GraphRenderer, checking both produce identical images."""
+    rows = list(synthetic_rows(num_frames + max_data_len))
+    buffers = SensorRingBuffer(max_data_len)
+    draw_values = [(label, unit, buffers[field]) for label, unit, field in GRAPH_FIELDS]
+
+    for row in rows[:max_data_len]:
+        buffers.append(row)
+
+    renderer = GraphRenderer(font_file=font_file)
+    draw_time = render_time = 0.0
+
+    for row in rows[max_data_len:]:
+        buffers.append(row)
+
+        start = time.perf_counter()
+        im1 = draw_sensors(draw_values, font_file=font_file)
+        draw_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        im2 = renderer.render(draw_values)
+        render_time += time.perf_counter() - start
+
+        assert im1.tobytes() == im2.tobytes(), "Rendered images differ"
+
+    print(f"draw_sensors:  {num_frames / draw_time:.1f} fps")
+    print(f"GraphRenderer: {num_frames / render_time:.1f} fps, speedup {draw_time / render_time:.1f}x")
+
+
+class PanelST7789:
+    """Stand-in for st7789.ST7789 keeping the RGB565 panel memory written through windows, to check partial updates."""
+
+    def __init__(self, width=240, height=240):
+        self.memory = np.zeros((height, width), ">u2")
+        self.window = None
+        self.pending = bytearray()
+
+    def begin(self):
+        pass
+
+    def set_window(self, x0, y0, x1, y1):
+        self.window = (x0, y0, x1 + 1, y1 + 1)
+        self.pending = bytearray()
+
+    def data(self, data):
+        x0, y0, x1, y1 = self.window
+        self.pending += bytes(data)
+        if len(self.pending) == (x1 - x0) * (y1 - y0) * 2:
+            self.memory[y0:y1, x0:x1] = np.frombuffer(self.pending, ">u2").reshape(y1 - y0, x1 - x0)
+
+
+@cli.command()
+@click.option("-n", "--num_frames", type=int, default=200, show_default=True, help="Number of frames to push")
+@click.option("-m", "--max_data_len", type=int, default=60 * 12, show_default=True, help="Ring buffer size")
+@click.option("--font_file", default=FONT_FILE, show_default=True, help="TrueType font to render labels with")
+def push(num_frames, max_data_len, font_file):
+    """
+    Compare bytes sent to the ST7789 pushing whole frames against pushing only dirty regions, with a new reading every
+    frame and with repeated frames, checking the panel memory matches the last image.
+    """
+    rows = list(synthetic_rows(num_frames + max_data_len))
+    buffers = SensorRingBuffer(max_data_len)
+    draw_values = [(label, unit, buffers[field]) for label, unit, field in GRAPH_FIELDS]
+
+    for row in rows[:max_data_len]:
+        buffers.append(row)
+
+    full_frame = 240 * 240 * 2
+
+    for name, repeat in (("new readings", False), ("repeated frames", True)):
+        renderer = GraphRenderer(font_file=font_file)
+        panel = PanelST7789()
+        disp = ST7789Display(panel)
+        renderer.render(draw_values)
+        disp.update(renderer.array, renderer.dirty)
+        start_sent, start_windows = disp.sent, disp.windows
+
+        start = time.perf_counter()
+        for row in rows[max_data_len : max_data_len + num_frames]:
+            if not repeat:
+                buffers.append(row)
+
+            renderer.render(draw_values)
+            disp.update(renderer.array, renderer.dirty)
+        push_time = time.perf_counter() - start
+
+        expected = np.frombuffer(rgb565(np.rot90(renderer.array, disp.rotation // 90)), ">u2")
+        assert np.array_equal(panel.memory.ravel(), expected), "Panel memory differs from the last image"
+
+        sent = (disp.sent - start_sent) / num_frames
+        windows = (disp.windows - start_windows) / num_frames
+        print(
+            f"{name + ':':16} {sent:8.0f} bytes/frame, {windows:.1f} windows/frame, "
+            f"{100 * sent / full_frame:.1f}% of full frames, {num_frames / push_time:.1f} fps"
+        )
+
+
+def _timed(func, repeats):
+    """Returns the best time in seconds of `repeats` calls to `func` and the last result."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+
+    return best, result
+
+
+@cli.command()
+@click.option("-n", "--num_rows", type=int, default=200000, show_default=True, help="Number of readings in the log")
+@click.option("-r", "--repeats", type=int, default=3, show_default=True, help="Number of times to repeat each read")
+@click.option(
+    "-p",
+    "--path",
+    default=tempfile.gettempdir(),
+    show_default=True,
+    help="Directory for the benchmark log files",
+)
+def reader(num_rows, repeats, path):
+    """Compare the notebooks' pandas CSV loading against the reader module for CSV, Sqlite, and .npz logs."""
+    import pandas as pd
+
+    rows = list(synthetic_rows(num_rows))
+    csv_log = os.path.join(path, "bench_log.csv")
+    sqlite_log = _db_path(path, "bench_log.sqlite")
+    npz_log = os.path.join(path, "bench_log.npz")
+
+    with open(csv_log, "w", newline="") as o:
+        writer = csv.DictWriter(o, ["time"] + list(rows[0])[1:])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({"time": str(row["date"]), **{k: v for k, v in row.items() if k != "date"}})
+
+    engine = create_log_engine(sqlite_log)
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.insert(), rows)
+    engine.dispose()
+
+    export_log(sqlite_log, npz_log)
+
+    def notebook_csv():
+        df = pd.read_csv(csv_log).dropna()
+        df["time"] = pd.to_datetime(df["time"], format="mixed")
+        return df.set_index("time")
+
+    end = rows[num_rows // 10]["date"]
+    results = {
+        "notebook CSV": _timed(notebook_csv, repeats),
+        "reader CSV": _timed(lambda: read_log(csv_log), repeats),
+        "reader Sqlite": _timed(lambda: read_log(sqlite_log), repeats),
+        "reader .npz": _timed(lambda: read_log(npz_log), repeats),
+        "reader .npz, 2 fields": _timed(lambda: read_log(npz_log, ["temperature", "iaq"]), repeats),
+        "reader Sqlite, 2 fields, 10%": _timed(lambda: read_log(sqlite_log, ["temperature", "iaq"], end=end), repeats),
+    }
+
+    base = results["notebook CSV"][0]
+    for name, (secs, _) in results.items():
+        print(f"{name + ':':30} {secs:.3f}s, {num_rows / secs:.0f} rows/s, speedup {base / secs:.1f}x")
+
+    assert np.allclose(results["reader CSV"][1]["temperature"], results["reader .npz"][1]["temperature"])
+    assert np.array_equal(results["reader CSV"][1]["date"], results["reader .npz"][1]["date"])
+
+    for filename in (csv_log, npz_log):
+        os.remove(filename)
+    _remove_db(sqlite_log)
+
+
+@cli.command()
+@click.option("-n", "--num_samples", type=int, default=5000, show_default=True, help="Number of samples to collect")
+@click.option("-i", "--interval", type=int, default=60, show_default=True, help="Display update interval")
+@click.option("-m", "--max_data_len", type=int, default=60 * 12, show_default=True, help="Ring buffer size")
+@click.option("--latency", type=float, default=0.0, show_default=True, help="Simulated sensor read latency")
+@click.option("--fault_rate", type=float, default=0.0, show_default=True, help="Simulated sensor fault rate")
+@click.option("--font_file", default=FONT_FILE, show_default=True, help="TrueType font to render labels with")
+def pipeline(num_samples, interval, max_data_len, latency, fault_rate, font_file):
+    """Run the collect, store, rollup, and render loop on simulated sensors and report throughput."""
+    sensors = SimulatedBackend(latency=latency, fault_rate=fault_rate)
+    buffers = SensorRingBuffer(max_data_len)
+    draw_values = [(label, unit, buffers[field]) for label, unit, field in GRAPH_FIELDS]
+    renderer = GraphRenderer(font_file=font_file)
+    disp = NullDisplay()
+    engine = create_log_engine(":memory:")
+    faults = 0
+    collect_time = render_time = 0.0
+
+    start = time.perf_counter()
+    with BatchWriter(engine) as bw:
+        for i in range(num_samples):
+            t0 = time.perf_counter()
+            try:
+                dat = collect_data(sensors.gas_sensor, sensors.env_sensor, sensors.light_sensor, StreamingIAQ(250000.0))
+            except IOError:
+                faults += 1
+                continue
+            finally:
+                collect_time += time.perf_counter() - t0
+
+            bw.write(dat)
+
+            if i % interval == 0:
+                t0 = time.perf_counter()
+                buffers.append(dat)
+                disp.display(renderer.render(draw_values))
+                render_time += time.perf_counter() - t0
+
+    total = time.perf_counter() - start
+
+    with Session(engine) as session:
+        stored = session.query(Reading).count()
+
+    print(f"{num_samples} samples in {total:.3f}s, {num_samples / total:.1f} samples/s")
+    print(f"collect {collect_time:.3f}s, render {render_time:.3f}s, {faults} faults, {stored} rows stored")
+
+
+@cli.command()
+@click.option("-n", "--num_samples", type=int, default=200, show_default=True, help="Number of samples to collect")
+@click.option("-d", "--delay", type=float, default=0.05, show_default=True, help="Delay between samples")
+@click.option("-i", "--interval", type=int, default=5, show_default=True, help="Display update interval")
+@click.option("--display_time", type=float, default=0.3, show_default=True, help="Extra time spent per display update")
+@click.option("--font_file", default=FONT_FILE, show_default=True, help="TrueType font to render labels with")
+def jitter(num_samples, delay, interval, display_time, font_file):
+    """Measure sampling jitter of the staged pipeline while display updates are slow."""
+    sensors = SimulatedBackend()
+    buffers = SensorRingBuffer(60 * 12)
+    draw_values = [(label, unit, buffers[field]) for label, unit, field in GRAPH_FIELDS]
+    renderer = GraphRenderer(font_file=font_file)
+
+    def sample():
+        return collect_data(sensors.gas_sensor, sensors.env_sensor, sensors.light_sensor, StreamingIAQ(250000.0))
+
+    def show(dat):
+        buffers.append(dat)
+        renderer.render(draw_values)
+        time.sleep(display_time)
+
+    with BatchWriter(create_log_engine(":memory:")) as bw:
+        pipeline = SensorPipeline(sample, bw, show, delay, interval)
+        pipeline.run(num_samples)
+
+    print(pipeline.summary())
+
+
+@cli.command()
+@click.option("-n", "--num_samples", type=int, default=200000, show_default=True, help="Number of samples to score")
+@click.option("-r", "--repeats", type=int, default=3, show_default=True, help="Number of times to repeat scoring")
+def iaq(num_samples, repeats):
+    """Compare scalar and vectorized IAQ scoring of a log, checking both produce identical scores."""
+    rng = np.random.default_rng(0)
+    gas = rng.uniform(100000, 400000, num_samples)
+    hum = rng.uniform(20, 70, num_samples)
+    gas_baseline = 250000.0
+
+    scalar_time, scalar = _timed(
+        lambda: np.array([iaq_scalar(g, h, gas_baseline) for g, h in zip(gas.tolist(), hum.tolist())]), repeats
+    )
+    vector_time, vector = _timed(lambda: compute_iaq(gas, hum, gas_baseline), repeats)
+
+    assert np.array_equal(scalar, vector), "Scalar and vectorized scores differ"
+
+    for mode in AdaptiveBaseline.MODES:
+        model = StreamingIAQ(AdaptiveBaseline(gas_baseline, mode))
+        streamed = np.array([model.update(g, h) for g, h in zip(gas.tolist(), hum.tolist())])
+        baselines = AdaptiveBaseline(gas_baseline, mode).series(gas)
+
+        assert np.array_equal(streamed, compute_iaq(gas, hum, baselines)), f"Rescored {mode} baseline scores differ"
+
+    print(f"scalar:     {scalar_time:.3f}s, {num_samples / scalar_time:.0f} samples/s")
+    speedup = scalar_time / vector_time
+    print(f"vectorized: {vector_time:.3f}s, {num_samples / vector_time:.0f} samples/s, speedup {speedup:.1f}x")
+
+
+if __name__ == "__main__":
+    cli()
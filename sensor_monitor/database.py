@@ -0,0 +1,433 @@
+"""Database definitions and the write-behind writer used to log sensor readings to Sqlite."""
+
+import queue
+import sys
+import threading
+import time
+import traceback
+from datetime import datetime
+from functools import lru_cache
+
+import click
+import sqlalchemy
+from sqlalchemy import Column, DateTime, Float, Integer, Table
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.pool import StaticPool
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Reading(Base):
+    """Table definition for log sqlite files."""
+
+    __tablename__ = "readings"
+    date: Mapped[datetime] = mapped_column(primary_key=True)
+    temperature: Mapped[float]
+    pressure: Mapped[float]
+    humidity: Mapped[float]
+    gas_resistance: Mapped[float]
+    iaq: Mapped[float]
+    oxidising: Mapped[float]
+    reducing: Mapped[float]
+    nh3: Mapped[float]
+    r: Mapped[int]
+    g: Mapped[int]
+    b: Mapped[int]
+    c: Mapped[int]
+
+
+class GasBaseline(Base):
+    """
+    Gas resistance baselines used to compute IAQ and when they were set. Provisional baselines are stored baselines used
+    from startup until the burn-in completes, so IAQ values of readings before the next non-provisional baseline are
+    provisional.
+    """
+
+    __tablename__ = "gas_baselines"
+    date: Mapped[datetime] = mapped_column(primary_key=True)
+    baseline: Mapped[float]
+    provisional: Mapped[bool]
+
+
+# rollup periods mapped to a function truncating datetimes to the start of their period, and the equivalent Sqlite
+# strftime format which produces the same string that a truncated datetime is stored as
+ROLLUP_PERIODS = {
+    "minute": (lambda d: d.replace(second=0, microsecond=0), "%Y-%m-%d %H:%M:00.000000"),
+    "hour": (lambda d: d.replace(minute=0, second=0, microsecond=0), "%Y-%m-%d %H:00:00.000000"),
+    "day": (lambda d: d.replace(hour=0, minute=0, second=0, microsecond=0), "%Y-%m-%d 00:00:00.000000"),
+}
+
+ROLLUP_FIELDS = [c.name for c in Reading.__table__.columns if c.name != "date"]
+ROLLUP_STATS = ("min", "mean", "max")
+
+
+def _rollup_table(period):
+    """Define the rollup table for `period`, which stores the count and min/mean/max of every field per period."""
+    stat_cols = [Column(f"{f}_{s}", Float) for f in ROLLUP_FIELDS for s in ROLLUP_STATS]
+    return Table(
+        f"readings_{period}",
+        Base.metadata,
+        Column("date", DateTime, primary_key=True),
+        Column("count", Integer, nullable=False),
+        *stat_cols,
+    )
+
+
+ROLLUP_TABLES = {period: _rollup_table(period) for period in ROLLUP_PERIODS}
+
+
+def create_log_engine(logfile, wal=True, tables=None):
+    """
+    Create the engine for the Sqlite file `logfile` and create any missing tables, or only those in `tables` if given.
+    If `wal` is True the database is put into WAL journal mode with normal synchronisation, so commits append to the log
+    rather than rewrite the database file. The name ":memory:" creates a single in-memory database shared between
+    threads.
+    """
+    if logfile == ":memory:":
+        engine = sqlalchemy.create_engine(
+            "sqlite://", echo=False, poolclass=StaticPool, connect_args={"check_same_thread": False}
+        )
+    else:
+        engine = sqlalchemy.create_engine(f"sqlite:///{logfile}", echo=False)
+
+    if wal:
+
+        @sqlalchemy.event.listens_for(engine, "connect")
+        def _set_pragmas(dbapi_conn, _):
+            cursor = dbapi_conn.cursor()
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.close()
+
+    Base.metadata.create_all(engine, tables)
+
+    return engine
+
+
+@lru_cache(maxsize=None)
+def _rollup_upsert(period):
+    """Returns the statement merging aggregated rows into an existing rollup row, or inserting if not present."""
+    table = ROLLUP_TABLES[period]
+    stmt = sqlite_insert(table)
+    old, new = table.c, stmt.excluded
+    total = old.count + new.count
+
+    values = {"count": total}
+    for f in ROLLUP_FIELDS:
+        values[f"{f}_min"] = sqlalchemy.func.min(old[f"{f}_min"], new[f"{f}_min"])
+        values[f"{f}_max"] = sqlalchemy.func.max(old[f"{f}_max"], new[f"{f}_max"])
+        values[f"{f}_mean"] = (old[f"{f}_mean"] * old.count + new[f"{f}_mean"] * new.count) / total
+
+    return stmt.on_conflict_do_update(index_elements=["date"], set_=values)
+
+
+def aggregate_rows(rows, period):
+    """Aggregate the reading dictionaries `rows` into rollup rows for `period`, returned as a list of dictionaries."""
+    truncate = ROLLUP_PERIODS[period][0]
+    buckets = {}
+
+    for row in rows:
+        key = truncate(row["date"])
+        agg = buckets.get(key)
+
+        if agg is None:
+            agg = buckets[key] = {"date": key, "count": 0}
+            for f in ROLLUP_FIELDS:
+                agg[f"{f}_min"] = agg[f"{f}_max"] = row[f]
+                agg[f"{f}_mean"] = 0.0  # holds the sum until all rows are added
+
+        agg["count"] += 1
+        for f in ROLLUP_FIELDS:
+            v = row[f]
+            agg[f"{f}_mean"] += v
+            if v < agg[f"{f}_min"]:
+                agg[f"{f}_min"] = v
+            if v > agg[f"{f}_max"]:
+                agg[f"{f}_max"] = v
+
+    for agg in buckets.values():
+        for f in ROLLUP_FIELDS:
+            agg[f"{f}_mean"] /= agg["count"]
+
+    return list(buckets.values())
+
+
+def update_rollups(conn, rows):
+    """Merge the reading dictionaries `rows` into every rollup table using the connection `conn`."""
+    for period in ROLLUP_PERIODS:
+        conn.execute(_rollup_upsert(period), aggregate_rows(rows, period))
+
+
+def select_new_rows(conn, table, rows, chunk_size=500):
+    """
+    Returns the reading dictionaries of `rows` whose dates aren't already in `table` or earlier in `rows`, which are
+    those an insert ignoring conflicting dates would add. Existing dates are queried in chunks of `chunk_size` using
+    `conn`.
+    """
+    dates = [row["date"] for row in rows]
+    seen = set()
+
+    for i in range(0, len(dates), chunk_size):
+        stmt = sqlalchemy.select(table.c.date).where(table.c.date.in_(dates[i : i + chunk_size]))
+        seen.update(conn.execute(stmt).scalars())
+
+    new_rows = []
+    for row in rows:
+        if row["date"] not in seen:
+            seen.add(row["date"])
+            new_rows.append(row)
+
+    return new_rows
+
+
+def backfill_rollups(engine):
+    """Rebuild every rollup table from all the readings in the database of `engine`, replacing existing rollup rows."""
+    Base.metadata.create_all(engine)
+    readings = Reading.__table__
+
+    with engine.begin() as conn:
+        for period, (_, fmt) in ROLLUP_PERIODS.items():
+            table = ROLLUP_TABLES[period]
+            bucket = sqlalchemy.func.strftime(fmt, readings.c.date)
+            cols = [bucket, sqlalchemy.func.count()]
+            for f in ROLLUP_FIELDS:
+                col = readings.c[f]
+                cols += [sqlalchemy.func.min(col), sqlalchemy.func.avg(col), sqlalchemy.func.max(col)]
+
+            select = sqlalchemy.select(*cols).group_by(bucket)
+            conn.execute(table.delete())
+            conn.execute(table.insert().from_select([c.name for c in table.columns], select))
+
+
+def select_rollup(period, start=None, end=None):
+    """Returns a select statement for rows of the rollup table for `period` with dates in the range [`start`, `end`)."""
+    table = ROLLUP_TABLES[period]
+    stmt = sqlalchemy.select(table).order_by(table.c.date)
+
+    if start is not None:
+        stmt = stmt.where(table.c.date >= start)
+    if end is not None:
+        stmt = stmt.where(table.c.date < end)
+
+    return stmt
+
+
+def save_baseline(engine, baseline, provisional=False, date=None):
+    """
+    Store the gas baseline `baseline` set at `date` (default now) in the database of `engine`. Raises ValueError if the
+    baseline isn't a positive value, since scores computed with it would be meaningless.
+    """
+    if not baseline > 0:
+        raise ValueError(f"Invalid gas baseline {baseline}")
+
+    row = dict(date=date or datetime.now(), baseline=baseline, provisional=provisional)
+    stmt = sqlite_insert(GasBaseline.__table__).values(row)
+
+    with engine.begin() as conn:
+        conn.execute(stmt.on_conflict_do_update(index_elements=["date"], set_=row))
+
+
+def load_baseline(engine, max_age=None):
+    """
+    Returns the latest non-provisional gas baseline stored in the database of `engine` and its date as a tuple, or None
+    if there is none or it is older than the timedelta `max_age`. Invalid baselines, not positive, are ignored.
+    """
+    table = GasBaseline.__table__
+    stmt = sqlalchemy.select(table.c.baseline, table.c.date).where(~table.c.provisional & (table.c.baseline > 0))
+
+    with engine.connect() as conn:
+        row = conn.execute(stmt.order_by(table.c.date.desc()).limit(1)).first()
+
+    if row is None or (max_age is not None and datetime.now() - row.date > max_age):
+        return None
+
+    return row.baseline, row.date
+
+
+def is_transient_error(exc):
+    """Returns True if the database exception `exc` may succeed when retried, ie. the database is locked or busy."""
+    msg = str(exc).lower()
+    return isinstance(exc, sqlalchemy.exc.OperationalError) and ("locked" in msg or "busy" in msg)
+
+
+class BatchWriter:
+    """
+    Write-behind writer for `Reading` rows. Rows given to `write` are put into a bounded queue which a background thread
+    drains, inserting rows in bulk in a single transaction once `flush_size` rows are pending or `flush_interval` seconds
+    have passed since the last flush. Calling `close` (or leaving a `with` block) flushes all pending rows. If the
+    database is locked pending rows are kept and retried, dropping the oldest beyond `max_pending`, and the error is
+    re-raised by the next call to `flush`. Otherwise the batch is retried one row at a time and rows which still fail,
+    such as those with NaN values, are logged and dropped, counted in `num_dropped`. Errors are never raised by `write`
+    so the caller's readings are always queued. If `rollups` is True the rollup tables are updated with the written
+    rows in the same transaction. If `stats` is given its `add` method is called with the time in seconds taken by each
+    commit.
+    """
+
+    _FLUSH = object()  # queue marker requesting a flush, paired with an Event to set when done
+    _STOP = object()  # queue marker requesting a final flush and thread exit
+
+    def __init__(
+        self,
+        engine,
+        flush_size=100,
+        flush_interval=10.0,
+        max_queue=10000,
+        table=Reading.__table__,
+        rollups=True,
+        stats=None,
+        max_pending=10000,
+    ):
+        self.engine = engine
+        self.rollups = rollups
+        self.stats = stats
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.table = table
+        self.queue = queue.Queue(max_queue)
+        self.pending = []  # rows taken from the queue and not yet committed, only accessed by the writer thread
+        self.max_pending = max_pending
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_flushes = 0
+        self.exc = None  # last transient exception raised in the writer thread, re-raised by flush
+        self._thread = threading.Thread(target=self._run, name="BatchWriter", daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _check_exception(self):
+        exc, self.exc = self.exc, None
+        if exc is not None:
+            raise exc
+
+    def write(self, row):
+        """Queue the dictionary `row` for writing, blocking if the queue is full."""
+        self.queue.put(row)
+
+    def flush(self, timeout=None):
+        """Write all rows queued so far and wait until they are committed."""
+        done = threading.Event()
+        self.queue.put((self._FLUSH, done))
+        done.wait(timeout)
+        self._check_exception()
+
+    def close(self, timeout=None):
+        """Flush all pending rows and stop the writer thread."""
+        if self._thread.is_alive():
+            self.queue.put(self._STOP)
+            self._thread.join(timeout)
+
+    def _insert(self, rows):
+        """Insert `rows` and update the rollups with those inserted in one transaction."""
+        # duplicate timestamps are ignored rather than failing the whole batch, and mustn't be counted in rollups
+        stmt = sqlite_insert(self.table).on_conflict_do_nothing()
+        with self.engine.begin() as conn:
+            if self.rollups:
+                rows = select_new_rows(conn, self.table, rows)
+
+            if rows:
+                conn.execute(stmt, rows)
+                if self.rollups:
+                    update_rollups(conn, rows)
+
+    def _insert_each(self):
+        """Insert the pending rows one at a time, dropping those which fail unless the failure is transient."""
+        for i, row in enumerate(self.pending):
+            try:
+                self._insert([row])
+            except Exception as e:
+                if is_transient_error(e):
+                    self.pending = self.pending[i:]
+                    raise
+
+                print(f"BatchWriter: dropping row {row}: {e}", file=sys.stderr)
+                self.num_dropped += 1
+            else:
+                self.num_written += 1
+
+        self.pending = []
+
+    def _limit_pending(self):
+        """Drop the oldest pending rows beyond `max_pending` so retrying can't use unbounded memory."""
+        excess = len(self.pending) - self.max_pending
+        if excess > 0:
+            print(f"BatchWriter: dropping {excess} rows waiting for the database", file=sys.stderr)
+            del self.pending[:excess]
+            self.num_dropped += excess
+
+    def _commit(self):
+        if not self.pending:
+            return
+
+        start = time.perf_counter()
+
+        try:
+            try:
+                self._insert(self.pending)
+            except Exception as e:
+                if is_transient_error(e):
+                    raise
+
+                self._insert_each()  # find and drop the rows which can't be inserted
+            else:
+                self.num_written += len(self.pending)
+                self.pending = []
+        except Exception as e:
+            traceback.print_exc()
+            self.exc = e
+            self._limit_pending()
+        else:
+            self.num_flushes += 1
+
+            if self.stats is not None:
+                self.stats.add(time.perf_counter() - start)
+
+    def _run(self):
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._commit()
+                return
+            elif isinstance(item, tuple) and item[0] is self._FLUSH:
+                self._commit()
+                item[1].set()
+            elif item is not None:
+                self.pending.append(item)
+
+            if len(self.pending) >= self.flush_size or time.monotonic() >= deadline:
+                self._commit()
+                deadline = time.monotonic() + self.flush_interval
+
+
+@click.group()
+def cli():
+    """Maintenance commands for sensor log databases."""
+
+
+@cli.command()
+@click.argument("logfiles", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def backfill(logfiles):
+    """Build the per-minute, per-hour, and per-day rollup tables of each of LOGFILES from its readings."""
+    for logfile in logfiles:
+        start = time.perf_counter()
+        engine = create_log_engine(logfile)
+        backfill_rollups(engine)
+        engine.dispose()
+        print(f"{logfile}: {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,380 @@
+"""Rendering of sensor graphs and values for the ST7789 display."""
+
+from enum import Enum
+from functools import lru_cache
+from itertools import cycle
+from colorsys import rgb_to_hls, hls_to_rgb
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# set to whatever other font available, installed with "apt install fonts-freefont-ttf"
+FONT_FILE = "/usr/share/fonts/truetype/freefont/FreeMonoBold.ttf"
+
+
+def set_lightness(r, g, b, l):
+    """Replace the lightness value of the color (`r`, `g`, `b`) by `l`. RGB values 0-255, `l` 0-1."""
+    h, _, s = rgb_to_hls(r / 255.0, g / 255.0, b / 255.0)
+    nr, ng, nb = hls_to_rgb(h, l, s)
+
+    return int(nr * 255), int(ng * 255), int(nb * 255)
+
+
+class Units(Enum):
+    """Known units and their symbols."""
+
+    temp = "C"
+    ohms = "\u03a9"
+    pressure = "hPa"
+    humidity = "%RH"
+    lux = "lx"
+    none = ""
+
+
+class GraphColors(Enum):
+    """Colors to use for graphs, if there are more graphs than colors cycle through the list."""
+
+    c1 = set_lightness(0, 63, 92, 0.5)
+    c2 = set_lightness(68, 78, 134, 0.5)
+    c3 = set_lightness(149, 81, 150, 0.5)
+    c4 = set_lightness(221, 81, 130, 0.5)
+    c5 = set_lightness(255, 110, 84, 0.5)
+    c6 = set_lightness(255, 166, 0, 0.5)
+    c7 = set_lightness(166, 255, 0, 0.5)
+    c8 = set_lightness(255, 255, 255, 0.7)
+
+
+def lighten_darken_color(rgb, factor=0.5):
+    """
+    Light or darken color `rgb` which is a triple of values 0-255. If `factor` is between 0 and 1,
+    the color is lighten (0 unchanged, 1 is white). If `factor` is between -1 and 0, the color is
+    darkened (0 unchanged, -1 black).
+    """
+    factor = np.clip(factor, -1.0, 1.0)
+    r, g, b = rgb
+    h, l, s = rgb_to_hls(r / 255.0, g / 255.0, b / 255.0)
+
+    if factor <= 0:
+        l = (1 + factor) * l
+    else:
+        l = 1 - factor * (1 - l)
+
+    nr, ng, nb = hls_to_rgb(h, l, s)
+
+    return int(nr * 255), int(ng * 255), int(nb * 255)
+
+
+def format_value(value, unit):
+    """Format the given float value into a string with the given unit, large value ohms reduced to kohms."""
+    unit_str = unit.value
+
+    if unit in (Units.ohms, Units.lux) and value > 1000:
+        unit_str = "k" + unit_str
+        value /= 1000.0
+
+    return f"{value:.3f}{unit_str}"
+
+
+def merge_boxes(boxes, slack=0):
+    """
+    Merge the boxes (x0, y0, x1, y1) whose bounding box covers no more than `slack` pixels outside of the two boxes, so
+    overlapping boxes are always merged. Returns the list of merged boxes.
+    """
+    merged = [tuple(b) for b in boxes]
+
+    def area(b):
+        return (b[2] - b[0]) * (b[3] - b[1])
+
+    done = False
+    while not done:
+        done = True
+        for i in range(len(merged)):
+            for j in range(i + 1, len(merged)):
+                a, b = merged[i], merged[j]
+                union = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                if area(union) <= area(a) + area(b) + slack:
+                    merged[i] = union
+                    del merged[j]
+                    done = False
+                    break
+            if not done:
+                break
+
+    return merged
+
+
+@lru_cache(maxsize=None)
+def load_font(font_file, font_size):
+    """Load the TrueType font `font_file` at size `font_size`, fonts are cached after the first load."""
+    return ImageFont.truetype(font_file, size=font_size)
+
+
+def draw_sensors(
+    sensors,
+    bg_color=(20, 20, 20),
+    graph_dims=(140, 25),
+    spacing=4,
+    image_dims=(240, 240),
+    light_dark_factor=-0.9,
+    font_size=12,
+    text_color=(200, 200, 200),
+    font_file=FONT_FILE,
+):
+    """
+    Draw the log graphs and sensor values into a PIL image. Each entry of `sensors` is a name, unit, and `RingBuffer`
+    of values to graph.
+    """
+    startx, starty = spacing - 1, spacing - 1
+    graphw, graphh = graph_dims
+    colors = cycle(GraphColors)
+
+    font = ImageFont.truetype(font_file, size=font_size)
+
+    pilim = Image.new("RGB", image_dims, bg_color)
+    draw = ImageDraw.Draw(pilim)
+
+    for name, unit, values in sensors:
+        col = next(colors).value
+        bgcol = lighten_darken_color(col, light_dark_factor)
+
+        graph_vals = np.full(graphw, np.nan, np.float32)
+
+        num_vals = min(graphw, len(values))
+        if num_vals > 0 and values.min() is not None:  # min is None if all values are NaN
+            graph_vals[-num_vals:] = values.last(num_vals)
+            minv = values.min()
+            maxv = values.max()
+            diff = (maxv - minv) or 1.0
+        else:
+            minv = maxv = 0.0
+            diff = 1.0
+
+        text_pos = (startx + graphw + spacing, starty)
+        text = f"{name}\n{format_value(graph_vals[-1],unit)}"
+
+        draw.rectangle([(startx, starty), (startx + graphw, starty + graphh)], fill=bgcol)
+        draw.multiline_text(text_pos, text, font=font, fill=text_color)
+
+        # draw the graph by drawing a vertical line for every value in graph_vals
+        for x in range(graphw):
+            if np.isnan(graph_vals[x]):
+                continue
+
+            y = (graph_vals[x] - minv) / diff
+            indy = starty + int((1 - y) * (graphh - 1))
+            indx = startx + x
+
+            if 0 <= indy < image_dims[0] and 0 <= indx < image_dims[1]:
+                draw.line([(indx, indy), (indx, starty + graphh)], fill=col)
+
+        starty += graphh + spacing
+
+    return pilim
+
+
+class GraphRenderer:
+    """
+    Renders the same image as `draw_sensors` into a persistent uint8 RGB array. The background and graph rectangles are
+    drawn once, value labels are redrawn only when their text changes, and the bars of all graphs are computed together
+    in one NumPy pass by building a mask of column heights. After each call to `render`, `dirty` lists the boxes
+    (x0, y0, x1, y1) bounding the pixels of the image which changed, the first render marks the whole image dirty.
+    """
+
+    def __init__(
+        self,
+        bg_color=(20, 20, 20),
+        graph_dims=(140, 25),
+        spacing=4,
+        image_dims=(240, 240),
+        light_dark_factor=-0.9,
+        font_size=12,
+        text_color=(200, 200, 200),
+        font_file=FONT_FILE,
+    ):
+        self.bg_color = bg_color
+        self.graph_dims = graph_dims
+        self.spacing = spacing
+        self.image_dims = image_dims
+        self.light_dark_factor = light_dark_factor
+        self.text_color = text_color
+        self.font = load_font(font_file, font_size)
+        self.array = None  # current image as a (height, width, 3) array
+        self.dirty = []
+        self._num_graphs = None
+        self._labels = None
+        self._name_slots = None
+        self._name_bboxes = {}
+
+        # offset of the second line of multiline text, measured to match however PIL lays out lines
+        draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+        first = draw.textbbox((0, 0), "A", font=self.font)
+        self.line_spacing = draw.multiline_textbbox((0, 0), "A\nA", font=self.font)[3] - first[3]
+
+    def _setup(self, num_graphs):
+        """Draw the static background and precompute the per-graph colors and coordinates."""
+        width, height = self.image_dims
+        graphw, graphh = self.graph_dims
+        startx = self.spacing - 1
+        colors = cycle(GraphColors)
+
+        cols = [next(colors).value for _ in range(num_graphs)]
+        bgcols = [lighten_darken_color(c, self.light_dark_factor) for c in cols]
+
+        self.graph_y = np.arange(num_graphs) * (graphh + self.spacing) + self.spacing - 1
+        self.text_x = startx + graphw + self.spacing
+        self.label_x = startx + graphw + 1  # left edge of the area containing labels
+
+        pilim = Image.new("RGB", self.image_dims, self.bg_color)
+        draw = ImageDraw.Draw(pilim)
+        for y, bgcol in zip(self.graph_y.tolist(), bgcols):
+            draw.rectangle([(startx, y), (startx + graphw, y + graphh)], fill=bgcol)
+
+        self.base = np.array(pilim)
+        self.dirty = [(0, 0, width, height)]
+        self._num_graphs = num_graphs
+        self._labels = [None] * num_graphs
+        self._name_slots = [(None, None)] * num_graphs
+
+        # graphs are drawn through a strided view with one entry per graph into a canvas padded to contain them all
+        canvas_h = max(height, int(self.graph_y[-1]) + graphh + 1)
+        canvas_w = max(width, startx + graphw)
+        self.canvas = np.zeros((canvas_h, canvas_w, 3), np.uint8)
+        self.canvas[:height, :width] = self.base
+        self.array = self.canvas[:height, :width]
+        row_stride, col_stride, chan_stride = self.canvas.strides
+        self._graph_view = np.lib.stride_tricks.as_strided(
+            self.canvas[self.graph_y[0] :, startx:],
+            (num_graphs, graphh + 1, graphw, 3),
+            (row_stride * (graphh + self.spacing), row_stride, col_stride, chan_stride),
+        )
+
+        # background and bar colors of each graph interleaved, indexed by twice the graph index plus the bar mask
+        self._palette = np.array([c for pair in zip(bgcols, cols) for c in pair], np.uint8)
+        self._palette_offsets = np.arange(num_graphs)[:, None, None] * 2
+        self._local_rows = np.arange(graphh + 1)[None, :, None]
+        self._graph_cols = startx + np.arange(graphw)
+
+    def _label_fits(self, name, value):
+        """Returns True if the ink of the label `name` and `value` lies within its slot in the label area."""
+        if name not in self._name_bboxes:
+            self._name_bboxes[name] = self.font.getbbox(name)
+
+        nx0, ny0, _, ny1 = self._name_bboxes[name]
+        vx0, vy0, _, vy1 = self.font.getbbox(value)
+        left = self.label_x - self.text_x
+        slot_h = self.graph_dims[1] + self.spacing
+
+        return (
+            min(nx0, vx0) >= left
+            and min(ny0, vy0 + self.line_spacing) >= 0
+            and max(ny1, vy1 + self.line_spacing) <= slot_h
+        )
+
+    def _draw_labels(self, labels):
+        """
+        Redraw the labels, pairs of name and value text, which have changed. Names are drawn once into a cached image of
+        each label's slot so only value lines are rendered per frame. If any label leaves its slot all are redrawn.
+        """
+        changed = [i for i, label in enumerate(labels) if label != self._labels[i]]
+        if not changed or self.label_x >= self.image_dims[0]:
+            return
+
+        width, height = self.image_dims
+        slot_h = self.graph_dims[1] + self.spacing
+        x0 = self.label_x
+        tx = self.text_x - x0
+
+        if all(self._label_fits(*label) for label in labels):
+            for i in changed:
+                name, value = labels[i]
+                y0 = int(self.graph_y[i])
+                y1 = min(height, y0 + slot_h)
+                if y0 >= height:
+                    continue
+
+                if self._name_slots[i][0] != name:
+                    slot = Image.fromarray(self.base[y0:y1, x0:])
+                    ImageDraw.Draw(slot).text((tx, 0), name, font=self.font, fill=self.text_color)
+                    self._name_slots[i] = (name, slot)
+
+                slot = self._name_slots[i][1].copy()
+                ImageDraw.Draw(slot).text((tx, self.line_spacing), value, font=self.font, fill=self.text_color)
+                slot = np.asarray(slot)
+
+                # only the value line usually changes so mark the box around the changed pixels as dirty
+                diff = np.any(self.array[y0:y1, x0:] != slot, axis=2)
+                rows = np.flatnonzero(diff.any(1))
+                if len(rows) > 0:
+                    cols = np.flatnonzero(diff.any(0))
+                    self.array[y0:y1, x0:] = slot
+                    box = (x0 + int(cols[0]), y0 + int(rows[0]), x0 + int(cols[-1]) + 1, y0 + int(rows[-1]) + 1)
+                    self.dirty.append(box)
+        else:
+            strip = Image.fromarray(self.base[:, x0:])
+            draw = ImageDraw.Draw(strip)
+            for y, (name, value) in zip(self.graph_y.tolist(), labels):
+                draw.multiline_text((tx, y), f"{name}\n{value}", font=self.font, fill=self.text_color)
+
+            self.array[:, x0:] = np.asarray(strip)
+            self.dirty.append((x0, 0, width, height))
+
+        self._labels = list(labels)
+
+    def render(self, sensors):
+        """Render `sensors`, a sequence of name, unit, and `RingBuffer` triples, and return the image in PIL form."""
+        if self._num_graphs != len(sensors):
+            self._setup(len(sensors))
+        else:
+            self.dirty = []
+
+        width, height = self.image_dims
+        graphw, graphh = self.graph_dims
+        num_graphs = len(sensors)
+
+        graph_vals = np.full((num_graphs, graphw), np.nan, np.float32)
+        minvs = np.zeros((num_graphs, 1))
+        diffs = np.ones((num_graphs, 1))
+        labels = []
+
+        for i, (name, unit, values) in enumerate(sensors):
+            num_vals = min(graphw, len(values))
+            if num_vals > 0 and values.min() is not None:
+                graph_vals[i, -num_vals:] = values.last(num_vals)
+                minv = values.min()
+                maxv = values.max()
+                minvs[i] = minv
+                diffs[i] = (maxv - minv) or 1.0
+
+            labels.append((name, format_value(graph_vals[i, -1], unit)))
+
+        self._draw_labels(labels)
+
+        # compute the top of each bar in image coordinates, truncating as int() does
+        y = (graph_vals.astype(np.float64) - minvs) / diffs
+        valid = ~np.isnan(y)
+        indy = np.trunc(np.where(valid, 1 - y, 0) * (graphh - 1)).astype(np.int64) + self.graph_y[:, None]
+        valid &= (indy >= 0) & (indy < width) & (self._graph_cols < height)
+
+        # mask of bar pixels for every graph, bars extend from their tops to the bottom of the graph
+        top = np.where(valid, indy - self.graph_y[:, None], graphh + 1)
+        mask = self._local_rows >= top[:, None, :]
+        graphs = self._palette.take(mask + self._palette_offsets, axis=0)
+
+        # mark the boxes around the changed pixels of each graph as dirty, clipping boxes to the image
+        changed = np.any(self._graph_view != graphs, axis=3)
+        changed_rows = changed.any(2)
+        changed_cols = changed.any(1)
+        self._graph_view[...] = graphs
+        startx = int(self._graph_cols[0])
+
+        for i in np.flatnonzero(changed_rows.any(1)).tolist():
+            rows = np.flatnonzero(changed_rows[i])
+            cols = np.flatnonzero(changed_cols[i])
+            x0 = startx + int(cols[0])
+            y0 = int(self.graph_y[i]) + int(rows[0])
+            if y0 < height and x0 < width:
+                x1 = min(width, startx + int(cols[-1]) + 1)
+                y1 = min(height, int(self.graph_y[i]) + int(rows[-1]) + 1)
+                self.dirty.append((x0, y0, x1, y1))
+
+        return Image.fromarray(self.array)
@@ -0,0 +1,180 @@
+"""
+Indoor air quality (IAQ) scoring from BME688 gas resistance and humidity, based on
+https://github.com/pimoroni/bme680-python/blob/master/examples/indoor-air-quality.py
+
+Scores are computed either for single samples or vectorized over whole arrays with identical results, so historical
+logs can be rescored with different baselines or weights in one call. `StreamingIAQ` scores samples as they arrive
+using an adaptive gas baseline.
+"""
+
+import bisect
+import time
+from collections import deque
+
+import numpy as np
+
+
+def iaq_scalar(gas, hum, gas_baseline, hum_baseline=40.0, hum_weighting=0.25):
+    """Compute the IAQ score of a single gas resistance `gas` and humidity `hum` sample."""
+    gas_offset = gas_baseline - gas
+    hum_offset = hum - hum_baseline
+
+    # Calculate hum_score as the distance from the hum_baseline.
+    if hum_offset > 0:
+        hum_score = 100 - hum_baseline - hum_offset
+        hum_score /= 100 - hum_baseline
+        hum_score *= hum_weighting * 100
+    else:
+        hum_score = hum_baseline + hum_offset
+        hum_score /= hum_baseline
+        hum_score *= hum_weighting * 100
+
+    # Calculate gas_score as the distance from the gas_baseline.
+    if gas_offset > 0:
+        gas_score = gas / gas_baseline
+        gas_score *= 100 - (hum_weighting * 100)
+    else:
+        gas_score = 100 - (hum_weighting * 100)
+
+    # Calculate air_quality_score.
+    return hum_score + gas_score
+
+
+def compute_iaq(gas, hum, gas_baseline, hum_baseline=40.0, hum_weighting=0.25):
+    """
+    Compute IAQ scores for arrays of gas resistance `gas` and humidity `hum`, any argument may be an array or scalar
+    and are broadcast together. The operations are those of `iaq_scalar` in the same order so results are identical.
+    """
+    gas = np.asarray(gas, np.float64)
+    hum = np.asarray(hum, np.float64)
+    gas_baseline = np.asarray(gas_baseline, np.float64)
+
+    gas_offset = gas_baseline - gas
+    hum_offset = hum - hum_baseline
+    hum_scale = hum_weighting * 100
+    gas_scale = 100 - hum_scale
+
+    hum_score = np.where(
+        hum_offset > 0,
+        (100 - hum_baseline - hum_offset) / (100 - hum_baseline) * hum_scale,
+        (hum_baseline + hum_offset) / hum_baseline * hum_scale,
+    )
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        gas_score = np.where(gas_offset > 0, gas / gas_baseline * gas_scale, gas_scale)
+
+    return hum_score + gas_score
+
+
+class AdaptiveBaseline:
+    """
+    Gas resistance baseline updated with every sample. With `mode` "fixed" the baseline stays at `initial`, with "ema"
+    it is an exponential moving average with weight `alpha` for new samples, and with "percentile" it is the given
+    `percentile` of the last `window` samples. If `initial` is None the first sample is used. Updates are O(1) for the
+    fixed and EMA modes, the percentile mode keeps a sorted window so is O(log n) search plus an insertion.
+    """
+
+    MODES = ("fixed", "ema", "percentile")
+
+    def __init__(self, initial=None, mode="ema", alpha=0.001, window=3600, percentile=90.0):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown baseline mode {mode}, should be one of {self.MODES}")
+
+        self.value = initial
+        self.mode = mode
+        self.alpha = alpha
+        self.percentile = percentile
+        self._window = deque(maxlen=window)
+        self._sorted = []
+
+    def update(self, gas):
+        """Add the gas resistance sample `gas` and return the updated baseline."""
+        if self.value is None:
+            self.value = gas
+        elif self.mode == "ema":
+            self.value += self.alpha * (gas - self.value)
+
+        if self.mode == "percentile":
+            if len(self._window) == self._window.maxlen:
+                del self._sorted[bisect.bisect_left(self._sorted, self._window[0])]
+
+            self._window.append(gas)
+            bisect.insort(self._sorted, gas)
+
+            idx = round((len(self._sorted) - 1) * self.percentile / 100)
+            self.value = self._sorted[idx]
+
+        return self.value
+
+    def series(self, gas):
+        """Returns the baseline after each sample of the array `gas` has been added, for rescoring logs."""
+        return np.fromiter((self.update(g) for g in np.asarray(gas, np.float64).tolist()), np.float64, len(gas))
+
+
+def burn_in_baseline(samples, num_samples=50):
+    """Returns the mean of the last `num_samples` of the gas resistance `samples`, or None if there are none."""
+    last = list(samples)[-num_samples:]
+    return sum(last) / len(last) if last else None
+
+
+class BaselineBurnIn:
+    """
+    Computes the burn-in gas baseline from samples as they are taken rather than blocking to read the sensor. Samples
+    are collected for `burn_in_time` seconds after the first and the mean of the last `num_samples` is the baseline,
+    which `on_done` is called with if given.
+    """
+
+    def __init__(self, burn_in_time=300, num_samples=50, on_done=None):
+        self.burn_in_time = burn_in_time
+        self.samples = deque(maxlen=num_samples)
+        self.on_done = on_done
+        self.start = None
+        self.baseline = None
+
+    @property
+    def done(self):
+        return self.baseline is not None
+
+    def add(self, gas):
+        """Add the gas resistance sample `gas`, returns the baseline once burn-in has completed or None until then."""
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+
+        self.samples.append(gas)
+
+        if not self.done and now - self.start >= self.burn_in_time:
+            self.baseline = burn_in_baseline(self.samples)
+            if self.on_done is not None:
+                self.on_done(self.baseline)
+
+        return self.baseline
+
+
+class StreamingIAQ:
+    """
+    Computes the IAQ score sample by sample using the `AdaptiveBaseline` `baseline`, updated with each sample. If the
+    `BaselineBurnIn` `burn_in` is given the baseline is provisional until the burn-in completes, its baseline then
+    replaces the current one.
+    """
+
+    def __init__(self, baseline, hum_baseline=40.0, hum_weighting=0.25, burn_in=None):
+        if not isinstance(baseline, AdaptiveBaseline):
+            baseline = AdaptiveBaseline(baseline, "fixed")
+
+        self.baseline = baseline
+        self.hum_baseline = hum_baseline
+        self.hum_weighting = hum_weighting
+        self.burn_in = burn_in
+
+    @property
+    def provisional(self):
+        return self.burn_in is not None and not self.burn_in.done
+
+    def update(self, gas, hum):
+        """Add the sample of gas resistance `gas` and humidity `hum` and return its IAQ score."""
+        if self.provisional and self.burn_in.add(gas) is not None:
+            self.baseline.value = self.burn_in.baseline
+
+        gas_baseline = self.baseline.update(gas)
+        return iaq_scalar(gas, hum, gas_baseline, self.hum_baseline, self.hum_weighting)
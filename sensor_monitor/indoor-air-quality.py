@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 import bme680
+import sys
 import time
 import datetime
 
+from database import GasBaseline, create_log_engine, load_baseline, save_baseline
+from iaq import BaselineBurnIn, StreamingIAQ, burn_in_baseline
+
 
 try:
     sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
@@ -33,20 +37,35 @@ burn_in_time = 300
 
 burn_in_data = []
 
-try:
-    # Collect gas resistance burn-in values, then use the average
-    # of the last 50 values to set the upper limit for calculating
-    # gas_baseline.
-    #print('Collecting gas resistance burn-in data for 5 mins\n')
-    while curr_time - start_time < burn_in_time:
-        curr_time = time.time()
-        if sensor.get_sensor_data() and sensor.data.heat_stable:
-            gas = sensor.data.gas_resistance
-            burn_in_data.append(gas)
-            #print('Gas: {0} Ohms'.format(gas))
-            time.sleep(1)
+# A baseline stored by an earlier run within this many seconds is
+# used immediately, with the burn-in refining it in the background.
+baseline_max_age = 24 * 60 * 60
+baseline_engine = create_log_engine("gas_baseline.sqlite", tables=[GasBaseline.__table__])
+stored = load_baseline(baseline_engine, datetime.timedelta(seconds=baseline_max_age))
 
-    gas_baseline = sum(burn_in_data[-50:]) / 50.0
+try:
+    if stored is None:
+        # Collect gas resistance burn-in values, then use the average
+        # of the last 50 values (or fewer if that's all there are) to
+        # set the upper limit for calculating gas_baseline.
+        #print('Collecting gas resistance burn-in data for 5 mins\n')
+        while curr_time - start_time < burn_in_time:
+            curr_time = time.time()
+            if sensor.get_sensor_data() and sensor.data.heat_stable:
+                gas = sensor.data.gas_resistance
+                burn_in_data.append(gas)
+                #print('Gas: {0} Ohms'.format(gas))
+                time.sleep(1)
+
+        gas_baseline = burn_in_baseline(burn_in_data)
+        if gas_baseline is None:
+            sys.exit("No stable gas readings during burn-in")
+
+        save_baseline(baseline_engine, gas_baseline)
+        burn_in = None
+    else:
+        gas_baseline = stored[0]
+        burn_in = BaselineBurnIn(burn_in_time, on_done=lambda b: save_baseline(baseline_engine, b))
 
     # Set the humidity baseline to 40%, an optimal indoor humidity.
     hum_baseline = 40.0
@@ -59,46 +78,25 @@ try:
     #    gas_baseline,
     #    hum_baseline))
 
-    print("time, gas_resistance, humidity, iaq")
+    iaq_model = StreamingIAQ(gas_baseline, hum_baseline, hum_weighting, burn_in)
+
+    print("time, gas_resistance, humidity, iaq, provisional")
 
     while True:
         has_data=bool(sensor.get_sensor_data())
         is_stable= sensor.data.heat_stable
         if has_data and is_stable:
             gas = sensor.data.gas_resistance
-            gas_offset = gas_baseline - gas
-
             hum = sensor.data.humidity
-            hum_offset = hum - hum_baseline
-
-            # Calculate hum_score as the distance from the hum_baseline.
-            if hum_offset > 0:
-                hum_score = (100 - hum_baseline - hum_offset)
-                hum_score /= (100 - hum_baseline)
-                hum_score *= (hum_weighting * 100)
-
-            else:
-                hum_score = (hum_baseline + hum_offset)
-                hum_score /= hum_baseline
-                hum_score *= (hum_weighting * 100)
-
-            # Calculate gas_score as the distance from the gas_baseline.
-            if gas_offset > 0:
-                gas_score = (gas / gas_baseline)
-                gas_score *= (100 - (hum_weighting * 100))
-
-            else:
-                gas_score = 100 - (hum_weighting * 100)
-
-            # Calculate air_quality_score.
-            air_quality_score = hum_score + gas_score
+            air_quality_score = iaq_model.update(gas, hum)
+            provisional = iaq_model.provisional
 
             #print('Gas: {0:.2f} Ohms,humidity: {1:.2f} %RH,air quality: {2:.2f}'.format(
             #    gas,
             #    hum,
             #    air_quality_score))
 
-            print(f"{str(datetime.datetime.now())}, {gas}, {hum}, {air_quality_score}")
+            print(f"{str(datetime.datetime.now())}, {gas}, {hum}, {air_quality_score}, {provisional}")
 
             time.sleep(1)
         else:
@@ -0,0 +1,195 @@
+"""Staged sampling pipeline which decouples sensor reads from storage and display updates."""
+
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+
+
+class StageStats:
+    """Thread-safe latency counters for one pipeline stage, times are in seconds."""
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, secs):
+        with self._lock:
+            self.count += 1
+            self.total += secs
+            self.last = secs
+            self.max = max(self.max, secs)
+
+    @contextmanager
+    def time(self):
+        """Context manager adding the time spent in its block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(time.perf_counter() - start)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return f"{self.name}: n={self.count} mean={self.mean * 1000:.2f}ms max={self.max * 1000:.2f}ms"
+
+
+class Scheduler:
+    """
+    Drift-free periodic scheduler. Tick deadlines are computed from the tick number on the monotonic clock rather than by
+    accumulating sleeps, and if `align` is True the first tick falls on a multiple of `period` in wall clock time. Ticks
+    which have passed entirely by the time `wait` is called are skipped and counted in `missed`. A `period` of 0 runs
+    freely without waiting. The `sleep` function can be replaced, eg. with `Event.wait` to allow interruption.
+    """
+
+    def __init__(self, period, align=True, sleep=time.sleep):
+        self.period = period
+        self.sleep = sleep
+        self.tick = 0  # number of the next tick
+        self.missed = 0
+        offset = (-time.time()) % period if align and period > 0 else 0.0
+        self.start = time.monotonic() + offset
+
+    def wait(self):
+        """Wait until the next tick and return how late in seconds this returned after the tick's deadline."""
+        now = time.monotonic()
+        if self.period <= 0:
+            return 0.0
+
+        deadline = self.start + self.tick * self.period
+
+        if now - deadline >= self.period:
+            skipped = int((now - deadline) // self.period)
+            self.missed += skipped
+            self.tick += skipped
+            deadline = self.start + self.tick * self.period
+
+        if deadline > now:
+            self.sleep(deadline - now)
+            now = time.monotonic()
+
+        self.tick += 1
+        return max(0.0, now - deadline)
+
+
+class DropOldestQueue:
+    """Bounded queue which discards its oldest item when full rather than blocking, counting items dropped."""
+
+    def __init__(self, maxsize):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.dropped = 0
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        with self._cond:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+
+            self.items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest item, or None if the queue is closed or `timeout` expires first."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.items or self.closed, timeout)
+            return self.items.popleft() if self.items else None
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class SensorPipeline:
+    """
+    Runs sampling, storage, and display as separate stages. The calling thread samples by calling `sample` on a
+    drift-free `Scheduler` every `delay` seconds and writes each reading to `writer`, whose background thread stores them.
+    Every `interval`-th reading is passed to `show` in a display thread through a queue of size `display_queue_size`
+    which drops the oldest readings, so slow rendering never delays sampling. Stage latencies are kept in `stats`.
+    """
+
+    def __init__(self, sample, writer, show, delay=1.0, interval=1, display_queue_size=2, max_retries=3):
+        self.sample = sample
+        self.writer = writer
+        self.show = show
+        self.delay = delay
+        self.interval = interval
+        self.max_retries = max_retries
+        self.display_queue = DropOldestQueue(display_queue_size)
+        self.scheduler = None
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._display_thread = threading.Thread(target=self._display_loop, name="Display", daemon=True)
+
+    def stat(self, name):
+        """Returns the `StageStats` object for `name`, creating it if needed."""
+        with self._stats_lock:
+            if name not in self.stats:
+                self.stats[name] = StageStats(name)
+
+            return self.stats[name]
+
+    def summary(self):
+        lines = [str(s) for s in self.stats.values()]
+        lines.append(f"missed ticks: {self.scheduler.missed if self.scheduler else 0}")
+        lines.append(f"display readings dropped: {self.display_queue.dropped}")
+        return "\n".join(lines)
+
+    def _display_loop(self):
+        while True:
+            dat = self.display_queue.get()
+            if dat is None:
+                return
+
+            try:
+                with self.stat("display").time():
+                    self.show(dat)
+            except Exception:
+                traceback.print_exc()
+
+    def run(self, num_samples=None):
+        """
+        Sample until interrupted, `num_samples` readings are taken, or more than `max_retries` consecutive exceptions
+        are raised. The display thread is stopped before returning, the writer is left open.
+        """
+        self._display_thread.start()
+        retries = self.max_retries
+        count = 0
+        self.scheduler = Scheduler(self.delay)
+
+        try:
+            while retries >= 0 and (num_samples is None or count < num_samples):
+                try:
+                    self.stat("jitter").add(self.scheduler.wait())
+
+                    with self.stat("sample").time():
+                        dat = self.sample()
+
+                    with self.stat("store").time():
+                        self.writer.write(dat)
+
+                    if count % self.interval == 0:
+                        self.display_queue.put(dat)
+
+                    count += 1
+                except KeyboardInterrupt:
+                    retries = -1
+                except Exception:
+                    traceback.print_exc()
+                    retries -= 1
+                else:
+                    retries = self.max_retries
+        finally:
+            self.display_queue.close()
+            self._display_thread.join()
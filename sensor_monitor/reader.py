@@ -0,0 +1,194 @@
+"""
+Fast loading of sensor logs in CSV, Sqlite, or compressed columnar .npz form into typed NumPy columns. Timestamps are
+returned as int64 nanoseconds since the epoch of the logged naive local time, in a column named "date".
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+
+import click
+import numpy as np
+
+from ringbuffer import reading_fields
+
+# dtypes of every column, timestamps are stored as int64 nanoseconds in every format
+FIELD_DTYPES = {name: np.dtype(dtype) for name, dtype in reading_fields().items()}
+FIELD_DTYPES["date"] = np.dtype(np.int64)
+
+DATA_FIELDS = [name for name in FIELD_DTYPES if name != "date"]
+
+
+def to_ns(value):
+    """Convert `value`, an int in nanoseconds or anything np.datetime64 accepts such as datetime or str, to int64 ns."""
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+
+    return int(np.datetime64(value, "ns").astype(np.int64))
+
+
+def _parse_dates(strings):
+    return np.asarray(strings, dtype="datetime64[ns]").view(np.int64)
+
+
+def _empty(fields):
+    return {f: np.zeros(0, FIELD_DTYPES[f]) for f in ["date"] + fields}
+
+
+def _time_mask(dates, start, end):
+    mask = np.ones(len(dates), bool)
+    if start is not None:
+        mask &= dates >= start
+    if end is not None:
+        mask &= dates < end
+
+    return mask
+
+
+def _read_csv(filename, fields, start, end):
+    """Read a CSV log with a "time" column as written by older loggers, rows with missing values are dropped."""
+    import pandas as pd
+
+    header = pd.read_csv(filename, nrows=0).columns
+    present = [f for f in fields if f in header]
+    df = pd.read_csv(filename, usecols=["time"] + present, dtype={f: np.float64 for f in present}).dropna()
+
+    dates = pd.to_datetime(df["time"], format="ISO8601").to_numpy("datetime64[ns]").view(np.int64)
+    mask = _time_mask(dates, start, end)
+    result = {"date": dates[mask]}
+
+    for f in fields:
+        if f in present:
+            result[f] = df[f].to_numpy()[mask].astype(FIELD_DTYPES[f])
+        else:  # older logs lack some fields
+            result[f] = np.full(mask.sum(), np.nan)
+
+    return result
+
+
+def _read_sqlite(filename, fields, start, end):
+    """Read the readings table of a Sqlite log, selecting only the requested columns and time range."""
+    query = f"SELECT date, {', '.join(fields)} FROM readings" if fields else "SELECT date FROM readings"
+    conds = []
+    params = []
+
+    # dates are stored as fixed width strings so compare as strings of the same format
+    for bound, op in ((start, ">="), (end, "<")):
+        if bound is not None:
+            conds.append(f"date {op} ?")
+            params.append(str(np.datetime64(bound, "ns").astype("datetime64[us]")).replace("T", " "))
+
+    if conds:
+        query += " WHERE " + " AND ".join(conds)
+
+    with sqlite3.connect(f"file:{filename}?mode=ro", uri=True) as conn:
+        rows = conn.execute(query + " ORDER BY date", params).fetchall()
+
+    if not rows:
+        return _empty(fields)
+
+    # converting the row tuples to a structured array in one call is much faster than per column conversion
+    table = np.array(rows, [("date", "U32")] + [(f, FIELD_DTYPES[f]) for f in fields])
+    result = {"date": _parse_dates(table["date"])}
+    for f in fields:
+        result[f] = np.ascontiguousarray(table[f])
+
+    return result
+
+
+def _read_npz(filename, fields, start, end):
+    """Read an exported .npz log, only the date column and requested fields are decompressed."""
+    with np.load(filename) as npz:
+        dates = npz["date"]
+
+        # dates are sorted on export so the time range is a contiguous slice
+        lo = 0 if start is None else np.searchsorted(dates, start, "left")
+        hi = len(dates) if end is None else np.searchsorted(dates, end, "left")
+        result = {"date": dates[lo:hi]}
+
+        for f in fields:
+            result[f] = npz[f][lo:hi] if f in npz.files else np.full(hi - lo, np.nan)
+
+    return result
+
+
+def read_log(filename, fields=None, start=None, end=None):
+    """
+    Read the log `filename` into a dictionary of NumPy arrays, one for "date" and one for each of `fields` (default all
+    fields). The format is chosen by extension: .csv, .npz, or Sqlite otherwise. Only rows with dates in the range
+    [`start`, `end`) are returned, these can be anything `to_ns` accepts.
+    """
+    fields = list(DATA_FIELDS if fields is None else [f for f in fields if f != "date"])
+    unknown = set(fields) - set(DATA_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {sorted(unknown)}")
+
+    start, end = to_ns(start), to_ns(end)
+    ext = os.path.splitext(filename)[1].lower()
+
+    if ext == ".csv":
+        return _read_csv(filename, fields, start, end)
+    elif ext == ".npz":
+        return _read_npz(filename, fields, start, end)
+    else:
+        return _read_sqlite(filename, fields, start, end)
+
+
+def read_logs(filenames, fields=None, start=None, end=None):
+    """Read every log in `filenames` as `read_log` does and concatenate the results sorted by date."""
+    results = [read_log(f, fields, start, end) for f in filenames]
+    if not results:
+        return _empty(list(DATA_FIELDS if fields is None else fields))
+
+    combined = {k: np.concatenate([r[k] for r in results]) for k in results[0]}
+    order = np.argsort(combined["date"], kind="stable")
+
+    if np.any(order[1:] < order[:-1]):
+        combined = {k: v[order] for k, v in combined.items()}
+
+    return combined
+
+
+def to_frame(data):
+    """Convert the dictionary `data` returned by `read_log` to a pandas DataFrame indexed by datetime."""
+    import pandas as pd
+
+    index = pd.DatetimeIndex(data["date"].view("datetime64[ns]"), name="date")
+    return pd.DataFrame({k: v for k, v in data.items() if k != "date"}, index=index)
+
+
+def export_log(filename, outfile):
+    """Export the log `filename` to the compressed columnar file `outfile`, returning the number of rows."""
+    data = read_logs([filename])
+    np.savez_compressed(outfile, **data)
+    return len(data["date"])
+
+
+@click.group()
+def cli():
+    """Read and convert sensor logs."""
+
+
+@cli.command()
+@click.argument("logfiles", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-o",
+    "--outdir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Directory to write exported logs to, defaults to the directory of each log",
+)
+def export(logfiles, outdir):
+    """Export each of LOGFILES to a compressed .npz file with one array per column."""
+    for logfile in logfiles:
+        dirname = outdir or os.path.dirname(logfile)
+        os.makedirs(dirname or ".", exist_ok=True)
+        outfile = os.path.join(dirname, os.path.splitext(os.path.basename(logfile))[0] + ".npz")
+
+        start = datetime.now()
+        num_rows = export_log(logfile, outfile)
+        print(f"{logfile} -> {outfile}: {num_rows} rows, {(datetime.now() - start).total_seconds():.2f}s")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,129 @@
+"""Fixed-size ring buffers for keeping the most recent sensor readings in memory."""
+
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+from database import Reading
+
+# dtypes used to store each python column type of the readings table
+COLUMN_DTYPES = {datetime: "datetime64[us]", float: np.float64, int: np.int64}
+
+
+def reading_fields():
+    """Returns a dictionary mapping each `Reading` field name to the dtype used to store it."""
+    return {c.name: COLUMN_DTYPES[c.type.python_type] for c in Reading.__table__.columns}
+
+
+class RingBuffer:
+    """
+    Preallocated ring buffer holding the last `capacity` values of type `dtype`. Values are written twice into an array
+    of twice the capacity so the most recent values are always contiguous, allowing `last` to return a view without
+    copying. If `track_range` is True the minimum and maximum of the stored values are maintained with monotonic queues
+    so that `min` and `max` are O(1), NaN values are ignored for the range.
+    """
+
+    def __init__(self, capacity, dtype=np.float64, track_range=True):
+        if capacity < 1:
+            raise ValueError("Capacity must be at least 1")
+
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.track_range = track_range
+        self._data = np.zeros(capacity * 2, self.dtype)
+        self._count = 0  # total number of values appended
+        self._minq = deque()  # (index, value) pairs with increasing values, front is the minimum
+        self._maxq = deque()  # (index, value) pairs with decreasing values, front is the maximum
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def __getitem__(self, item):
+        return self.last()[item]
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.last(), dtype)
+
+    def append(self, value):
+        """Append `value`, replacing the oldest value if the buffer is full."""
+        pos = self._count % self.capacity
+        self._data[pos] = value
+        self._data[pos + self.capacity] = value
+        idx = self._count
+        self._count += 1
+
+        if self.track_range:
+            expired = idx - self.capacity  # indices at or below this are no longer in the buffer
+            value = self._data[pos]
+
+            if value == value:  # skip NaN
+                while self._minq and self._minq[-1][1] >= value:
+                    self._minq.pop()
+                while self._maxq and self._maxq[-1][1] <= value:
+                    self._maxq.pop()
+
+                self._minq.append((idx, value))
+                self._maxq.append((idx, value))
+
+            while self._minq and self._minq[0][0] <= expired:
+                self._minq.popleft()
+            while self._maxq and self._maxq[0][0] <= expired:
+                self._maxq.popleft()
+
+    def last(self, n=None):
+        """Returns a read-only view of the last `n` values in order of insertion, or all values if `n` is None."""
+        size = len(self)
+        n = size if n is None else max(0, min(n, size))
+        end = (self._count - 1) % self.capacity + self.capacity + 1
+
+        view = self._data[end - n : end]
+        view.flags.writeable = False
+        return view
+
+    def min(self):
+        """Returns the minimum stored value, or None if there are no values or range tracking is disabled."""
+        return self._minq[0][1] if self._minq else None
+
+    def max(self):
+        """Returns the maximum stored value, or None if there are no values or range tracking is disabled."""
+        return self._maxq[0][1] if self._maxq else None
+
+    def clear(self):
+        self._count = 0
+        self._minq.clear()
+        self._maxq.clear()
+
+
+class SensorRingBuffer:
+    """
+    Collection of ring buffers, one per field in `fields` which maps names to dtypes, defaulting to the fields of
+    `Reading`. Rows are appended as dictionaries and individual fields accessed by indexing with the field name.
+    """
+
+    def __init__(self, capacity, fields=None):
+        fields = fields or reading_fields()
+        self.capacity = capacity
+        self.buffers = {}
+
+        for name, dtype in fields.items():
+            dtype = np.dtype(dtype)
+            self.buffers[name] = RingBuffer(capacity, dtype, track_range=dtype.kind in "fiu")
+
+    def __getitem__(self, name):
+        return self.buffers[name]
+
+    def __len__(self):
+        return min(len(b) for b in self.buffers.values())
+
+    def keys(self):
+        return self.buffers.keys()
+
+    def append(self, row):
+        """Append the values from dictionary `row`, all fields must be present."""
+        for name, buf in self.buffers.items():
+            buf.append(row[name])
+
+    def last(self, n=None):
+        """Returns a dictionary of views of the last `n` values for each field."""
+        return {name: buf.last(n) for name, buf in self.buffers.items()}
@@ -1,69 +1,37 @@
+import signal
+import sys
+import threading
 import time
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from enum import Enum
+from functools import partial
 from itertools import cycle
-from collections import defaultdict
-from colorsys import rgb_to_hls, hls_to_rgb
 
 import numpy as np
 import click
-from PIL import Image, ImageDraw, ImageFont
-import mics6814
-import bme680
-import st7789
-import bh1745
-import psutil  # only needed for CPU temperature compensation
 
-import sqlalchemy
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, Session
-
-# set to whatever other font available, installed with "apt install fonts-freefont-ttf"
-FONT_FILE = "/usr/share/fonts/truetype/freefont/FreeMonoBold.ttf"
+from backends import create_backend, create_display
+from database import BatchWriter, GasBaseline, create_log_engine, load_baseline, save_baseline
+from ringbuffer import SensorRingBuffer
+from display import FONT_FILE, Units, GraphRenderer
+from pipeline import Scheduler, SensorPipeline, StageStats
+from iaq import AdaptiveBaseline, BaselineBurnIn, StreamingIAQ, burn_in_baseline
 
 cpu_temps = []
 
-
-class Base(DeclarativeBase):
-    pass
-
-
-class Reading(Base):
-    """Table definition for log sqlite files."""
-
-    __tablename__ = "readings"
-    date: Mapped[datetime] = mapped_column(primary_key=True)
-    temperature: Mapped[float]
-    pressure: Mapped[float]
-    humidity: Mapped[float]
-    gas_resistance: Mapped[float]
-    iaq: Mapped[float]
-    oxidising: Mapped[float]
-    reducing: Mapped[float]
-    nh3: Mapped[float]
-    r: Mapped[int]
-    g: Mapped[int]
-    b: Mapped[int]
-    c: Mapped[int]
-
-
-def set_lightness(r, g, b, l):
-    """Replace the lightness value of the color (`r`, `g`, `b`) by `l`. RGB values 0-255, `l` 0-1."""
-    h, _, s = rgb_to_hls(r / 255.0, g / 255.0, b / 255.0)
-    nr, ng, nb = hls_to_rgb(h, l, s)
-
-    return int(nr * 255), int(ng * 255), int(nb * 255)
-
-
-class Units(Enum):
-    """Known units and their symbols."""
-
-    temp = "C"
-    ohms = "\u03a9"
-    pressure = "hPa"
-    humidity = "%RH"
-    lux = "lx"
-    none = ""
+# label, units, and Reading field of each graph shown on the display
+GRAPH_FIELDS = (
+    ("Temperature", Units.temp, "temperature"),
+    ("Pressure", Units.pressure, "pressure"),
+    ("Humidity", Units.humidity, "humidity"),
+    #    ("Gas Resist", Units.ohms, "gas_resistance"),
+    ("IAQ", Units.none, "iaq"),
+    ("Oxidising", Units.ohms, "oxidising"),
+    ("Reducing", Units.ohms, "reducing"),
+    ("NH3", Units.ohms, "nh3"),
+    ("Lightness", Units.lux, "c"),
+)
 
 
 class LEDColors(Enum):
@@ -78,39 +46,6 @@ class LEDColors(Enum):
     c7 = (20, 20, 20)
 
 
-class GraphColors(Enum):
-    """Colors to use for graphs, if there are more graphs than colors cycle through the list."""
-
-    c1 = set_lightness(0, 63, 92, 0.5)
-    c2 = set_lightness(68, 78, 134, 0.5)
-    c3 = set_lightness(149, 81, 150, 0.5)
-    c4 = set_lightness(221, 81, 130, 0.5)
-    c5 = set_lightness(255, 110, 84, 0.5)
-    c6 = set_lightness(255, 166, 0, 0.5)
-    c7 = set_lightness(166, 255, 0, 0.5)
-    c8 = set_lightness(255, 255, 255, 0.7)
-
-
-def lighten_darken_color(rgb, factor=0.5):
-    """
-    Light or darken color `rgb` which is a triple of values 0-255. If `factor` is between 0 and 1,
-    the color is lighten (0 unchanged, 1 is white). If `factor` is between -1 and 0, the color is
-    darkened (0 unchanged, -1 black).
-    """
-    factor = np.clip(factor, -1.0, 1.0)
-    r, g, b = rgb
-    h, l, s = rgb_to_hls(r / 255.0, g / 255.0, b / 255.0)
-
-    if factor <= 0:
-        l = (1 + factor) * l
-    else:
-        l = 1 - factor * (1 - l)
-
-    nr, ng, nb = hls_to_rgb(h, l, s)
-
-    return int(nr * 255), int(ng * 255), int(nb * 255)
-
-
 def rgbc_to_rgb(r, g, b, c):
     if c > 0:
         r, g, b = [min(255, int((x / float(c)) * 255)) for x in (r, g, b)]
@@ -119,19 +54,10 @@ def rgbc_to_rgb(r, g, b, c):
     return (0, 0, 0)
 
 
-def format_value(value, unit):
-    """Format the given float value into a string with the given unit, large value ohms reduced to kohms."""
-    unit_str = unit.value
-
-    if unit in (Units.ohms, Units.lux) and value > 1000:
-        unit_str = "k" + unit_str
-        value /= 1000.0
-
-    return f"{value:.3f}{unit_str}"
-
-
 def compensate_temperature(raw_temp, factor=4.0, smooth_size=10):
     """Adjust the raw temperature value based on the CPU temperature to approximate a true temperature."""
+    import psutil  # only needed for CPU temperature compensation
+
     temps = psutil.sensors_temperatures()
     cpu_temp = temps["cpu_thermal"][0].current
     cpu_temps.append(cpu_temp)
@@ -143,6 +69,10 @@ def compensate_temperature(raw_temp, factor=4.0, smooth_size=10):
 
 
 def get_gas_baseline(sensor, burn_in_time=300):
+    """
+    Returns the mean of the last 50 gas resistance readings of `sensor` read over `burn_in_time` seconds, or None if
+    there were no readings with the heater stable.
+    """
     start_time = curr_time = time.time()
     burn_in_data = []
 
@@ -153,61 +83,42 @@ def get_gas_baseline(sensor, burn_in_time=300):
             burn_in_data.append(gas)
             time.sleep(1)
 
-    return sum(burn_in_data[-50:]) / 50.0
-
-
-def computer_indoor_air_quality(gas, hum, gas_baseline, hum_baseline=40.0, hum_weighting=0.25):
-    # from https://github.com/pimoroni/bme680-python/blob/master/examples/indoor-air-quality.py
-    gas_offset = gas_baseline - gas
-    hum_offset = hum - hum_baseline
-
-    # Calculate hum_score as the distance from the hum_baseline.
-    if hum_offset > 0:
-        hum_score = 100 - hum_baseline - hum_offset
-        hum_score /= 100 - hum_baseline
-        hum_score *= hum_weighting * 100
-    else:
-        hum_score = hum_baseline + hum_offset
-        hum_score /= hum_baseline
-        hum_score *= hum_weighting * 100
-
-    # Calculate gas_score as the distance from the gas_baseline.
-    if gas_offset > 0:
-        gas_score = gas / gas_baseline
-        gas_score *= 100 - (hum_weighting * 100)
-    else:
-        gas_score = 100 - (hum_weighting * 100)
-
-    # Calculate air_quality_score.
-    return hum_score + gas_score
+    return burn_in_baseline(burn_in_data)
 
 
-def collect_data(gas_sensor, env_sensor, light_sensor, gas_baseline, timeout=5, sleep_time=0.01):
-    """Collect values from sensors and return as a dictionary."""
+def read_env(env_sensor, iaq_model, timeout=0.05, sleep_time=0.01):
+    """
+    Read the BME688, polling every `sleep_time` seconds until data is ready and the heater is stable or `timeout`
+    seconds have passed, and return its values with the IAQ computed by the `StreamingIAQ` `iaq_model` as a dictionary.
+    """
+    deadline = time.monotonic() + timeout
     env_ready = env_sensor.get_sensor_data()
 
-    while timeout > 0 and (not env_ready or not env_sensor.data.heat_stable):
+    while (not env_ready or not env_sensor.data.heat_stable) and time.monotonic() < deadline:
         time.sleep(sleep_time)
         env_ready = env_sensor.get_sensor_data()
-        timeout -= 1
 
-    if timeout == 0:
-        if not env_ready:
-            raise IOError("Cannot acquire BME688 data")
-        elif not env_sensor.data.heat_stable:
-            raise IOError("BME680 heat not stable")
+    if not env_ready:
+        raise IOError("Cannot acquire BME688 data")
+    elif not env_sensor.data.heat_stable:
+        raise IOError("BME680 heat not stable")
 
-    r, g, b, c = light_sensor.get_rgbc_raw()
+    data = env_sensor.data
+
+    return dict(
+        temperature=data.temperature,
+        pressure=data.pressure,
+        humidity=data.humidity,
+        gas_resistance=data.gas_resistance,
+        iaq=iaq_model.update(data.gas_resistance, data.humidity),
+    )
 
-    iaq = computer_indoor_air_quality(env_sensor.data.gas_resistance, env_sensor.data.humidity, gas_baseline)
+
+def read_fast(gas_sensor, light_sensor):
+    """Read the MICS6814 and BH1745, which can be sampled much faster than the BME688, into a dictionary."""
+    r, g, b, c = light_sensor.get_rgbc_raw()
 
     return dict(
-        date=datetime.now(),
-        temperature=env_sensor.data.temperature,
-        pressure=env_sensor.data.pressure,
-        humidity=env_sensor.data.humidity,
-        gas_resistance=env_sensor.data.gas_resistance,
-        iaq=iaq,
         oxidising=gas_sensor.read_oxidising(),
         reducing=gas_sensor.read_reducing(),
         nh3=gas_sensor.read_nh3(),
@@ -218,68 +129,75 @@ def collect_data(gas_sensor, env_sensor, light_sensor, gas_baseline, timeout=5,
     )
 
 
-def draw_sensors(
-    sensors,
-    bg_color=(20, 20, 20),
-    graph_dims=(140, 25),
-    spacing=4,
-    image_dims=(240, 240),
-    light_dark_factor=-0.9,
-    font_size=12,
-    text_color=(200, 200, 200),
-):
-    """Draw the log graphs and sensor values into a PIL image."""
-    startx, starty = spacing - 1, spacing - 1
-    graphw, graphh = graph_dims
-    colors = cycle(GraphColors)
-
-    font = ImageFont.truetype(FONT_FILE, size=font_size)
-
-    pilim = Image.new("RGB", image_dims, bg_color)
-    draw = ImageDraw.Draw(pilim)
-
-    for name, unit, values in sensors:
-        col = next(colors).value
-        bgcol = lighten_darken_color(col, light_dark_factor)
-
-        graph_vals = np.full(graphw, np.nan, np.float32)
-
-        num_vals = min(graphw, len(values))
-        if num_vals > 0:
-            sel_values = np.asarray(values[-num_vals:])
-            graph_vals[-num_vals:] = sel_values
-            minv = min(values)
-            maxv = max(values)
-            diff = (maxv - minv) or 1.0
-        else:
-            minv = maxv = 0.0
-            diff = 1.0
+def collect_data(gas_sensor, env_sensor, light_sensor, iaq_model, timeout=0.05, sleep_time=0.01):
+    """Collect values from sensors and return as a dictionary."""
+    env = read_env(env_sensor, iaq_model, timeout, sleep_time)
 
-        text_pos = (startx + graphw + spacing, starty)
-        text = f"{name}\n{format_value(graph_vals[-1],unit)}"
+    return dict(date=datetime.now(), **env, **read_fast(gas_sensor, light_sensor))
 
-        draw.rectangle([(startx, starty), (startx + graphw, starty + graphh)], fill=bgcol)
-        draw.multiline_text(text_pos, text, font=font, fill=text_color)
 
-        # draw the graph by drawing a vertical line for every value in graph_vals
-        for x in range(graphw):
-            if np.isnan(graph_vals[x]):
-                continue
+class MultiRateCollector:
+    """
+    Collects readings at a higher rate than the BME688 allows. The BME688 is read in a background thread on its own
+    schedule every `env_period` seconds, as its gas heater cycle limits its rate, while the MICS6814 and BH1745 are read
+    on every call to `collect`. Each row merges the fast readings with the latest BME688 values, and an IOError is
+    raised if these are older than `max_age` periods.
+    """
 
-            y = (graph_vals[x] - minv) / diff
-            indy = starty + int((1 - y) * (graphh - 1))
-            indx = startx + x
+    def __init__(self, gas_sensor, env_sensor, light_sensor, iaq_model, env_period=1.0, max_age=5):
+        self.gas_sensor = gas_sensor
+        self.env_sensor = env_sensor
+        self.light_sensor = light_sensor
+        self.iaq_model = iaq_model
+        self.env_period = env_period
+        self.max_age = max_age
+        self.env = None  # latest BME688 values
+        self.env_time = 0.0  # monotonic time of the latest BME688 values
+        self.env_ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._env_loop, name="BME688", daemon=True)
+        self._thread.start()
+        self.env_ready.wait(env_period * max_age)  # give the first reading time to arrive before sampling starts
+
+    def _env_loop(self):
+        scheduler = Scheduler(self.env_period, sleep=self._stop.wait)
+
+        while not self._stop.is_set():
+            scheduler.wait()
+
+            try:
+                env = read_env(self.env_sensor, self.iaq_model, timeout=self.env_period / 2)
+            except Exception:
+                traceback.print_exc()
+            else:
+                self.env, self.env_time = env, time.monotonic()
+                self.env_ready.set()
+
+    def collect(self):
+        """Read the fast sensors and return a row merged with the latest BME688 values."""
+        if not self.env_ready.wait(self.env_period * self.max_age):
+            raise IOError("Cannot acquire BME688 data")
 
-            if 0 <= indy < image_dims[0] and 0 <= indx < image_dims[1]:
-                draw.line([(indx, indy), (indx, starty + graphh)], fill=col)
+        env, env_time = self.env, self.env_time
+        if time.monotonic() - env_time > self.env_period * self.max_age:
+            raise IOError("BME688 data is stale")
 
-        starty += graphh + spacing
+        return dict(date=datetime.now(), **env, **read_fast(self.gas_sensor, self.light_sensor))
 
-    return pilim
+    def close(self):
+        self._stop.set()
+        self._thread.join()
 
 
 @click.command("sensor_logger")
 @click.option("-d", "--delay", type=float, default=1.0, show_default=True, help="Delay between samples")
+@click.option(
+    "-e",
+    "--env_delay",
+    type=float,
+    default=None,
+    help="Delay between BME688 reads if longer than DELAY, so other sensors are sampled at the faster rate",
+)
 @click.option("-i", "--interval", type=int, default=60, show_default=True, help="Display update interval")
 @click.option(
     "-m",
@@ -297,100 +215,198 @@ def draw_sensors(
     show_default=True,
     help="File to log data to",
 )
-def log_sensor_data(delay, interval, max_data_len, logfile):
+@click.option(
+    "-f",
+    "--flush_size",
+    type=int,
+    default=100,
+    show_default=True,
+    help="Number of pending readings which triggers a write to the log",
+)
+@click.option(
+    "-F",
+    "--flush_interval",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="Maximum time in seconds readings are held before being written to the log",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(["hardware", "simulated"]),
+    default="hardware",
+    show_default=True,
+    help="Read from the sensors or from deterministic simulated sensors",
+)
+@click.option(
+    "--display",
+    type=click.Choice(["st7789", "file", "null"]),
+    default="st7789",
+    show_default=True,
+    help="Show graphs on the ST7789, save them to sensor_display.png, or discard them",
+)
+@click.option("--font_file", default=FONT_FILE, show_default=True, help="TrueType font to render labels with")
+@click.option("--burn_in", type=float, default=300, show_default=True, help="Gas sensor burn-in time in seconds")
+@click.option(
+    "--baseline_mode",
+    type=click.Choice(AdaptiveBaseline.MODES),
+    default="fixed",
+    show_default=True,
+    help="Keep the burn-in gas baseline fixed or adapt it with a moving average or windowed percentile",
+)
+@click.option(
+    "--gas_baseline",
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help="Gas baseline to use instead of a stored or burned in one, stored only in the log, eg. for simulated runs",
+)
+@click.option(
+    "--baseline_file",
+    type=click.Path(dir_okay=False, writable=True, resolve_path=True),
+    default="./gas_baseline.sqlite",
+    show_default=True,
+    help="Sqlite file the gas baseline is stored in between runs",
+)
+@click.option(
+    "--baseline_max_age",
+    type=float,
+    default=24.0,
+    show_default=True,
+    help="Age in hours after which a stored gas baseline is not used",
+)
+@click.option("--sim_seed", type=int, default=0, show_default=True, help="Seed for the simulated sensor signals")
+@click.option("--sim_latency", type=float, default=0.0, show_default=True, help="Simulated sensor read latency")
+@click.option("--sim_fault_rate", type=float, default=0.0, show_default=True, help="Simulated sensor fault rate")
+def log_sensor_data(
+    delay,
+    env_delay,
+    interval,
+    max_data_len,
+    logfile,
+    flush_size,
+    flush_interval,
+    backend,
+    display,
+    font_file,
+    burn_in,
+    baseline_mode,
+    gas_baseline,
+    baseline_file,
+    baseline_max_age,
+    sim_seed,
+    sim_latency,
+    sim_fault_rate,
+):
     """
     Logs sensor data from the BME688, MICS6814, and BH1745 sensors, displaying graph results on the ST7789 display.
-    Readings are taken at DELAY intervals (in seconds), which are logged in Sqlite form to LOGFILE.
-    The program will loop forever until interrupted on the console.
+    Readings are taken at DELAY intervals (in seconds) aligned to the clock, which are logged in Sqlite form to LOGFILE.
+    If ENV_DELAY is longer than DELAY the BME688 is read at that interval in the background while the MICS6814 and
+    BH1745 are read every DELAY, with each reading holding the latest BME688 values. Readings are written in batches by
+    a background thread every FLUSH_SIZE readings or FLUSH_INTERVAL seconds, whichever is first. Sampling, storage,
+    and display run in separate threads so slow rendering or commits do not delay sampling. The gas baseline for IAQ
+    found during burn-in is kept fixed or adapted with every reading as chosen by BASELINE_MODE. Baselines are stored in
+    BASELINE_FILE and the log, if one younger than BASELINE_MAX_AGE hours is stored logging starts immediately using
+    it while the burn-in runs on the logged readings, with IAQ values provisional until the burn-in completes. Runs
+    with the simulated BACKEND store baselines only in the log. A known baseline can be given with GAS_BASELINE to skip
+    the burn-in, this is also stored only in the log.
+    The program will loop forever until interrupted on the console, pending readings are written and stage latencies
+    printed before exiting. With the simulated BACKEND and a null or file DISPLAY the logger runs without any hardware.
     """
-    try:
-        env_sensor = bme680.BME680(bme680.I2C_ADDR_PRIMARY)
-    except (RuntimeError, IOError):
-        env_sensor = bme680.BME680(bme680.I2C_ADDR_SECONDARY)
-
-    env_sensor.set_humidity_oversample(bme680.OS_2X)
-    env_sensor.set_pressure_oversample(bme680.OS_4X)
-    env_sensor.set_temperature_oversample(bme680.OS_8X)
-    env_sensor.set_filter(bme680.FILTER_SIZE_3)
-    env_sensor.set_gas_status(bme680.ENABLE_GAS_MEAS)
-    env_sensor.set_gas_heater_temperature(320)
-    env_sensor.set_gas_heater_duration(150)
-    env_sensor.select_gas_heater_profile(0)
-
-    gas_sensor = mics6814.MICS6814()
-
-    light_sensor = bh1745.BH1745()
-    light_sensor.setup()
-    light_sensor.set_leds(0)
-    light_sensor._enable_channel_compensation = False
-    # might be sensible values instead of disabling compensation:
-    # light_sensor._channel_compensation = (0.9, 0.5, 0.95, 10.0)
-
-    disp = st7789.ST7789(
-        port=0,
-        cs=st7789.BG_SPI_CS_FRONT,  # BG_SPI_CS_BACK or BG_SPI_CS_FRONT
-        dc=9,
-        backlight=19,  # 18 for back BG slot, 19 for front BG slot.
-        spi_speed_hz=80 * 1000 * 1000,
-        offset_left=0,
-    )
-    disp.begin()
+    # exit through SystemExit on termination so that pending readings are flushed
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
 
-    sensor_arrays = defaultdict(list)
-    except_retries = 3  # how many times to try recording data if an exception happens
-    count = 0
+    sensors = create_backend(backend, seed=sim_seed, latency=sim_latency, fault_rate=sim_fault_rate)
+    env_sensor = sensors.env_sensor
+    gas_sensor = sensors.gas_sensor
+    light_sensor = sensors.light_sensor
+    disp = create_display(display, "sensor_display.png")
+
+    sensor_arrays = SensorRingBuffer(max_data_len)
     led_color = cycle(LEDColors)
+    draw_values = [(label, unit, sensor_arrays[field]) for label, unit, field in GRAPH_FIELDS]
+    renderer = GraphRenderer(font_file=font_file)
+
+    engine = create_log_engine(logfile)
+    # simulated baselines must not be stored where hardware runs would load them
+    baseline_engines = [engine]
+    if backend != "simulated":
+        baseline_engines.append(create_log_engine(baseline_file, tables=[GasBaseline.__table__]))
+
+    def store_baseline(baseline, provisional=False):
+        date = datetime.now()
+        for e in baseline_engines:
+            save_baseline(e, baseline, provisional, date)
+
+    stored = None
+    if gas_baseline is None and backend != "simulated":
+        stored = load_baseline(baseline_engines[-1], timedelta(hours=baseline_max_age))
+
+    if gas_baseline is not None:
+        save_baseline(engine, gas_baseline)
+        baseline_burn_in = None
+    elif stored is None:
+        gas_baseline = get_gas_baseline(env_sensor, burn_in)
+        if gas_baseline is None:
+            raise click.ClickException("No stable gas readings during burn-in, increase --burn_in")
+
+        store_baseline(gas_baseline)
+        baseline_burn_in = None
+    else:
+        gas_baseline, baseline_date = stored
+        print(f"Using gas baseline {gas_baseline:.1f} from {baseline_date}, IAQ is provisional until burn-in completes")
+        store_baseline(gas_baseline, True)
+        baseline_burn_in = BaselineBurnIn(burn_in, on_done=store_baseline)
 
-    draw_values = (
-        ("Temperature", Units.temp, sensor_arrays["temperature"]),
-        ("Pressure", Units.pressure, sensor_arrays["pressure"]),
-        ("Humidity", Units.humidity, sensor_arrays["humidity"]),
-        #        ("Gas Resist", Units.ohms, sensor_arrays["gas_resistance"]),
-        ("IAQ", Units.none, sensor_arrays["iaq"]),
-        ("Oxidising", Units.ohms, sensor_arrays["oxidising"]),
-        ("Reducing", Units.ohms, sensor_arrays["reducing"]),
-        ("NH3", Units.ohms, sensor_arrays["nh3"]),
-        ("Lightness", Units.lux, sensor_arrays["c"]),
-    )
+    iaq_model = StreamingIAQ(AdaptiveBaseline(gas_baseline, baseline_mode), burn_in=baseline_burn_in)
 
-    gas_baseline = get_gas_baseline(env_sensor)
+    commit_stats = StageStats("commit")
+    writer = BatchWriter(engine, flush_size, flush_interval, stats=commit_stats)
 
-    engine = sqlalchemy.create_engine(f"sqlite:///{logfile}", echo=False)
-    Base.metadata.create_all(engine)
+    if env_delay is not None and env_delay > delay:
+        collector = MultiRateCollector(gas_sensor, env_sensor, light_sensor, iaq_model, env_delay)
+        collect = collector.collect
+    else:
+        collector = None
+        collect = partial(collect_data, gas_sensor, env_sensor, light_sensor, iaq_model)
+
+    def sample():
+        dat = collect()
 
-    while except_retries >= 0:
-        try:
-            start = time.time()
-            dat = collect_data(gas_sensor, env_sensor, light_sensor, gas_baseline)
+        # Adjust for heating from CPU, omit if BME680 is thermally isolated or if this isn't trusted.
+        # dat["temperature"] = compensate_temperature(dat["temperature"])
 
-            # Adjust for heating from CPU, omit if BME680 is thermally isolated or if this isn't trusted.
-            # dat["temperature"] = compensate_temperature(dat["temperature"])
+        gas_sensor.set_led(*next(led_color).value)
+        return dat
 
-            with Session(engine) as session:
-                session.add(Reading(**dat))
-                session.commit()
+    def show(dat):
+        sensor_arrays.append(dat)
 
-            if (count % interval) == 0:
-                count = 0
-                for k, v in dat.items():
-                    sensor_arrays[k][:] = sensor_arrays[k][-max_data_len:] + [v]
+        with pipeline.stat("render").time():
+            im = renderer.render(draw_values)
 
-                im = draw_sensors(draw_values)
+        # only save and push regions which changed, nothing is sent if the image is unchanged
+        if renderer.dirty:
+            with pipeline.stat("save").time():
                 im.save("sensor_logger.png")
-                disp.display(im)
-
-            count += 1
-            tdelta = time.time() - start
-
-            gas_sensor.set_led(*next(led_color).value)
-            time.sleep(max(0, delay - tdelta))
-        except KeyboardInterrupt:
-            except_retries = -1
-        except Exception as e:
-            traceback.print_exc()
-            except_retries -= 1
-        else:
-            except_retries = 3
+            with pipeline.stat("push").time():
+                disp.update(renderer.array, renderer.dirty)
+
+    pipeline = SensorPipeline(sample, writer, show, delay, interval)
+    pipeline.stats["commit"] = commit_stats
+
+    try:
+        pipeline.run()
+    finally:
+        if collector is not None:
+            collector.close()
+        writer.close()
+
+        # adapted baselines are measured continuously so keep them for the next run, fixed ones keep their burn-in date
+        if baseline_mode != "fixed" and not iaq_model.provisional:
+            store_baseline(iaq_model.baseline.value)
+
+        print(pipeline.summary())
+        print(f"readings dropped by the writer: {writer.num_dropped}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,341 @@
+#! /usr/bin/env python3
+
+'''
+Benchmarks for the thermal camera which run without the camera or display, using SDL's dummy video driver:
+
+    python3 benchmark.py render --frames 500 --size 240
+    python3 benchmark.py acquire --seconds 5
+    python3 benchmark.py pipeline --frames 1000
+    python3 benchmark.py record --hours 1
+    python3 benchmark.py display --frames 500
+'''
+
+import os
+import time
+import argparse
+import tempfile
+
+os.environ['SDL_VIDEODRIVER']=os.environ.get('SDL_VIDEODRIVER','dummy')
+
+import numpy as np
+import pygame
+
+from render import FrameRenderer, KERNELS
+from pipeline import TemporalFilter, AutoRange, Pipeline
+from sources import FakeAMG88XX, AcquisitionThread, SENSORRATE
+from recording import FrameRecorder, FrameReader, ReplayThread
+
+cmaps=['inferno','gist_heat','hot','bwr','coolwarm','gist_rainbow','gray']
+
+
+def randomFrames(num,width=8,height=8,seed=0):
+    '''Returns `num' random unit valued frames resembling a warm object in front of a cooler background.'''
+    rng=np.random.default_rng(seed)
+    y,x=np.mgrid[:height,:width]
+    frames=[]
+    for i in range(num):
+        cx,cy=rng.uniform(0,width),rng.uniform(0,height)
+        blob=np.exp(-((x-cx)**2+(y-cy)**2)/8.0)
+        frames.append(np.clip(blob+rng.normal(0,0.05,blob.shape),0,1))
+
+    return frames
+
+
+def originalRender(im,mapIndex,size):
+    '''The original frame rendering, applying the float colormap then resizing with PIL.'''
+    import matplotlib.pyplot as plt
+    from PIL import Image
+
+    cm=plt.get_cmap(cmaps[mapIndex])
+    im=Image.fromarray((cm(im)[...,:3]*255).astype(np.uint8))
+    im=im.resize((size,size),Image.BICUBIC)
+    return pygame.image.fromstring(im.tobytes(),im.size,im.mode)
+
+
+def benchRender(args):
+    '''Compare the frames per second of the original and lookup table rendering, with and without drawing to the display.'''
+    pygame.init()
+    surf=pygame.display.set_mode((args.size*4//3,args.size))
+    imsurf=surf.subsurface((0,0,args.size,args.size))
+    frames=randomFrames(args.frames)
+    renderer=FrameRenderer((8,8),(args.size,args.size),cmaps,imsurf)
+
+    def original(im,i):
+        surf.blit(originalRender(im,i%len(cmaps),args.size),(0,0))
+
+    def lut(im,i):
+        renderer.render(im,i%len(cmaps))
+        renderer.draw()
+
+    lut(frames[0],0)
+    assert np.array_equal(pygame.surfarray.array3d(imsurf),renderer.toRGB()),'Drawn image differs from rendered colors'
+
+    print('%i frames rendered at %ix%i, SDL driver %s'%(args.frames,args.size,args.size,pygame.display.get_driver()))
+
+    base=None
+    for name,func in (('original',original),('lookup table',lut)):
+        for i,im in enumerate(frames[:10]): # warm up, including importing matplotlib for the original
+            func(im,i)
+
+        for update in (False,True):
+            start=time.perf_counter()
+            for i,im in enumerate(frames):
+                func(im,i)
+                if update:
+                    pygame.display.update()
+            fps=len(frames)/(time.perf_counter()-start)
+
+            base=base or fps
+            print('%-13s %-18s %8.1f fps, %.2fx'%(name+':','render+display' if update else 'render',fps,fps/base))
+
+    pygame.quit()
+
+
+def benchAcquire(args):
+    '''
+    Compare reading the simulated sensor synchronously in the display loop against the acquisition thread, reporting
+    frames displayed, how many were repeats of a frame already shown, and the CPU time used.
+    '''
+    pygame.init()
+    size=240
+    surf=pygame.display.set_mode((size*4//3,size))
+    renderer=FrameRenderer((8,8),(size,size),cmaps,surf.subsurface((0,0,size,size)))
+
+    def display(frame):
+        im=np.clip((np.rot90(frame,3)-20)/20,0,1)
+        renderer.render(im,0)
+        renderer.draw()
+        pygame.display.update()
+
+    def synchronous(sensor,end):
+        frames=[]
+        while time.monotonic()<end:
+            frame=np.asarray(sensor.pixels,np.float32)
+            display(frame)
+            frames.append(frame.tobytes())
+
+        return frames
+
+    def threaded(sensor,end):
+        frames=[]
+        acquisition=AcquisitionThread(sensor)
+        acquisition.start()
+        raw=np.zeros((8,8),np.float32)
+        seq=0
+        while time.monotonic()<end:
+            if acquisition.frames.wait(seq,0.5):
+                seq,_=acquisition.frames.read(raw)
+                display(raw)
+                frames.append(raw.tobytes())
+
+        acquisition.stop()
+        return frames
+
+    for name,func in (('synchronous',synchronous),('acquisition thread',threaded)):
+        sensor=FakeAMG88XX(latency=args.latency,seed=0)
+        start=time.process_time()
+        frames=func(sensor,time.monotonic()+args.seconds)
+        cpu=time.process_time()-start
+
+        repeats=sum(a==b for a,b in zip(frames,frames[1:]))
+        print('%-19s %5i frames displayed, %5i repeats, %.1f fps, CPU %.0f%%'%(name+':',len(frames),repeats,
+              len(frames)/args.seconds,cpu*100/args.seconds))
+
+    pygame.quit()
+
+
+def benchPipeline(args):
+    '''
+    Run simulated frames through the processing pipeline with each filter mode and interpolation kernel, reporting the
+    error of the filtered temperatures against the noise-free scene, how much the automatic range moves between frames
+    compared to ranging each frame by its own minimum and maximum, and the time taken by each stage.
+    '''
+    sensor=FakeAMG88XX(seed=0)
+    frames=[sensor.frame(i) for i in range(args.frames)]
+    truth=[sensor.frame(i,False) for i in range(args.frames)]
+
+    def rms(filtered):
+        return np.sqrt(np.mean([(f-t)**2 for f,t in zip(filtered,truth)]))
+
+    def jitter(limits):
+        return np.abs(np.diff(limits,axis=0)).mean()
+
+    print('%i frames, %ix%i output'%(args.frames,args.size,args.size))
+    print('raw frames: error %.3fC RMS, per-frame min/max range moves %.3fC per frame'%(rms(frames),
+          jitter([(f.min(),f.max()) for f in frames])))
+
+    for mode in TemporalFilter.MODES:
+        for kernel in KERNELS:
+            autorange=AutoRange((8,8))
+            tfilter=TemporalFilter((8,8),mode)
+            pipeline=Pipeline([tfilter,autorange,FrameRenderer((8,8),(args.size,args.size),cmaps,kernel=kernel)])
+            filtered=[]
+            limits=[]
+            for f in frames:
+                pipeline.process(f)
+                filtered.append(tfilter.state.copy())
+                limits.append((autorange.minv,autorange.maxv))
+
+            times=', '.join('%s %.3fms'%(name,t) for name,t in pipeline.timings().items())
+            print('%-6s %-8s error %.3fC RMS, range moves %.3fC per frame, %s'%(mode,kernel,rms(filtered),
+                  jitter(limits),times))
+
+
+def benchRecord(args):
+    '''
+    Record simulated frames for the given number of hours at the sensor's rate, reporting the file size and the time to
+    write and open it, checking the frames read back match, then replaying part of it at an accelerated speed.
+    '''
+    sensor=FakeAMG88XX(seed=0)
+    num=int(args.hours*3600*SENSORRATE)
+    frames=[sensor.frame(i%1000) for i in range(1000)] # cycle through fewer frames so generating them doesn't dominate
+
+    with tempfile.TemporaryDirectory() as d:
+        filename=os.path.join(d,'bench.thrm')
+
+        start=time.perf_counter()
+        recorder=FrameRecorder(filename)
+        for i in range(num):
+            recorder.write(frames[i%len(frames)],i/SENSORRATE)
+        recorder.close()
+        writeTime=time.perf_counter()-start
+
+        size=os.path.getsize(filename)
+        print('%i frames (%.1f hours): %.2f MB, %i bytes per frame, written in %.2fs'%(num,args.hours,size/1e6,
+              size/num,writeTime))
+
+        start=time.perf_counter()
+        reader=FrameReader(filename)
+        openTime=time.perf_counter()-start
+        print('Opened in %.2fms, frames %r %s, shares file memory: %s'%(openTime*1000,reader.frames.shape,
+              reader.frames.dtype,np.shares_memory(reader.frames,reader.records)))
+
+        expected=np.array(frames,np.float16)
+        assert np.array_equal(reader.frames[:len(frames)],expected),'Frames read differ from those written'
+        assert np.array_equal(reader.times,np.arange(num)/SENSORRATE),'Timestamps read differ from those written'
+        print('Largest float16 rounding error: %.4fC'%np.abs(expected-np.array(frames)).max())
+
+        start=time.perf_counter()
+        mean=reader.frames.mean(axis=0,dtype=np.float32)
+        print('Mean frame over the recording computed in %.2fms, centre %.2fC'%((time.perf_counter()-start)*1000,
+              mean[3:5,3:5].mean()))
+
+        replay=ReplayThread(filename,args.speed)
+        replay.start()
+        time.sleep(args.seconds)
+        replay.stop()
+        replay.join()
+        expectedFrames=args.seconds*SENSORRATE*args.speed
+        print('Replayed at %gx: %i frames in %gs, expected %i'%(args.speed,replay.numFrames,args.seconds,expectedFrames))
+
+
+def benchDisplay(args):
+    '''
+    Compare filling, drawing, and updating the whole display with a newly rendered label every frame as the app did
+    against drawing and updating only the changed regions with cached labels, for a moving and a still scene, reporting
+    frames per second and the pixels sent to the display per frame.
+    '''
+    pygame.init()
+    size=240
+    surf=pygame.display.set_mode((size*4//3,size))
+    imsurf=surf.subsurface((0,0,size,size))
+    font=pygame.font.Font(None,20)
+    sensor=FakeAMG88XX(seed=0)
+    scenes=(('moving',[sensor.frame(i) for i in range(args.frames)]),('still',[sensor.frame(0,False)]*args.frames))
+
+    def full(pipeline,renderer,autorange,frames):
+        sent=0
+        for frame in frames:
+            pipeline.process(frame)
+            label=font.render('Min: %.2i Max: %.2i'%(autorange.minv,autorange.maxv),1,(255,255,255))
+            surf.fill((0,0,0))
+            renderer.draw(True)
+            surf.blit(label,(size+15,15))
+            pygame.display.update()
+            sent+=width*height
+
+        return sent
+
+    def partial(pipeline,renderer,autorange,frames):
+        labels={}
+        label=None
+        labelRect=pygame.Rect(size+15,15,0,0)
+        sent=0
+        for frame in frames:
+            pipeline.process(frame)
+            dirty=[]
+            drawn=renderer.draw()
+            if drawn:
+                dirty.append(drawn)
+
+            text='Min: %.2i Max: %.2i'%(autorange.minv,autorange.maxv)
+            if text not in labels:
+                labels[text]=font.render(text,1,(255,255,255))
+
+            if labels[text] is not label:
+                surf.fill((0,0,0),labelRect)
+                dirty.append(labelRect)
+                label=labels[text]
+                labelRect=surf.blit(label,(size+15,15))
+                dirty.append(labelRect)
+
+            if dirty:
+                pygame.display.update(dirty)
+                sent+=sum(r.width*r.height for r in dirty)
+
+        return sent
+
+    width,height=surf.get_size()
+    print('%i frames at %ix%i, SDL driver %s'%(args.frames,width,height,pygame.display.get_driver()))
+
+    for scene,frames in scenes:
+        for name,func in (('full update',full),('changed regions',partial)):
+            surf.fill((0,0,0))
+            renderer=FrameRenderer((8,8),(size,size),cmaps,imsurf)
+            autorange=AutoRange((8,8))
+            pipeline=Pipeline([TemporalFilter((8,8)),autorange,renderer])
+
+            start=time.perf_counter()
+            sent=func(pipeline,renderer,autorange,frames)
+            fps=len(frames)/(time.perf_counter()-start)
+
+            shown=pygame.surfarray.array3d(imsurf)
+            assert np.array_equal(shown,renderer.toRGB()),'Displayed image differs from the last rendered'
+
+            print('%-7s %-16s %8.1f fps, %8i pixels sent per frame'%(scene+':',name,fps,sent/len(frames)))
+
+    pygame.quit()
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub=parser.add_subparsers(dest='command')
+    sub.required=True
+
+    p=sub.add_parser('render',help=benchRender.__doc__)
+    p.add_argument('--frames',type=int,default=500,help='Number of frames to render')
+    p.add_argument('--size',type=int,default=240,help='Width and height of the rendered image')
+    p.set_defaults(func=benchRender)
+
+    p=sub.add_parser('acquire',help=benchAcquire.__doc__)
+    p.add_argument('--seconds',type=float,default=5,help='Seconds to run each loop for')
+    p.add_argument('--latency',type=float,default=0.003,help='Simulated seconds to read a frame over I2C')
+    p.set_defaults(func=benchAcquire)
+
+    p=sub.add_parser('pipeline',help=benchPipeline.__doc__)
+    p.add_argument('--frames',type=int,default=1000,help='Number of frames to process')
+    p.add_argument('--size',type=int,default=240,help='Width and height of the rendered image')
+    p.set_defaults(func=benchPipeline)
+
+    p=sub.add_parser('record',help=benchRecord.__doc__)
+    p.add_argument('--hours',type=float,default=1,help='Hours of frames to record')
+    p.add_argument('--speed',type=float,default=10,help='Replay speed')
+    p.add_argument('--seconds',type=float,default=2,help='Seconds to replay for')
+    p.set_defaults(func=benchRecord)
+
+    p=sub.add_parser('display',help=benchDisplay.__doc__)
+    p.add_argument('--frames',type=int,default=500,help='Number of frames to display')
+    p.set_defaults(func=benchDisplay)
+
+    args=parser.parse_args()
+    args.func(args)
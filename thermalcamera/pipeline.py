@@ -0,0 +1,130 @@
+'''
+Frame processing pipeline for the thermal camera. Frames pass through a sequence of stages, each with a `name' and a
+`process' method taking a frame and returning its output in an array preallocated by the stage, so processing a frame
+allocates nothing and takes constant time. The pipeline times each stage, and can be run over recorded frames.
+'''
+
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class TemporalFilter(object):
+    '''
+    Reduces sensor noise by filtering each pixel over time. With `mode' "ema" this is an exponential moving average
+    with weight `alpha' given to each new frame. With "kalman" each pixel is a constant value Kalman filter with process
+    noise variance `q' and measurement noise variance `r', which follows quickly from the first frame then settles to
+    the steady state gain. The first frame initializes the filter state.
+    '''
+    name='filter'
+    MODES=('ema','kalman')
+
+    def __init__(self,shape,mode='kalman',alpha=0.5,q=0.2,r=0.25):
+        if mode not in self.MODES:
+            raise ValueError('Unknown filter mode %r'%mode)
+
+        self.mode=mode
+        self.alpha=alpha
+        self.q=q
+        self.r=r
+        self.state=np.zeros(shape) # filtered frame
+        self.var=np.zeros(shape) # Kalman estimate variances
+        self.gain=np.zeros(shape) # Kalman gains
+        self.diff=np.zeros(shape) # scratch space for the difference between the frame and state
+        self.initialized=False
+
+    def reset(self):
+        self.initialized=False
+
+    def process(self,frame):
+        if not self.initialized:
+            self.state[...]=frame
+            self.var.fill(self.r)
+            self.initialized=True
+            return self.state
+
+        np.subtract(frame,self.state,out=self.diff)
+
+        if self.mode=='ema':
+            self.diff*=self.alpha
+        else:
+            self.var+=self.q # predict
+            np.add(self.var,self.r,out=self.gain)
+            np.divide(self.var,self.gain,out=self.gain) # gain=var/(var+r)
+            self.diff*=self.gain
+            np.multiply(self.var,1-self.gain,out=self.var) # update
+
+        self.state+=self.diff
+        return self.state
+
+
+class AutoRange(object):
+    '''
+    Rescales frames to unit values. Ranges are given in `ranges' as (min, max) pairs indexed by the member `mode', with
+    (None, None) for automatic ranging, in which case the range tracks each frame's minimum and maximum with an
+    exponential moving average of weight `alpha' so the displayed range doesn't jump with noise. The range used for
+    the last frame is in `minv' and `maxv'.
+    '''
+    name='range'
+
+    def __init__(self,shape,ranges=((None,None),),mode=0,alpha=0.2):
+        self.ranges=ranges
+        self.mode=mode
+        self.alpha=alpha
+        self.out=np.zeros(shape)
+        self.minv=None
+        self.maxv=None
+        self.autoMin=None # tracked automatic range
+        self.autoMax=None
+
+    def process(self,frame):
+        minv,maxv=self.ranges[self.mode]
+
+        if minv is None or maxv is None:
+            fmin,fmax=frame.min(),frame.max()
+            if self.autoMin is None:
+                self.autoMin,self.autoMax=fmin,fmax
+            else:
+                self.autoMin+=self.alpha*(fmin-self.autoMin)
+                self.autoMax+=self.alpha*(fmax-self.autoMax)
+
+            minv,maxv=self.autoMin,self.autoMax
+
+        self.minv,self.maxv=minv,maxv
+
+        # rescale image to unit values (pixels values between 0 and 1) based on the given minv and maxv thresholds
+        if maxv>minv:
+            np.subtract(frame,minv,out=self.out)
+            self.out*=1.0/(maxv-minv)
+        else:
+            self.out[...]=frame
+
+        return np.clip(self.out,0,1,out=self.out)
+
+
+class Pipeline(object):
+    '''Runs frames through the list of stages `stages' in order, accumulating the time spent in each.'''
+    def __init__(self,stages):
+        self.stages=list(stages)
+        self.times=OrderedDict((s.name,0.0) for s in self.stages)
+        self.numFrames=0
+
+    def process(self,frame):
+        '''Process `frame' through each stage, returning the output of the last.'''
+        for stage in self.stages:
+            start=time.perf_counter()
+            frame=stage.process(frame)
+            self.times[stage.name]+=time.perf_counter()-start
+
+        self.numFrames+=1
+        return frame
+
+    def run(self,frames):
+        '''Yields the output of processing each of `frames', which is reused so must be copied to be kept.'''
+        for frame in frames:
+            yield self.process(frame)
+
+    def timings(self):
+        '''Returns the mean milliseconds per frame spent in each stage.'''
+        return OrderedDict((name,t*1000/max(1,self.numFrames)) for name,t in self.times.items())
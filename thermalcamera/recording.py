@@ -0,0 +1,182 @@
+'''
+Recording and replay of raw thermal camera frames. Recordings are a small header followed by fixed size records, each a
+float64 timestamp and a float16 frame, so files are only ever appended to, a partly written final record from a crash
+is simply ignored, and a recording of any length is opened as a memory map without reading it. At 10 frames per second
+an hour of 8x8 frames is about 5MB.
+'''
+
+import os
+import time
+import struct
+import threading
+
+import numpy as np
+
+from sources import DoubleBuffer, HEIGHT, WIDTH
+
+MAGIC=b'THRM'
+VERSION=1
+HEADER=struct.Struct('<4sHHHxxd') # magic, version, height, width, creation time
+HEADERSIZE=32 # header is padded so records start on an aligned offset
+CHUNKSIZE=50 # records buffered before writing to the file, 5 seconds at the sensor's rate
+EXTENSION='.thrm'
+
+
+def recordType(height=HEIGHT,width=WIDTH):
+    '''Returns the numpy structured type of records of frames of the given dimensions.'''
+    return np.dtype([('time','<f8'),('frame','<f2',(height,width))])
+
+
+def readHeader(fileobj):
+    '''Read the header from the start of `fileobj', returning the (height,width,created) tuple.'''
+    data=fileobj.read(HEADERSIZE)
+    if len(data)<HEADERSIZE:
+        raise IOError('Truncated recording header')
+
+    magic,version,height,width,created=HEADER.unpack_from(data)
+    if magic!=MAGIC:
+        raise IOError('Not a frame recording')
+    if version!=VERSION:
+        raise IOError('Unsupported recording version %i'%version)
+
+    return height,width,created
+
+
+class FrameRecorder(object):
+    '''
+    Appends frames of shape `shape' with their timestamps to the recording `filename', creating it if it doesn't exist.
+    Records are buffered and written in chunks of `chunksize', so call flush() or close() to write the remainder. Only
+    one thread should write to a recorder.
+    '''
+    def __init__(self,filename,shape=(HEIGHT,WIDTH),chunksize=CHUNKSIZE):
+        self.filename=filename
+        self.shape=tuple(shape)
+        self.dtype=recordType(*self.shape)
+        self.chunk=np.zeros(chunksize,self.dtype)
+        self.numBuffered=0
+        self.numFrames=0
+        self.fileobj=open(filename,'ab+')
+
+        if self.fileobj.tell()==0:
+            self.created=time.time()
+            self.fileobj.write(HEADER.pack(MAGIC,VERSION,self.shape[0],self.shape[1],self.created).ljust(HEADERSIZE,b'\0'))
+        else:
+            self.fileobj.seek(0)
+            height,width,self.created=readHeader(self.fileobj)
+            if (height,width)!=self.shape:
+                raise IOError('Recording %r has frames of shape %r'%(filename,(height,width)))
+
+            # drop a partly written final record so new records stay aligned
+            size=os.path.getsize(filename)
+            self.fileobj.truncate(size-(size-HEADERSIZE)%self.dtype.itemsize)
+
+    def write(self,frame,timestamp):
+        '''Append `frame' with time `timestamp', in seconds in any clock since replay only uses the differences.'''
+        record=self.chunk[self.numBuffered]
+        record['time']=timestamp
+        record['frame']=frame
+        self.numBuffered+=1
+        self.numFrames+=1
+
+        if self.numBuffered==len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        '''Write the buffered records to the file.'''
+        if self.numBuffered>0:
+            self.fileobj.write(self.chunk[:self.numBuffered].tobytes())
+            self.fileobj.flush()
+            self.numBuffered=0
+
+    def close(self):
+        self.flush()
+        self.fileobj.close()
+
+
+class FrameReader(object):
+    '''
+    Reads the recording `filename' as a read-only memory map. The `frames' member is a (N,height,width) float16 view and
+    `times' the (N,) timestamps, neither of which copy the file's data.
+    '''
+    def __init__(self,filename):
+        self.filename=filename
+        with open(filename,'rb') as o:
+            height,width,self.created=readHeader(o)
+
+        self.shape=(height,width)
+        self.dtype=recordType(height,width)
+        num=(os.path.getsize(filename)-HEADERSIZE)//self.dtype.itemsize
+
+        if num>0:
+            self.records=np.memmap(filename,self.dtype,'r',HEADERSIZE,(num,))
+        else: # memory maps can't be empty
+            self.records=np.zeros(0,self.dtype)
+
+        self.frames=self.records['frame']
+        self.times=self.records['time']
+
+    def __len__(self):
+        return len(self.records)
+
+    def duration(self):
+        '''Returns the seconds between the first and last frames.'''
+        return float(self.times[-1]-self.times[0]) if len(self)>1 else 0.0
+
+
+class ReplayThread(threading.Thread):
+    '''
+    Replays the recording `filename' into the double buffer `frames' with the original timing sped up by `speed', in
+    place of an AcquisitionThread so the display loop is unchanged. If `loop' is True replay restarts from the beginning
+    when the end is reached, otherwise `finished' is set to True and the thread stops.
+    '''
+    def __init__(self,filename,speed=1.0,loop=False):
+        threading.Thread.__init__(self)
+        self.reader=FrameReader(filename)
+        self.speed=speed
+        self.loop=loop
+        self.frames=DoubleBuffer(self.reader.shape)
+        self.numFrames=0
+        self.doRun=True
+        self.finished=False
+        self.exc=None
+        self.daemon=True
+
+    def stop(self):
+        self.doRun=False
+
+    def run(self):
+        times=self.reader.times
+
+        try:
+            while self.doRun and len(times)>0:
+                start=time.monotonic()
+                for i in range(len(times)):
+                    delay=start+(times[i]-times[0])/self.speed-time.monotonic()
+                    if delay>0:
+                        time.sleep(delay)
+                    if not self.doRun:
+                        break
+
+                    self.frames.write(self.reader.frames[i],time.monotonic())
+                    self.numFrames+=1
+
+                if not self.loop:
+                    break
+        except Exception as e:
+            self.exc=e
+
+        self.finished=True
+
+
+if __name__=='__main__':
+    import argparse
+    parser=argparse.ArgumentParser(description='Print a summary of frame recordings')
+    parser.add_argument('recordings',nargs='+',help='Recording files')
+    args=parser.parse_args()
+
+    for filename in args.recordings:
+        reader=FrameReader(filename)
+        created=time.strftime('%Y-%m-%d %H:%M:%S',time.localtime(reader.created))
+        print('%s: created %s, %i frames over %.1fs'%(filename,created,len(reader),reader.duration()))
+        if len(reader):
+            print('  temperatures %.2f to %.2f'%(reader.frames.min(),reader.frames.max()))
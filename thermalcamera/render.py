@@ -0,0 +1,163 @@
+'''
+Rendering of thermal camera frames. Colormaps are converted once into 256 entry lookup tables and images are upscaled
+with precomputed interpolation matrices, so rendering a frame is two small matrix products, a quantization to byte
+indices, and a table lookup into reused buffers laid out for pygame.surfarray, with nothing allocated per frame.
+'''
+
+import numpy as np
+
+LUTSIZE=256
+
+
+def makeLUT(name,size=LUTSIZE):
+    '''
+    Returns a (size,3) uint8 lookup table of the colors of the matplotlib colormap `name', giving the same colors as
+    calling the colormap on unit values and scaling to bytes when indexed by `quantize'. Matplotlib is only imported here.
+    '''
+    import matplotlib
+    try:
+        cmap=matplotlib.colormaps[name].resampled(size)
+    except AttributeError: # matplotlib older than 3.6
+        from matplotlib import cm
+        cmap=cm.get_cmap(name,size)
+
+    return (cmap(np.linspace(0,1,size))[:,:3]*255).astype(np.uint8)
+
+
+def bilinearKernel(x):
+    '''Triangle kernel for bilinear resampling.'''
+    return np.maximum(1-np.abs(x),0.0)
+
+
+def bicubicKernel(x,a=-0.5):
+    '''Cubic convolution kernel with parameter `a', as used by PIL for bicubic resampling.'''
+    x=np.abs(x)
+    return np.where(x<1,((a+2)*x-(a+3))*x*x+1,np.where(x<2,(((x-5)*x+8)*x-4)*a,0.0))
+
+
+def lanczosKernel(x,a=3):
+    '''Lanczos kernel with `a' lobes.'''
+    return np.where(np.abs(x)<a,np.sinc(x)*np.sinc(x/a),0.0)
+
+
+# interpolation kernels and their supports by name
+KERNELS={'bilinear':(bilinearKernel,1.0),'bicubic':(bicubicKernel,2.0),'lanczos':(lanczosKernel,3.0)}
+
+
+def interpMatrix(insize,outsize,kernel='bicubic'):
+    '''
+    Returns the (outsize,insize) matrix resampling a dimension of length `insize' to `outsize' with the kernel named
+    `kernel' in KERNELS, computed as PIL does with pixel centers aligned and weights normalized at the edges.
+    '''
+    kernel,support=KERNELS[kernel]
+    mat=np.zeros((outsize,insize))
+    scale=insize/outsize
+    filterscale=max(scale,1.0)
+    support*=filterscale
+
+    for i in range(outsize):
+        center=(i+0.5)*scale
+        xmin=max(int(center-support+0.5),0)
+        xmax=min(int(center+support+0.5),insize)
+        weights=kernel((np.arange(xmin,xmax)-center+0.5)/filterscale)
+        mat[i,xmin:xmax]=weights/weights.sum()
+
+    return mat
+
+
+def quantize(im,out,work=None):
+    '''
+    Quantize the image `im', with values scaled by LUTSIZE from unit values, into the uint8 array `out' as lookup table
+    indices, truncating as matplotlib does when indexing colormaps. The array `work' is used as scratch space if given.
+    '''
+    work=np.empty(im.shape) if work is None else work
+    np.clip(im,0,LUTSIZE-1,out=work)
+    np.copyto(out,work,casting='unsafe')
+    return out
+
+
+class FrameRenderer(object):
+    '''
+    Renders unit valued images of shape `inshape' at shape `outshape' colored with the lookup tables built for the
+    colormaps named in `cmaps', interpolating with the kernel named `kernel' in KERNELS. Rendered images are kept as
+    lookup table indices in (x,y) order as pygame.surfarray uses, then drawn to `surface' with the tables converted to
+    its pixel format, or converted to RGB for saving. Only the region which differs from the image last drawn is drawn.
+    This can be the last stage of a pipeline.Pipeline.
+    '''
+    name='render'
+
+    def __init__(self,inshape,outshape,cmaps,surface=None,kernel='bicubic'):
+        self.inshape=tuple(inshape)
+        self.outshape=tuple(outshape)
+        self.surface=surface
+        self.kernel=kernel
+        self.luts=[makeLUT(c) for c in cmaps]
+        self.mapIndex=0 # colormap of the last rendered image
+
+        # scaled images are computed transposed, the row matrix includes scaling to the lookup table range
+        self.cols=interpMatrix(self.inshape[1],self.outshape[1],kernel)
+        self.rowsT=np.ascontiguousarray(interpMatrix(self.inshape[0],self.outshape[0],kernel).T*LUTSIZE)
+        self.partial=np.empty((self.outshape[1],self.inshape[0])) # image scaled along columns only
+        self.scaled=np.empty(self.outshape[::-1]) # fully scaled image
+        self.index=np.zeros(self.outshape[::-1],np.uint8) # lookup table indices of the scaled image
+
+        if surface is not None:
+            self.pixelLUTs=[np.array([surface.map_rgb(*map(int,c)) for c in lut],np.uint32) for lut in self.luts]
+            self.pixels=np.empty(self.outshape[::-1],np.uint32)
+            self.drawn=np.zeros_like(self.index) # indices of the image last drawn
+            self.drawnMap=None # colormap of the image last drawn, None if nothing has been drawn
+            self.changed=np.zeros(self.index.shape,bool) # scratch space for the pixels differing from those drawn
+
+    def render(self,im,mapIndex=None):
+        '''Render the unit valued image `im' with the colormap indexed `mapIndex', or the last used if None.'''
+        np.dot(self.cols,im.T,out=self.partial)
+        np.dot(self.partial,self.rowsT,out=self.scaled)
+        quantize(self.scaled,self.index,self.scaled)
+        if mapIndex is not None:
+            self.mapIndex=mapIndex
+
+        return self.index
+
+    process=render
+
+    def changedRegion(self):
+        '''Returns the (x0,y0,x1,y1) box containing the pixels differing from the image last drawn, None if none do.'''
+        if self.drawnMap!=self.mapIndex:
+            return (0,0)+self.index.shape
+
+        np.not_equal(self.index,self.drawn,out=self.changed)
+        cols=np.flatnonzero(self.changed.any(1))
+        if len(cols)==0:
+            return None
+
+        rows=np.flatnonzero(self.changed[cols[0]:cols[-1]+1].any(0))
+        return cols[0],rows[0],cols[-1]+1,rows[-1]+1
+
+    def draw(self,force=False):
+        '''
+        Draw the region of the last rendered image which differs from the image last drawn to the surface, or all of it
+        if `force' is True. Returns the pygame.Rect drawn to in display coordinates for pygame.display.update, or None.
+        '''
+        import pygame
+
+        region=(0,0)+self.index.shape if force else self.changedRegion()
+        if region is None:
+            return None
+
+        x0,y0,x1,y1=map(int,region)
+        np.take(self.pixelLUTs[self.mapIndex],self.index[x0:x1,y0:y1],out=self.pixels[x0:x1,y0:y1])
+        pygame.surfarray.blit_array(self.surface.subsurface((x0,y0,x1-x0,y1-y0)),self.pixels[x0:x1,y0:y1])
+        self.drawn[x0:x1,y0:y1]=self.index[x0:x1,y0:y1]
+        self.drawnMap=self.mapIndex
+
+        ox,oy=self.surface.get_abs_offset()
+        return pygame.Rect(x0+ox,y0+oy,x1-x0,y1-y0)
+
+    def toRGB(self):
+        '''Returns the last rendered image as a (width,height,3) RGB array.'''
+        return self.luts[self.mapIndex][self.index]
+
+    def toImage(self):
+        '''Returns the last rendered image as a PIL image for saving.'''
+        from PIL import Image
+        return Image.fromarray(np.ascontiguousarray(self.toRGB().transpose(1,0,2)))
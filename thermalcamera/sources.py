@@ -0,0 +1,141 @@
+'''
+Frame sources for the thermal camera. Frames are read from the sensor by an acquisition thread at the sensor's frame
+rate into a double buffer, so the display loop never waits on I2C and only renders when a new frame has arrived. A
+simulated AMG88XX provides frames without the hardware.
+'''
+
+import time
+import threading
+
+import numpy as np
+
+SENSORRATE=10 # frames per second of the AMG8833
+WIDTH=8
+HEIGHT=8
+
+
+class FakeAMG88XX(object):
+    '''
+    Simulated AMG88XX with the `pixels' and `temperature' attributes of adafruit_amg88xx.AMG88XX. The scene is a warm
+    object moving in front of a room temperature background with sensor noise, changing at `rate' frames per second
+    so reading faster returns the same frame again, and each read takes `latency' seconds as reading over I2C does.
+    '''
+    def __init__(self,rate=SENSORRATE,latency=0.003,seed=None):
+        self.rate=rate
+        self.latency=latency
+        self.seed=np.random.SeedSequence(seed).entropy
+        self.start=time.monotonic()
+        self.y,self.x=np.mgrid[:HEIGHT,:WIDTH]
+
+    @property
+    def temperature(self):
+        return 24.0
+
+    def frame(self,index,noise=True):
+        '''Returns frame number `index' as an array, without sensor noise or quantization if `noise' is False.'''
+        t=index/self.rate
+        cx=WIDTH/2+2.5*np.cos(t*0.7)
+        cy=HEIGHT/2+2.5*np.sin(t*0.5)
+        im=22+14*np.exp(-((self.x-cx)**2+(self.y-cy)**2)/4.0)
+
+        if noise:
+            im+=np.random.default_rng([index,self.seed]).normal(0,0.5,im.shape)
+            im=np.round(im*4)/4 # sensor resolution is 0.25C
+
+        return im
+
+    @property
+    def pixels(self):
+        time.sleep(self.latency)
+        return self.frame(int((time.monotonic()-self.start)*self.rate)).tolist()
+
+
+class DoubleBuffer(object):
+    '''
+    Double buffer of frames of shape `shape' with one writer and any number of readers, without locks. The writer fills
+    the back buffer then publishes it with its sequence number and timestamp in a single assignment. Readers copy the
+    published buffer and retry if it was reused for a newer frame while copying, which only happens if copying takes
+    longer than a frame period.
+    '''
+    def __init__(self,shape=(HEIGHT,WIDTH),dtype=np.float32):
+        self.buffers=[np.zeros(shape,dtype),np.zeros(shape,dtype)]
+        self.seqs=[0,0] # sequence number of the frame in each buffer, -1 while being written
+        self.latest=(0,0.0,0) # sequence number, timestamp, and buffer index of the latest frame
+        self.event=threading.Event() # set when a frame is published
+
+    def write(self,frame,timestamp):
+        '''Publish `frame' with time `timestamp' as the next frame, for use by the writer thread only.'''
+        seq,_,front=self.latest
+        back=1-front
+        self.seqs[back]=-1
+        self.buffers[back][...]=frame
+        self.seqs[back]=seq+1
+        self.latest=(seq+1,timestamp,back)
+        self.event.set()
+
+    def read(self,out):
+        '''Copy the latest frame into `out', returning its sequence number and timestamp, 0 if there are no frames yet.'''
+        while True:
+            seq,timestamp,index=self.latest
+            out[...]=self.buffers[index]
+            if self.seqs[index]==seq:
+                return seq,timestamp
+
+    def wait(self,seq,timeout=None):
+        '''Wait until a frame newer than sequence number `seq' is published, returns False if `timeout' passes first.'''
+        if self.latest[0]!=seq:
+            return True
+
+        self.event.clear()
+        if self.latest[0]!=seq: # published between the check and clearing
+            return True
+
+        return self.event.wait(timeout)
+
+
+class AcquisitionThread(threading.Thread):
+    '''
+    Reads frames from `sensor' at `rate' frames per second into the double buffer `frames', timestamped with the
+    monotonic clock time each was read. If reading falls behind the schedule is reset rather than reading faster to
+    catch up, since the sensor can't produce frames any faster. If `recorder' is given, a recording.FrameRecorder, each
+    frame is also written to it, which is closed when the thread stops.
+    '''
+    def __init__(self,sensor,rate=SENSORRATE,recorder=None):
+        threading.Thread.__init__(self)
+        self.sensor=sensor
+        self.rate=rate
+        self.frames=DoubleBuffer()
+        self.recorder=recorder
+        self.numFrames=0
+        self.doRun=True
+        self.exc=None # exception raised reading the sensor
+        self.daemon=True
+
+    def stop(self):
+        self.doRun=False
+
+    def run(self):
+        period=1.0/self.rate
+        nextTime=time.monotonic()
+
+        try:
+            while self.doRun:
+                frame=self.sensor.pixels
+                timestamp=time.monotonic()
+                self.frames.write(frame,timestamp)
+                self.numFrames+=1
+
+                if self.recorder is not None:
+                    self.recorder.write(frame,timestamp)
+
+                nextTime+=period
+                delay=nextTime-time.monotonic()
+                if delay>0:
+                    time.sleep(delay)
+                else:
+                    nextTime=time.monotonic()
+        except Exception as e:
+            self.exc=e
+        finally:
+            if self.recorder is not None:
+                self.recorder.close()
@@ -12,26 +12,31 @@ import time
 import datetime
 
 import pygame
-from PIL import Image
 import numpy as np
-import matplotlib.pyplot as plt
 #from Adafruit_AMG88xx import Adafruit_AMG88xx
 from gpiozero import Button
 
-
-import busio
-import board
-import adafruit_amg88xx
+from render import FrameRenderer
+from pipeline import TemporalFilter, AutoRange, Pipeline
+from sources import FakeAMG88XX, AcquisitionThread, SENSORRATE
+from recording import FrameRecorder, ReplayThread, EXTENSION
 
 MINTEMP=0
 MAXTEMP=80
 WIDTH=8
 HEIGHT=8
-
-# rescale mode for camera values
+FILTERMODE='kalman' # temporal noise filter, 'ema' or 'kalman'
+INTERPOLATION='bicubic' # image upscaling, 'bilinear', 'bicubic', or 'lanczos'
+FAKESENSOR=os.environ.get('FAKESENSOR','')=='1' # set FAKESENSOR=1 to use a simulated sensor without the hardware
+RECORD=os.environ.get('RECORD','')=='1' # set RECORD=1 to record raw frames to a file named like screenshots
+REPLAY=os.environ.get('REPLAY','') # set REPLAY to a recording's filename to display it instead of the sensor
+REPLAYSPEED=float(os.environ.get('REPLAYSPEED','1')) # replay speed relative to the original
+LABELCACHESIZE=256 # number of rendered min/max labels to keep
+
+# rescale mode for camera values, (None,None) tracks the minimum and maximum
 ranges=[(None,None),(MINTEMP,MAXTEMP-40),(MINTEMP,MAXTEMP),(MINTEMP+15,MAXTEMP-40),(MINTEMP+20,MAXTEMP)]
 
-# color maps from matplotlib
+# color maps from matplotlib, converted to lookup tables at startup
 cmaps=['inferno','gist_heat','hot','bwr','coolwarm','gist_rainbow','gray']
 
 doRun=True # loop condition
@@ -55,23 +60,18 @@ def toggleMaps():
     mapMode=(mapMode+1)%len(cmaps)
 
 
-def rescaleMode(im,mode):
-    '''
-    Rescale the input image `im' to unit values based on `mode': if 0 then rescale from minimum to maximum, otherwise
-    rescale by indexed range in ranges.
-    '''
-    if mode==0:
-        #minv=im.min()
-        #maxv=im.max()
-        minv,maxv=np.percentile(im,[0,100])
-    else:
-        minv,maxv=ranges[mode]
+def renderLabel(minp,maxp):
+    '''Returns the rendered min/max label, which is cached for each text since the values change slowly.'''
+    text='Min: %.2i Max: %.2i'%(minp,maxp)
+    label=labelCache.get(text)
     
-    # rescale image to unit values (pixels values between 0 and 1) based on the given minv and maxv thresholds
-    if maxv>minv:
-        im=(im-minv)/(maxv-minv)
+    if label is None:
+        if len(labelCache)>=LABELCACHESIZE:
+            labelCache.clear()
+            
+        label=labelCache[text]=font.render(text, 1, (255,255,255))
         
-    return np.clip(im,0,1),minv,maxv
+    return label
 
 
 def save():
@@ -91,9 +91,30 @@ mapbutton.when_pressed=toggleMaps
 savebutton=Button(27)
 savebutton.when_pressed=save
 
-#sensor = Adafruit_AMG88xx()
-i2c = busio.I2C(board.SCL, board.SDA)
-sensor = adafruit_amg88xx.AMG88XX(i2c)
+if REPLAY:
+    sensor=None
+elif FAKESENSOR:
+    sensor=FakeAMG88XX()
+else:
+    import busio
+    import board
+    import adafruit_amg88xx
+    
+    #sensor = Adafruit_AMG88xx()
+    i2c = busio.I2C(board.SCL, board.SDA)
+    sensor = adafruit_amg88xx.AMG88XX(i2c)
+
+# frames are read in a separate thread at the sensor's rate so reading and rendering don't hold each other up
+if REPLAY:
+    acquisition=ReplayThread(REPLAY,REPLAYSPEED,True)
+else:
+    recorder=None
+    if RECORD:
+        recorder=FrameRecorder(datetime.datetime.now().strftime('IR_%Y%m%d_%H%M%S'+EXTENSION))
+        
+    acquisition=AcquisitionThread(sensor,SENSORRATE,recorder)
+    
+acquisition.start()
 
 #os.putenv('SDL_FBDEV', '/dev/fb0')
 os.environ['SDL_FBDEV']=os.environ.get('SDL_FBDEV','/dev/fb0')
@@ -108,34 +129,66 @@ pygame.mouse.set_visible(False)
 #pixels=basebuffer.reshape((WIDTH,HEIGHT))
 #pixels=np.rot90(pixels,3)
 pixels=np.zeros((WIDTH,HEIGHT), dtype=np.float64)
+raw=np.zeros((HEIGHT,WIDTH), dtype=np.float32) # frame as read from the sensor
+seq=0 # sequence number of the last frame displayed
+minp,maxp=0,0 # range of the last frame displayed
                 
 mindim=min(*surf.get_size())
 
+imsurf=surf.subsurface((0,0,mindim,mindim)) # region of the display the image is drawn to
+renderer=FrameRenderer(pixels.shape,(mindim,mindim),cmaps,imsurf,INTERPOLATION)
+autorange=AutoRange(pixels.shape,ranges,rangeMode)
+pipeline=Pipeline([TemporalFilter(pixels.shape,FILTERMODE),autorange,renderer])
+
+labelCache={} # rendered labels by text
+label=None # label currently shown
+labelRect=pygame.Rect(mindim+15,15,0,0) # region of the display the label covers
+dirty=[surf.get_rect()] # regions of the display changed since the last update
+
+surf.fill((0,0,0))
+
 while(doRun):
     if saveShot==0: # display output from camera
-        cm = plt.get_cmap(cmaps[mapMode])
-        
+        if not acquisition.frames.wait(seq,0.5): # sleep until the next frame arrives
+            if acquisition.exc is not None: # reading failed, raise the error here rather than showing the last frame
+                raise acquisition.exc
+            elif not acquisition.is_alive():
+                raise RuntimeError('Frame acquisition stopped')
+                
+            continue
+            
         #basebuffer[:]=sensor.readPixels()
-        pixels[:,:]=np.rot90(np.asarray(sensor.pixels),3)
-        im,minp,maxp=rescaleMode(pixels,rangeMode)
-        im=cm(im)
-        
-        im=Image.fromarray((im[...,:3]*255).astype(np.uint8))
-        im = im.resize((mindim,mindim), Image.BICUBIC)
+        seq,timestamp=acquisition.frames.read(raw)
+        pixels[:,:]=np.rot90(raw,3)
+        autorange.mode=rangeMode
+        renderer.mapIndex=mapMode
+        pipeline.process(pixels)
+        minp,maxp=autorange.minv,autorange.maxv
     
     elif saveShot==1: # capture output from camera to file
         saveShot=2 # change state to wait with current image
         filename=datetime.datetime.now().strftime('IR_%Y%m%d_%H%M%S.png')
-        im.save(filename)
+        renderer.toImage().save(filename)
     else: # display captured file until button pressed again
         time.sleep(0.5)
     
-    pim = pygame.image.fromstring(im.tobytes(),im.size,im.mode)
-    label = font.render('Min: %.2i Max: %.2i'%(minp,maxp), 1, (255,255,255))
+    drawn=renderer.draw()
+    if drawn:
+        dirty.append(drawn)
+        
+    newLabel=renderLabel(minp,maxp)
+    if newLabel is not label: # clear the old label and draw the new one
+        surf.fill((0,0,0),labelRect)
+        dirty.append(labelRect)
+        label=newLabel
+        labelRect=surf.blit(label, (mindim+15, 15))
+        dirty.append(labelRect)
     
-    surf.fill((0,0,0))
-    surf.blit(pim,(0,0))    
-    surf.blit(label, (mindim+15, 15))
+    # only send changed regions to the display, nothing at all if the frame and label are unchanged
+    if dirty:
+        pygame.display.update(dirty)
+        dirty=[]
     
-    pygame.display.update()
+acquisition.stop()
+acquisition.join(1) # wait for the recording to be closed
     